@@ -15,32 +15,146 @@ Version: 4.0
 
 import os
 import sys
-from pathlib import Path
+from functools import lru_cache
+from types import SimpleNamespace
 
-# Try to import python-dotenv
-try:
-    from dotenv import load_dotenv
-    # Load environment variables from .env file
-    load_dotenv()
-except ImportError:
-    print("Warning: python-dotenv not installed. Using system environment variables only.")
-    print("Install with: pip install python-dotenv")
+# Settings read from the environment on first access (see __getattr__ below)
+_LAZY_SETTINGS = ("GEMINI_API_KEY", "EMAIL_CONFIG", "GEMINI_CONFIG", "APP_CONFIG")
+
+@lru_cache(maxsize=None)
+def _environment():
+    """
+    Load the .env file and take a snapshot of the environment, once.
+    
+    Returns:
+        dict: Copy of os.environ after loading .env
+    """
+    # Try to import python-dotenv
+    try:
+        from dotenv import load_dotenv
+        # Load environment variables from .env file
+        load_dotenv()
+    except ImportError:
+        print("Warning: python-dotenv not installed. Using system environment variables only.")
+        print("Install with: pip install python-dotenv")
+    
+    return dict(os.environ)
+
+def _get(key, default):
+    """Read a setting from the environment snapshot."""
+    return _environment().get(key, default)
+
+def _get_int(key, default):
+    """Read an integer setting from the environment snapshot."""
+    return int(_get(key, default))
+
+def _get_float(key, default):
+    """Read a float setting from the environment snapshot."""
+    return float(_get(key, default))
+
+@lru_cache(maxsize=None)
+def _load():
+    """
+    Read all settings, once.
+    
+    Deferred until a setting is first used so that importing config
+    does not pay for dotenv parsing up front.
+    """
+    settings = SimpleNamespace()
+    
+    # Your Gemini API key from Google AI Studio
+    # To obtain a key:
+    # 1. Visit https://aistudio.google.com/
+    # 2. Sign in with your Google account
+    # 3. Navigate to API access and create a new key
+    settings.GEMINI_API_KEY = _get("GEMINI_API_KEY", "your_gemini_api_key_here")
+    
+    # Email configuration
+    # For Gmail:
+    # - You'll need to set up an "App Password" in your Google account security settings
+    # - Do not use your regular Gmail password
+    settings.EMAIL_CONFIG = {
+        "smtp_server": _get("SMTP_SERVER", "smtp.gmail.com"),
+        "smtp_port": _get_int("SMTP_PORT", "587"),
+        "imap_server": _get("IMAP_SERVER", "imap.gmail.com"),
+        "imap_port": _get_int("IMAP_PORT", "993"),
+        "email_address": _get("EMAIL_ADDRESS", "your.email@gmail.com"),
+        "email_password": _get("EMAIL_PASSWORD", "your_app_password_here")
+    }
+    
+    # Gemini API configuration
+    # These settings control how the AI generates responses
+    settings.GEMINI_CONFIG = {
+        "model": _get("GEMINI_MODEL", "gemini-2.0-flash"),
+        "temperature": _get_float("GEMINI_TEMPERATURE", "0.7"),
+        "max_output_tokens": _get_int("MAX_OUTPUT_TOKENS", "1024"),
+        # Longer email bodies are trimmed to keep the prompt within this budget
+        "max_input_tokens": _get_int("MAX_INPUT_TOKENS", "8000"),
+        "top_p": _get_float("TOP_P", "0.95"),
+        "top_k": _get_int("TOP_K", "40"),
+        "max_requests_per_minute": _get_int("GEMINI_MAX_RPM", "60"),
+        # Parallel requests in GeminiEmailResponder.generate_batch
+        "batch_workers": _get_int("GEMINI_BATCH_WORKERS", "8"),
+        # Seconds to wait for a Gemini Batch API job before answering directly
+        "batch_job_timeout": _get_int("GEMINI_BATCH_JOB_TIMEOUT", "900"),
+        # Reuse responses for identical emails. A switch for development and
+        # evaluation runs over the same emails, off in production
+        "response_cache": _get("RESPONSE_CACHE", "False").lower() == "true",
+        "response_cache_file": _get("RESPONSE_CACHE_FILE", "response_cache.db"),
+        # Reuse responses for near-duplicate emails (needs sentence-transformers).
+        # Off by default: a similar email from another customer can get a
+        # response with their order numbers, dates or amounts
+        "semantic_cache": _get("SEMANTIC_CACHE", "False").lower() == "true",
+        "semantic_cache_threshold": _get_float("SEMANTIC_CACHE_THRESHOLD", "0.92"),
+        "semantic_cache_file": _get("SEMANTIC_CACHE_FILE", "semantic_cache.npz"),
+        # ONNX export of the embedding model (needs onnxruntime and tokenizers), e.g.
+        # optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 minilm/
+        # then int8-quantized with onnxruntime.quantization.quantize_dynamic
+        "semantic_cache_onnx_model": _get("SEMANTIC_CACHE_ONNX_MODEL", "")
+    }
+    
+    # Application settings
+    settings.APP_CONFIG = {
+        "check_interval": _get_int("EMAIL_CHECK_INTERVAL", "10"),  # seconds
+        "fetch_limit": _get_int("EMAIL_FETCH_LIMIT", "5"),
+        "debug_mode": _get("DEBUG_MODE", "False").lower() == "true",
+        "log_file": _get("LOG_FILE", "email_automation.log")
+    }
+    
+    # Display configuration status (only in debug mode)
+    if settings.APP_CONFIG["debug_mode"]:
+        print("\n🔧 Debug Mode: Configuration Status")
+        print("=" * 50)
+        print(f"API Key Configured: {'✅' if not settings.GEMINI_API_KEY.startswith('your_') else '❌'}")
+        print(f"Email Configured: {'✅' if not settings.EMAIL_CONFIG['email_address'].startswith('your.') else '❌'}")
+        print(f"Model: {settings.GEMINI_CONFIG['model']}")
+        print(f"Temperature: {settings.GEMINI_CONFIG['temperature']}")
+        print("=" * 50)
+    
+    return settings
+
+def __getattr__(name):
+    """Resolve settings lazily on first access (PEP 562)."""
+    if name in _LAZY_SETTINGS:
+        return getattr(_load(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Security check function
 def check_configuration():
     """Check if configuration is properly set up"""
+    env = _environment()
     issues = []
     
     # Check API key
-    if os.getenv("GEMINI_API_KEY", "").startswith("your_"):
+    if env.get("GEMINI_API_KEY", "").startswith("your_"):
         issues.append("❌ GEMINI_API_KEY not configured in .env file")
     
     # Check email configuration
-    if os.getenv("EMAIL_ADDRESS", "").endswith("@gmail.com"):
-        if os.getenv("EMAIL_ADDRESS") == "your.email@gmail.com":
+    if env.get("EMAIL_ADDRESS", "").endswith("@gmail.com"):
+        if env.get("EMAIL_ADDRESS") == "your.email@gmail.com":
             issues.append("❌ EMAIL_ADDRESS not configured in .env file")
     
-    if len(os.getenv("EMAIL_PASSWORD", "")) != 16:
+    if len(env.get("EMAIL_PASSWORD", "")) != 16:
         issues.append("❌ EMAIL_PASSWORD should be a 16-character App Password")
     
     if issues:
@@ -55,38 +169,8 @@ def check_configuration():
         return False
     return True
 
-# Your Gemini API key from Google AI Studio
-# To obtain a key:
-# 1. Visit https://aistudio.google.com/
-# 2. Sign in with your Google account
-# 3. Navigate to API access and create a new key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your_gemini_api_key_here")
-
-# Email configuration
-# For Gmail:
-# - You'll need to set up an "App Password" in your Google account security settings
-# - Do not use your regular Gmail password
-EMAIL_CONFIG = {
-    "smtp_server": os.getenv("SMTP_SERVER", "smtp.gmail.com"),
-    "smtp_port": int(os.getenv("SMTP_PORT", "587")),
-    "imap_server": os.getenv("IMAP_SERVER", "imap.gmail.com"),
-    "imap_port": int(os.getenv("IMAP_PORT", "993")),
-    "email_address": os.getenv("EMAIL_ADDRESS", "your.email@gmail.com"),
-    "email_password": os.getenv("EMAIL_PASSWORD", "your_app_password_here")
-}
-
-# Gemini API configuration
-# These settings control how the AI generates responses
-GEMINI_CONFIG = {
-    "model": os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
-    "temperature": float(os.getenv("GEMINI_TEMPERATURE", "0.7")),
-    "max_output_tokens": int(os.getenv("MAX_OUTPUT_TOKENS", "1024")),
-    "top_p": float(os.getenv("TOP_P", "0.95")),
-    "top_k": int(os.getenv("TOP_K", "40"))
-}
-
 # Email categories for response customization
-EMAIL_CATEGORIES = [
+EMAIL_CATEGORIES = (
     "complaint",          # Customer expressing dissatisfaction
     "product_support",    # Technical questions or issues
     "feature_request",    # Suggestions for new features
@@ -95,31 +179,14 @@ EMAIL_CATEGORIES = [
     "urgent_request",     # Time-sensitive matters
     "spam",               # Potential spam or irrelevant messages
     "customer_inquiry"    # General product or service questions
-]
-
-# Application settings
-APP_CONFIG = {
-    "check_interval": int(os.getenv("EMAIL_CHECK_INTERVAL", "10")),  # seconds
-    "fetch_limit": int(os.getenv("EMAIL_FETCH_LIMIT", "5")),
-    "debug_mode": os.getenv("DEBUG_MODE", "False").lower() == "true",
-    "log_file": os.getenv("LOG_FILE", "email_automation.log")
-}
-
-# Display configuration status (only in debug mode)
-if APP_CONFIG["debug_mode"]:
-    print("\n🔧 Debug Mode: Configuration Status")
-    print("=" * 50)
-    print(f"API Key Configured: {'✅' if not GEMINI_API_KEY.startswith('your_') else '❌'}")
-    print(f"Email Configured: {'✅' if not EMAIL_CONFIG['email_address'].startswith('your.') else '❌'}")
-    print(f"Model: {GEMINI_CONFIG['model']}")
-    print(f"Temperature: {GEMINI_CONFIG['temperature']}")
-    print("=" * 50)
+)
 
 # Run configuration check when module is imported
 if __name__ == "__main__":
     if check_configuration():
+        settings = _load()
         print("✅ Configuration looks good!")
-        print(f"   Email: {EMAIL_CONFIG['email_address']}")
-        print(f"   Model: {GEMINI_CONFIG['model']}")
+        print(f"   Email: {settings.EMAIL_CONFIG['email_address']}")
+        print(f"   Model: {settings.GEMINI_CONFIG['model']}")
     else:
-        sys.exit(1)
+        sys.exit(1)
\ No newline at end of file
@@ -9,266 +9,511 @@ Author: Linda Marin and Sawsan Abdulbari for HAMK Digital and Social Media Analy
 Date: August 2025
 """
 
+import hashlib
 import re
-from typing import List, Tuple, Dict
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Tuple, Dict, Set, Optional
 
-class EmailFilter:
+# Optional: pyahocorasick scans for all spam terms in a single pass.
+# Without it we fall back to one substring search per term.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Optional: google-re2 matches in guaranteed linear time, which protects the
+# backtracking-prone sender patterns (".*@.*paypal\..*") from crafted input.
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Engine used for the sender patterns
+_sender_re = re2 if re2 is not None else re
+
+# Most recent should_skip_email verdicts kept (least recently used go first)
+_VERDICT_CACHE_SIZE = 4096
+_verdict_cache = OrderedDict()
+_verdict_lock = threading.Lock()
+
+
+def _build_automaton(terms):
+    """Build an Aho-Corasick automaton for the given terms (None if unavailable)."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for term in terms:
+        automaton.add_word(term, term)
+    automaton.make_automaton()
+    return automaton
+
+
+# Known no-reply patterns
+NO_REPLY_PATTERNS = (
+    r'noreply@.*',
+    r'no-reply@.*',
+    r'donotreply@.*',
+    r'do-not-reply@.*',
+    r'notifications@.*',
+    r'alerts@.*',
+    r'automated@.*',
+    r'system@.*',
+    r'mailer-daemon@.*',
+    r'postmaster@.*'
+)
+
+# Suspicious sender patterns (potential phishing)
+SUSPICIOUS_SENDERS = (
+    r'.*@.*paypal\..*',  # PayPal phishing (unless from paypal.com)
+    r'.*@.*banking\..*',
+    r'.*@.*amazon\..*',  # Amazon phishing (unless from amazon.com)
+    r'.*@.*ebay\..*',    # eBay phishing (unless from ebay.com)
+    r'.*@.*lottery\..*',
+    r'.*@.*winner\..*',
+    r'.*@.*prize\..*',
+    r'.*@.*kilpailu\..*',  # Finnish contest/lottery
+    r'.*@.*arvonta\..*',   # Finnish lottery
+    r'.*voita@.*',         # Finnish "win" emails
+)
+
+# Whitelisted domains (legitimate companies)
+WHITELIST_DOMAINS = (
+    'paypal.com',
+    'amazon.com',
+    'amazon.co.uk',
+    'ebay.com',
+    'google.com',
+    'microsoft.com',
+    'apple.com',
+    'facebook.com',
+    'linkedin.com'
+)
+
+# Spam keywords in subject or body
+SPAM_KEYWORDS = (
+    # Financial scams
+    'lottery', 'winner', 'million dollars', 'inheritance', 'bitcoin',
+    'investment opportunity', 'claim your', 'free money', 'jackpot',
+    'casino', 'get rich', 'earn money fast', 'prize winner',
+    
+    # Finnish spam
+    'voita', 'arvonta', 'kilpailu', 'ilmainen', 'voittaja',
+    
+    # Urgency scams
+    'act now', 'limited time', 'expires today', 'urgent action required',
+    
+    # Phishing attempts
+    'verify your account', 'suspended account', 'click here immediately',
+    'confirm your identity', 'update payment information',
+    
+    # Adult content
+    'xxx', 'adult', 'singles', 'dating',
+    
+    # Pharmaceuticals
+    'viagra', 'cialis', 'pharmacy', 'pills', 'medication'
+)
+
+# Attachment types often used to deliver malware
+SUSPICIOUS_EXTENSIONS = ('.exe', '.zip', '.rar', '.bat', '.cmd', '.scr')
+
+# URL shorteners (often used in phishing)
+URL_SHORTENERS = ('bit.ly', 'tinyurl.com', 'goo.gl', 'ow.ly', 't.co')
+
+# Precompiled patterns (compiled once at import instead of per call).
+# Each pattern list is fused into one alternation so a sender is checked
+# with a single match call instead of one call per pattern.
+_NO_REPLY_COMBINED = _sender_re.compile('|'.join(f'(?:{p})' for p in NO_REPLY_PATTERNS))
+_SUSPICIOUS_COMBINED = _sender_re.compile('|'.join(f'(?:{p})' for p in SUSPICIOUS_SENDERS))
+
+# Dangerous content removed from bodies before they reach the prompt:
+# (name, pattern, replacement). All entries are fused into one alternation
+# so the body is scanned once no matter how many patterns are listed.
+DANGEROUS_CONTENT = (
+    ('url', r'https?://[^\s]+', '[URL REMOVED]'),
+    ('data_uri', r'(?i:\bdata:[\w.+-]+/[\w.+-]+[;,][^\s)]*)', '[DATA URI REMOVED]'),
+    ('script_uri', r'(?i:\bjavascript:\S+)', '[SCRIPT REMOVED]'),
+)
+_DANGEROUS_RE = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern, _ in DANGEROUS_CONTENT))
+_DANGEROUS_REPLACEMENTS = {name: replacement for name, _, replacement in DANGEROUS_CONTENT}
+_WHITELIST_SUFFIXES = tuple(f'@{domain}' for domain in WHITELIST_DOMAINS)
+
+# ASCII uppercase letters, deleted with bytes.translate to count capitals in C
+_ASCII_UPPER = bytes(range(ord('A'), ord('Z') + 1))
+
+# Every term searched for in the subject/body, matched in one pass when possible
+_BODY_TERMS = SUSPICIOUS_EXTENSIONS + URL_SHORTENERS
+_SCAN_TERMS = tuple(dict.fromkeys(SPAM_KEYWORDS + SUSPICIOUS_EXTENSIONS + URL_SHORTENERS))
+_SCAN_AUTOMATON = _build_automaton(_SCAN_TERMS)
+
+# Character class of the first letter of every scan term: text containing
+# none of these letters cannot match any term
+_SCAN_KEY_CHARS_RE = re.compile(
+    '[' + re.escape(''.join(sorted({next(c for c in term if c.isalpha()) for term in _SCAN_TERMS}))) + ']'
+)
+
+# Bit flags returned by _classify_sender
+_NO_REPLY_FLAG = 1
+_SUSPICIOUS_FLAG = 2
+
+
+def is_no_reply_address(email_address: str) -> bool:
     """
-    Filter emails to prevent responding to spam, phishing, and dangerous senders.
+    Check if an email address is a no-reply address.
+    
+    Args:
+        email_address: The sender's email address
+    
+    Returns:
+        bool: True if it's a no-reply address
+    """
+    return bool(_classify_sender(email_address.lower()) & _NO_REPLY_FLAG)
+
+
+def is_suspicious_sender(email_address: str) -> bool:
     """
+    Check if an email address appears to be suspicious or phishing.
     
-    # Known no-reply patterns
-    NO_REPLY_PATTERNS = [
-        r'noreply@.*',
-        r'no-reply@.*',
-        r'donotreply@.*',
-        r'do-not-reply@.*',
-        r'notifications@.*',
-        r'alerts@.*',
-        r'automated@.*',
-        r'system@.*',
-        r'mailer-daemon@.*',
-        r'postmaster@.*'
-    ]
-    
-    # Suspicious sender patterns (potential phishing)
-    SUSPICIOUS_SENDERS = [
-        r'.*@.*paypal\..*',  # PayPal phishing (unless from paypal.com)
-        r'.*@.*banking\..*',
-        r'.*@.*amazon\..*',  # Amazon phishing (unless from amazon.com)
-        r'.*@.*ebay\..*',    # eBay phishing (unless from ebay.com)
-        r'.*@.*lottery\..*',
-        r'.*@.*winner\..*',
-        r'.*@.*prize\..*',
-        r'.*@.*kilpailu\..*',  # Finnish contest/lottery
-        r'.*@.*arvonta\..*',   # Finnish lottery
-        r'.*voita@.*',         # Finnish "win" emails
-    ]
-    
-    # Whitelisted domains (legitimate companies)
-    WHITELIST_DOMAINS = [
-        'paypal.com',
-        'amazon.com',
-        'amazon.co.uk',
-        'ebay.com',
-        'google.com',
-        'microsoft.com',
-        'apple.com',
-        'facebook.com',
-        'linkedin.com'
-    ]
-    
-    # Spam keywords in subject or body
-    SPAM_KEYWORDS = [
-        # Financial scams
-        'lottery', 'winner', 'million dollars', 'inheritance', 'bitcoin',
-        'investment opportunity', 'claim your', 'free money', 'jackpot',
-        'casino', 'get rich', 'earn money fast', 'prize winner',
-        
-        # Finnish spam
-        'voita', 'arvonta', 'kilpailu', 'ilmainen', 'voittaja',
-        
-        # Urgency scams
-        'act now', 'limited time', 'expires today', 'urgent action required',
-        
-        # Phishing attempts
-        'verify your account', 'suspended account', 'click here immediately',
-        'confirm your identity', 'update payment information',
-        
-        # Adult content
-        'xxx', 'adult', 'singles', 'dating',
-        
-        # Pharmaceuticals
-        'viagra', 'cialis', 'pharmacy', 'pills', 'medication'
-    ]
-    
-    @classmethod
-    def is_no_reply_address(cls, email_address: str) -> bool:
-        """
-        Check if an email address is a no-reply address.
-        
-        Args:
-            email_address: The sender's email address
-            
-        Returns:
-            bool: True if it's a no-reply address
-        """
-        email_lower = email_address.lower()
-        
-        # Check against no-reply patterns
-        for pattern in cls.NO_REPLY_PATTERNS:
-            if re.match(pattern, email_lower):
-                return True
-        
-        return False
+    Args:
+        email_address: The sender's email address
     
-    @classmethod
-    def is_suspicious_sender(cls, email_address: str) -> bool:
-        """
-        Check if an email address appears to be suspicious or phishing.
-        
-        Args:
-            email_address: The sender's email address
-            
-        Returns:
-            bool: True if the sender appears suspicious
-        """
-        # Extract just the email part if it includes a name
-        if '<' in email_address and '>' in email_address:
-            match = re.search(r'<([^>]+)>', email_address)
-            if match:
-                email_address = match.group(1)
-        
-        email_lower = email_address.lower()
-        
-        # Check if it's from a whitelisted domain
-        for domain in cls.WHITELIST_DOMAINS:
-            if email_lower.endswith(f'@{domain}'):
-                return False  # Legitimate sender
-        
-        # Check against suspicious patterns
-        for pattern in cls.SUSPICIOUS_SENDERS:
-            if re.match(pattern, email_lower):
-                return True
-        
-        return False
+    Returns:
+        bool: True if the sender appears suspicious
+    """
+    return bool(_classify_sender(email_address.lower()) & _SUSPICIOUS_FLAG)
+
+
+def _match_no_reply(email_lower: str) -> bool:
+    """Check a lowercased address against the no-reply patterns."""
+    return _NO_REPLY_COMBINED.match(email_lower) is not None
+
+
+def _match_suspicious(email_lower: str) -> bool:
+    """Check a lowercased address against the whitelist and suspicious patterns."""
+    # Extract just the email part if it includes a name ("Name <addr>")
+    lt = email_lower.rfind('<')
+    if lt != -1:
+        gt = email_lower.find('>', lt + 1)
+        if gt != -1:
+            email_lower = email_lower[lt + 1:gt]
     
-    @classmethod
-    def calculate_spam_score(cls, email_data: Dict) -> Tuple[float, List[str]]:
-        """
-        Calculate a spam score for an email based on various factors.
-        
-        Args:
-            email_data: Dictionary containing email information
-            
-        Returns:
-            Tuple of (spam_score, reasons)
-            spam_score: 0.0 (not spam) to 1.0 (definitely spam)
-            reasons: List of reasons for the score
-        """
-        score = 0.0
-        reasons = []
-        
-        subject = email_data.get('subject', '').lower()
-        body = email_data.get('body', '').lower()
-        from_address = email_data.get('from', '').lower()
-        
-        # Check sender
-        if cls.is_no_reply_address(from_address):
+    # Check if it's from a whitelisted domain
+    if email_lower.endswith(_WHITELIST_SUFFIXES):
+        return False  # Legitimate sender
+    
+    # Check against suspicious patterns
+    return _SUSPICIOUS_COMBINED.match(email_lower) is not None
+
+
+@lru_cache(maxsize=4096)
+def _classify_sender(email_lower: str) -> int:
+    """
+    Classify a lowercased sender address, memoized per address.
+    
+    Bulk senders and mailing lists repeat the same address, so the
+    regex work is only done once per distinct sender.
+    
+    Args:
+        email_lower: The sender's email address, lowercased
+    
+    Returns:
+        int: Bitmask of _NO_REPLY_FLAG and _SUSPICIOUS_FLAG
+    """
+    flags = 0
+    if _match_no_reply(email_lower):
+        flags |= _NO_REPLY_FLAG
+    if _match_suspicious(email_lower):
+        flags |= _SUSPICIOUS_FLAG
+    return flags
+
+
+def _scan_terms(subject: str, body: str) -> Tuple[Set[str], Set[str]]:
+    """
+    Find which scan terms occur in the email.
+    
+    Args:
+        subject: Lowercased email subject
+        body: Lowercased email body
+    
+    Returns:
+        Tuple of (spam keywords found in subject or body, terms found in body)
+    """
+    # Scan subject and body together; the separator keeps matches from spanning both
+    haystack = f"{subject}\x00{body}"
+    
+    # Cheap prefilter: the search stops at the first candidate letter, so this
+    # costs almost nothing on normal text and skips the scan for e.g. non-Latin mail
+    if _SCAN_KEY_CHARS_RE.search(haystack) is None:
+        return set(), set()
+    
+    if _SCAN_AUTOMATON is None:
+        found = {keyword for keyword in SPAM_KEYWORDS if keyword in haystack}
+        body_hits = {term for term in _BODY_TERMS if term in body}
+        return found, body_hits
+    
+    found = set()
+    body_hits = set()
+    body_start = len(subject) + 1
+    for end, term in _SCAN_AUTOMATON.iter(haystack):
+        found.add(term)
+        if end - len(term) + 1 >= body_start:
+            body_hits.add(term)
+    return found, body_hits
+
+
+def _count_uppercase(text: str) -> int:
+    """Count uppercase characters, using a byte-table fast path for ASCII text."""
+    if text.isascii():
+        raw = text.encode('ascii')
+        return len(raw) - len(raw.translate(None, _ASCII_UPPER))
+    return sum(map(str.isupper, text))
+
+
+def calculate_spam_score(email_data: Dict, *, is_noreply: Optional[bool] = None,
+                         is_suspicious: Optional[bool] = None,
+                         early_exit_threshold: Optional[float] = None) -> Tuple[float, List[str]]:
+    """
+    Calculate a spam score for an email based on various factors.
+    
+    Args:
+        email_data: Dictionary containing email information
+        is_noreply: Precomputed no-reply check for the sender (computed if None)
+        is_suspicious: Precomputed suspicious-sender check (computed if None)
+        early_exit_threshold: If set, stop as soon as the score reaches it
+            (the remaining checks are skipped, so score and reasons are partial)
+    
+    Returns:
+        Tuple of (spam_score, reasons)
+        spam_score: 0.0 (not spam) to 1.0 (definitely spam)
+        reasons: List of reasons for the score
+    """
+    score = 0.0
+    reasons = []
+    
+    # Check sender (lowercased once, and only if the caller did not already check)
+    if is_noreply is None or is_suspicious is None:
+        sender_flags = _classify_sender(email_data.get('from', '').lower())
+        if is_noreply is None:
+            is_noreply = bool(sender_flags & _NO_REPLY_FLAG)
+        if is_suspicious is None:
+            is_suspicious = bool(sender_flags & _SUSPICIOUS_FLAG)
+    
+    if is_noreply:
+        score += 0.3
+        reasons.append("No-reply address")
+    
+    if is_suspicious:
+        score += 0.5
+        reasons.append("Suspicious sender pattern")
+    
+    # The sender alone can already decide; skip the body scan if so
+    if early_exit_threshold is not None and score >= early_exit_threshold:
+        return min(1.0, score), reasons
+    
+    subject_orig = email_data.get('subject', '')
+    subject = subject_orig.lower()
+    body = email_data.get('body', '').lower()
+    
+    # Find all spam keywords, attachment types and shorteners in one scan
+    found_terms, body_hits = _scan_terms(subject, body)
+    
+    # Check for spam keywords
+    found_keywords = [keyword for keyword in SPAM_KEYWORDS if keyword in found_terms]
+    spam_keyword_count = len(found_keywords)
+    
+    if spam_keyword_count > 0:
+        # Add score based on number of spam keywords
+        keyword_score = min(0.5, spam_keyword_count * 0.1)
+        score += keyword_score
+        reasons.append(f"Spam keywords found: {', '.join(found_keywords[:5])}")
+        
+        if early_exit_threshold is not None and score >= early_exit_threshold:
+            return min(1.0, score), reasons
+    
+    # Check for excessive capitalization in subject (must use the original case).
+    # If lowercasing changed nothing there are no capitals, so skip counting.
+    if subject_orig and subject_orig != subject:
+        caps_ratio = _count_uppercase(subject_orig) / len(subject_orig)
+        if caps_ratio > 0.5:
+            score += 0.2
+            reasons.append("Excessive capitalization")
+    
+    # Check for suspicious attachments mentioned
+    for ext in SUSPICIOUS_EXTENSIONS:
+        if ext in body_hits:
             score += 0.3
-            reasons.append("No-reply address")
-        
-        if cls.is_suspicious_sender(from_address):
-            score += 0.5
-            reasons.append("Suspicious sender pattern")
-        
-        # Check for spam keywords
-        spam_keyword_count = 0
-        found_keywords = []
-        for keyword in cls.SPAM_KEYWORDS:
-            if keyword in subject or keyword in body:
-                spam_keyword_count += 1
-                found_keywords.append(keyword)
-        
-        if spam_keyword_count > 0:
-            # Add score based on number of spam keywords
-            keyword_score = min(0.5, spam_keyword_count * 0.1)
-            score += keyword_score
-            reasons.append(f"Spam keywords found: {', '.join(found_keywords[:5])}")
-        
-        # Check for excessive capitalization in subject
-        if subject:
-            caps_ratio = sum(1 for c in subject if c.isupper()) / len(subject)
-            if caps_ratio > 0.5:
-                score += 0.2
-                reasons.append("Excessive capitalization")
-        
-        # Check for suspicious attachments mentioned
-        suspicious_extensions = ['.exe', '.zip', '.rar', '.bat', '.cmd', '.scr']
-        for ext in suspicious_extensions:
-            if ext in body:
-                score += 0.3
-                reasons.append(f"Suspicious attachment type: {ext}")
-        
-        # Check for URL shorteners (often used in phishing)
-        url_shorteners = ['bit.ly', 'tinyurl.com', 'goo.gl', 'ow.ly', 't.co']
-        for shortener in url_shorteners:
-            if shortener in body:
-                score += 0.2
-                reasons.append(f"URL shortener detected: {shortener}")
-        
-        # Cap the score at 1.0
-        score = min(1.0, score)
-        
-        return score, reasons
+            reasons.append(f"Suspicious attachment type: {ext}")
     
-    @classmethod
-    def should_skip_email(cls, email_data: Dict, spam_threshold: float = 0.5) -> Tuple[bool, str]:
-        """
-        Determine if an email should be skipped (not responded to).
-        
-        Args:
-            email_data: Dictionary containing email information
-            spam_threshold: Threshold above which email is considered spam (0.0-1.0)
-            
-        Returns:
-            Tuple of (should_skip, reason)
-        """
-        from_address = email_data.get('from', '')
-        
-        # Check if it's a no-reply address
-        if cls.is_no_reply_address(from_address):
-            return True, "No-reply address"
-        
-        # Calculate spam score
-        spam_score, reasons = cls.calculate_spam_score(email_data)
-        
-        # Skip if spam score exceeds threshold
-        if spam_score >= spam_threshold:
-            reason = f"High spam score ({spam_score:.2f}): {'; '.join(reasons)}"
-            return True, reason
-        
-        # Check for specific dangerous patterns
-        subject = email_data.get('subject', '').lower()
-        body = email_data.get('body', '').lower()
-        
-        # Never respond to emails about payments/receipts from payment processors
-        payment_keywords = ['receipt', 'payment', 'invoice', 'transaction']
-        payment_domains = ['paypal', 'stripe', 'square', 'venmo']
-        
-        for keyword in payment_keywords:
-            if keyword in subject:
-                for domain in payment_domains:
-                    if domain in from_address.lower():
-                        return True, f"Payment processor email ({domain})"
-        
-        return False, ""
+    # Check for URL shorteners (often used in phishing)
+    for shortener in URL_SHORTENERS:
+        if shortener in body_hits:
+            score += 0.2
+            reasons.append(f"URL shortener detected: {shortener}")
     
-    @classmethod
-    def sanitize_email_for_response(cls, email_data: Dict) -> Dict:
-        """
-        Sanitize email data before generating a response.
-        Removes potentially dangerous content.
-        
-        Args:
-            email_data: Original email data
-            
-        Returns:
-            Sanitized email data
-        """
-        import copy
-        sanitized = copy.deepcopy(email_data)
-        
-        # Remove any URLs from the body to prevent clicking on malicious links
-        body = sanitized.get('body', '')
-        # Simple URL removal (not perfect but helps)
-        url_pattern = r'https?://[^\s]+'
-        body = re.sub(url_pattern, '[URL REMOVED]', body)
-        sanitized['body'] = body
-        
-        # Truncate very long bodies (potential attack vector)
-        max_body_length = 5000
-        if len(body) > max_body_length:
-            sanitized['body'] = body[:max_body_length] + '... [TRUNCATED]'
-        
-        return sanitized
\ No newline at end of file
+    # Cap the score at 1.0
+    score = min(1.0, score)
+    
+    return score, reasons
+
+
+def score_batch(emails: List[Dict]) -> List[float]:
+    """
+    Calculate spam scores for a batch of emails.
+    
+    Each email is scanned once by the shared keyword automaton, and
+    repeat senders hit the sender classification cache.
+    
+    Args:
+        emails: List of email dictionaries
+    
+    Returns:
+        List of spam scores in the same order as the input
+    """
+    return [calculate_spam_score(email_data)[0] for email_data in emails]
+
+
+def should_skip_email(email_data: Dict, spam_threshold: float = 0.5) -> Tuple[bool, str]:
+    """
+    Determine if an email should be skipped (not responded to).
+    
+    Verdicts are cached by sender, subject and a digest of the body, so a
+    repeated email (spam waves, newsletter loops) skips the scans.
+    
+    Args:
+        email_data: Dictionary containing email information
+        spam_threshold: Threshold above which email is considered spam (0.0-1.0)
+    
+    Returns:
+        Tuple of (should_skip, reason)
+    """
+    key = (
+        email_data.get('from', ''),
+        email_data.get('subject', ''),
+        hashlib.blake2b(email_data.get('body', '').encode('utf-8', 'surrogatepass'), digest_size=16).digest(),
+        spam_threshold,
+    )
+    with _verdict_lock:
+        verdict = _verdict_cache.get(key)
+        if verdict is not None:
+            _verdict_cache.move_to_end(key)
+            return verdict
+    
+    verdict = _check_email(email_data, spam_threshold)
+    with _verdict_lock:
+        _verdict_cache[key] = verdict
+        if len(_verdict_cache) > _VERDICT_CACHE_SIZE:
+            _verdict_cache.popitem(last=False)
+    return verdict
+
+
+def should_skip_batch(emails: List[Dict], spam_threshold: float = 0.5) -> List[Tuple[bool, str]]:
+    """
+    Determine which emails of a batch should be skipped.
+    
+    Args:
+        emails: List of email dictionaries
+        spam_threshold: Threshold above which email is considered spam (0.0-1.0)
+    
+    Returns:
+        List of (should_skip, reason) tuples in the same order as the input
+    """
+    return [should_skip_email(email_data, spam_threshold) for email_data in emails]
+
+
+def _check_email(email_data: Dict, spam_threshold: float) -> Tuple[bool, str]:
+    """Run the checks behind should_skip_email."""
+    # Lowercase the sender once and reuse it for every check below
+    from_lower = email_data.get('from', '').lower()
+    sender_flags = _classify_sender(from_lower)
+    
+    # Check if it's a no-reply address (decides on its own, no scoring needed)
+    if sender_flags & _NO_REPLY_FLAG:
+        return True, "No-reply address"
+    
+    # Calculate spam score, reusing the sender checks done above
+    spam_score, reasons = calculate_spam_score(
+        email_data,
+        is_noreply=False,
+        is_suspicious=bool(sender_flags & _SUSPICIOUS_FLAG),
+        early_exit_threshold=spam_threshold
+    )
+    
+    # Skip if spam score exceeds threshold
+    if spam_score >= spam_threshold:
+        reason = f"High spam score ({spam_score:.2f}): {'; '.join(reasons)}"
+        return True, reason
+    
+    # Check for specific dangerous patterns
+    subject = email_data.get('subject', '').lower()
+    
+    # Never respond to emails about payments/receipts from payment processors
+    payment_keywords = ['receipt', 'payment', 'invoice', 'transaction']
+    payment_domains = ['paypal', 'stripe', 'square', 'venmo']
+    
+    for keyword in payment_keywords:
+        if keyword in subject:
+            for domain in payment_domains:
+                if domain in from_lower:
+                    return True, f"Payment processor email ({domain})"
+    
+    return False, ""
+
+
+def sanitize_email_for_response(email_data: Dict) -> Dict:
+    """
+    Sanitize email data before generating a response.
+    Removes potentially dangerous content.
+    
+    Args:
+        email_data: Original email data
+    
+    Returns:
+        Sanitized email data
+    """
+    # Shallow copy is enough: only the (immutable) body string is replaced
+    sanitized = dict(email_data)
+    
+    body = sanitized.get('body', '')
+    
+    # Truncate very long bodies first (potential attack vector) so the
+    # URL scan below never runs over more than max_body_length characters
+    max_body_length = 5000
+    truncated = len(body) > max_body_length
+    if truncated:
+        body = body[:max_body_length]
+    
+    # Remove URLs and other dangerous content in a single pass to prevent
+    # clicking on malicious links (simple removal, not perfect but helps)
+    body = _DANGEROUS_RE.sub(lambda m: _DANGEROUS_REPLACEMENTS[m.lastgroup], body)
+    
+    if truncated:
+        body += '... [TRUNCATED]'
+    sanitized['body'] = body
+    
+    return sanitized
+
+
+class EmailFilter:
+    """
+    Filter emails to prevent responding to spam, phishing, and dangerous senders.
+    
+    Thin facade over the module-level functions, kept so existing
+    EmailFilter.<method> / instance call sites keep working.
+    """
+    
+    NO_REPLY_PATTERNS = NO_REPLY_PATTERNS
+    SUSPICIOUS_SENDERS = SUSPICIOUS_SENDERS
+    WHITELIST_DOMAINS = WHITELIST_DOMAINS
+    SPAM_KEYWORDS = SPAM_KEYWORDS
+    SUSPICIOUS_EXTENSIONS = SUSPICIOUS_EXTENSIONS
+    URL_SHORTENERS = URL_SHORTENERS
+    DANGEROUS_CONTENT = DANGEROUS_CONTENT
+    
+    is_no_reply_address = staticmethod(is_no_reply_address)
+    is_suspicious_sender = staticmethod(is_suspicious_sender)
+    calculate_spam_score = staticmethod(calculate_spam_score)
+    score_batch = staticmethod(score_batch)
+    should_skip_email = staticmethod(should_skip_email)
+    should_skip_batch = staticmethod(should_skip_batch)
+    sanitize_email_for_response = staticmethod(sanitize_email_for_response)
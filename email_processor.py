@@ -11,151 +11,917 @@ Author: Linda Marin and Sawsan Abdulbari for HAMK Digital and Social Media Analy
 Date: August 2025
 """
 
+import asyncio
+import concurrent.futures
+import functools
 import json
-import smtplib
-import imaplib
+import logging
 import email
 import re
+import threading
+import time
 from datetime import datetime, timedelta
-from email.message import EmailMessage
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from email.header import decode_header
+from html.parser import HTMLParser
+from email.utils import parsedate_tz, mktime_tz
 from config import EMAIL_CONFIG
+from email_filter import sanitize_email_for_response
+
+# Progress messages are logged at DEBUG level so that per-email output
+# costs nothing unless the application enables it
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Optional: pyahocorasick finds every category/sentiment keyword in a single
+# pass. Without it we fall back to one substring search per keyword.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Optional: aioimaplib/aiosmtplib back the async fetch/send methods.
+# Without them the blocking versions run in a worker thread.
+try:
+    import aioimaplib
+except ImportError:
+    aioimaplib = None
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+# Sections fetched per message: headers plus the first MIME part
+_FETCH_ITEMS = '(BODY.PEEK[HEADER] BODY.PEEK[1.MIME] BODY.PEEK[1])'
+
+# Fallback for messages whose body text is not in the first part
+_FETCH_FULL_ITEMS = '(BODY.PEEK[])'
+
+# Message ID at the start of a FETCH response descriptor, e.g. b'3 (BODY[HEADER] {1234}'
+# (aioimaplib keeps the FETCH keyword: b'3 FETCH (BODY[HEADER] {1234}')
+_FETCH_ID_RE = re.compile(rb'^(\d+) (?:FETCH )?\(')
+
+# UID data item anywhere in a FETCH response line, e.g. b'3 (UID 1042 BODY[HEADER] {1234}'
+_FETCH_UID_RE = re.compile(rb'\bUID (\d+)')
+
+# UIDVALIDITY response code of a SELECT, e.g. b'OK [UIDVALIDITY 3857529045] UIDs valid'
+_UIDVALIDITY_RE = re.compile(rb'UIDVALIDITY (\d+)')
+
+# Section name before the literal size, e.g. b' BODY[1.MIME] {56}'
+_FETCH_SECTION_RE = re.compile(rb'(\w+(?:\[[^\]]*\])?)(?:<\d+>)? \{\d+\}$')
+
+# Precompiled patterns used when building and formatting messages
+_SENDER_NAME_RE = re.compile(r'^"?([^"<]+)"?\s*<[^>]+>$')
+
+# Markdown bold (**x**, __x__) and italic (*x*, _x_)
+_BOLD_RE = re.compile(r'\*\*(?P<star>.*?)\*\*|__(?P<underscore>.*?)__')
+_ITALIC_RE = re.compile(r'\*(?P<star>.*?)\*|_(?P<underscore>.*?)_')
+
+# A stray email header line in a reply body (leading whitespace allowed),
+# together with one blank line directly after it
+_HEADER_LINE_RE = re.compile(
+    r'^[^\S\n]*(?:Subject:|From:|To:|Date:|Re:)[^\n]*(?:\n|\Z)(?:[^\S\n]*(?:\n|\Z))?',
+    re.MULTILINE
+)
+_HEADER_PREFIXES = ('Subject:', 'From:', 'To:', 'Date:', 'Re:')
+
+# Keywords used to categorize incoming emails
+CATEGORY_KEYWORDS = {
+    'complaint': (
+        'complaint', 'disappointed', 'unhappy', 'terrible', 'awful', 'poor', 
+        'unsatisfied', 'frustrated', 'upset', 'angry', 'annoyed', 'dissatisfied',
+        'problem with', 'not working', 'does not work', 'failed', 'failing',
+        'issue with', 'bad experience', 'bad service', 'poor quality'
+    ),
+    'product_support': (
+        'login', 'password', 'error', 'not working', 'help', 'how to', 'does not work',
+        'broken', 'bug', 'technical', 'support', 'assistance', 'problem',
+        'troubleshoot', 'issue', 'fix', 'solution'
+    ),
+    'feature_request': (
+        'feature', 'suggestion', 'improve', 'enhancement', 'add', 'missing', 
+        'should have', 'would be nice', 'could you add', 'please include',
+        'consider adding', 'new feature', 'functionality', 'capability'
+    ),
+    'billing_question': (
+        'bill', 'charge', 'payment', 'refund', 'subscription', 'price', 'cost',
+        'discount', 'invoice', 'credit card', 'transaction', 'receipt',
+        'cancellation', 'renewal', 'billing', 'charged', 'fee', 'pricing'
+    ),
+    'general_feedback': (
+        'thank', 'great', 'love', 'awesome', 'excellent', 'amazing', 'good',
+        'appreciate', 'feedback', 'enjoyed', 'wonderful', 'fantastic',
+        'satisfied', 'helpful', 'impressive'
+    ),
+    'urgent_request': (
+        'urgent', 'emergency', 'asap', 'immediate', 'critical', 'important',
+        'time sensitive', 'deadline', 'quickly', 'rush', 'priority', 'immediately',
+        'as soon as possible', 'promptly', 'fast', 'today'
+    ),
+    'spam': (
+        'lottery', 'million dollars', 'bitcoin', 'investment opportunity',
+        'inheritance', 'claim your', 'free money',
+        'winner', 'jackpot', 'casino', 'earn money fast', 'get rich'
+    ),
+}
+
+# Category checked first wins when an email matches several
+CATEGORY_PRIORITY = (
+    'urgent_request', 'complaint', 'billing_question', 'product_support',
+    'feature_request', 'spam', 'general_feedback', 'customer_inquiry'
+)
+
+# Sentiment words
+POSITIVE_WORDS = (
+    'good', 'great', 'excellent', 'wonderful', 'amazing', 'love', 'like',
+    'happy', 'pleased', 'satisfied', 'thank', 'thanks', 'helpful', 'appreciate',
+    'awesome', 'fantastic', 'perfect', 'best', 'impressed'
+)
+
+NEGATIVE_WORDS = (
+    'bad', 'poor', 'terrible', 'awful', 'horrible', 'disappointed', 'upset',
+    'angry', 'unhappy', 'not working', 'problem', 'issue', 'broken', 'error',
+    'failed', 'wrong', 'worst', 'hate', 'dislike', 'annoyed', 'frustrating'
+)
+
+# Every distinct keyword, scanned for once per email
+_ALL_KEYWORDS = tuple(dict.fromkeys(
+    [keyword for keywords in CATEGORY_KEYWORDS.values() for keyword in keywords]
+    + list(POSITIVE_WORDS) + list(NEGATIVE_WORDS)
+))
+
+
+def _build_keyword_automaton():
+    """Build an Aho-Corasick automaton for all keywords (None if unavailable)."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword in _ALL_KEYWORDS:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+def _bold_to_html(match):
+    """re.sub callback for _BOLD_RE; bold nested in the other style is converted too."""
+    return f"<strong>{_BOLD_RE.sub(_bold_to_html, match.group(match.lastgroup))}</strong>"
+
+
+def _italic_to_html(match):
+    """re.sub callback for _ITALIC_RE; italic nested in the other style is converted too."""
+    return f"<em>{_ITALIC_RE.sub(_italic_to_html, match.group(match.lastgroup))}</em>"
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the text of an HTML document, skipping <script> and <style> contents."""
+    
+    _SKIP_TAGS = frozenset({'script', 'style'})
+    
+    def reset(self):
+        super().reset()
+        self.parts = []
+        self._skip_depth = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP_TAGS:
+            self._skip_depth += 1
+    
+    def handle_endtag(self, tag):
+        if tag in self._SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+    
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def _html_to_text(html_body):
+    """Convert HTML to plain text; entities such as &amp; are decoded while parsing."""
+    parser = _TextExtractor()
+    parser.feed(html_body)
+    parser.close()
+    return ''.join(parser.parts)
+
+
+def _fetch_lines_to_data(lines):
+    """
+    Convert aioimaplib FETCH response lines to imaplib's layout.
+    
+    aioimaplib returns each literal as a bytearray line following the line
+    that announced it; imaplib pairs them as (descriptor, payload) tuples
+    and keeps the other lines as plain bytes.
+    """
+    data = []
+    for index, line in enumerate(lines):
+        if isinstance(line, bytearray):
+            continue  # literal, paired with the line before it
+        if index + 1 < len(lines) and isinstance(lines[index + 1], bytearray):
+            data.append((bytes(line), bytes(lines[index + 1])))
+        else:
+            data.append(bytes(line))
+    return data
+
+
+def _parse_uidvalidity(lines):
+    """Find the UIDVALIDITY value in SELECT response data (None if the server sent none)."""
+    for line in lines or ():
+        if isinstance(line, str):
+            line = line.encode()
+        match = _UIDVALIDITY_RE.search(line) if isinstance(line, (bytes, bytearray)) else None
+        if match:
+            return match.group(1).decode()
+        if line and line.isdigit():
+            return line.decode()  # imaplib's response('UIDVALIDITY') gives just the number
+    return None
+
+
+def _email_key(uidvalidity, uid):
+    """
+    Stable identifier for a message: "<UIDVALIDITY>:<UID>".
+    
+    A UID is only unique within one UIDVALIDITY of a folder, so both are
+    needed to recognize an already processed email reliably.
+    """
+    uid = uid.decode() if isinstance(uid, bytes) else uid
+    return f"{uidvalidity}:{uid}" if uidvalidity else uid
+
+
+def _select_mailbox(mail, folder):
+    """
+    Select a folder on an imaplib connection.
+    
+    Returns:
+        tuple: (UIDVALIDITY, UIDNEXT, EXISTS) of the folder, each None if the
+            server sent none. New mail changes UIDNEXT and EXISTS.
+    """
+    status, data = mail.select(folder)
+    uidvalidity = _parse_uidvalidity(mail.response('UIDVALIDITY')[1])
+    uidnext = mail.response('UIDNEXT')[1][-1]
+    exists = data[-1] if status == 'OK' and data else None
+    return uidvalidity, uidnext, exists
+
+
+# imaplib only supports IDLE from Python 3.14 on, so the three helpers below
+# speak it directly. They are the only code relying on imaplib internals: the
+# private _new_tag(), and send()/readline(), which bypass its response parsing.
+
+def _imap_start_idle(mail):
+    """
+    Send IDLE and read the server's continuation.
+    
+    Returns:
+        bytes: The command's tag, needed by _imap_end_idle
+    """
+    import imaplib
+    
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    if not mail.readline().startswith(b'+'):
+        raise imaplib.IMAP4.error("IDLE was rejected")
+    return tag
+
+
+def _imap_read_line(mail, timeout):
+    """
+    Read one raw response line while idling.
+    
+    Raises:
+        socket.timeout: If nothing arrives within timeout seconds. The
+            connection can't be read from after that and must be closed.
+    """
+    mail.sock.settimeout(timeout)
+    return mail.readline()
+
+
+def _imap_end_idle(mail, tag):
+    """Send DONE and read up to the IDLE command's completion, the connection stays usable."""
+    mail.sock.settimeout(None)
+    mail.send(b'DONE\r\n')
+    for line in iter(mail.readline, b''):
+        if line.startswith(tag):
+            break
+
+
+@functools.lru_cache(maxsize=1024)
+def _decode_encoded_header(header_value):
+    """
+    Decode a header containing RFC 2047 encoded words, memoized per value.
+    
+    Senders and subjects repeat across a thread, so each distinct
+    header is only decoded once.
+    """
+    decoded_parts = []
+    for part, encoding in decode_header(header_value):
+        if isinstance(part, bytes):
+            decoded_parts.append(part.decode(encoding or 'utf-8', errors='replace'))
+        else:
+            decoded_parts.append(part)
+    return ''.join(decoded_parts)
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_sender_name(from_address):
+    """
+    Extract the display name from a From header, memoized per address.
+    
+    An inbox sees few distinct senders per polling window, so the regex
+    only runs once per sender.
+    """
+    if '<' in from_address and '>' in from_address:
+        match = _SENDER_NAME_RE.search(from_address)
+        if match:
+            return match.group(1).strip()
+    return None
+
+
+HIGH_PRIORITY_CATEGORIES = frozenset({'complaint', 'urgent_request'})
+MEDIUM_PRIORITY_CATEGORIES = frozenset({'product_support', 'billing_question'})
 
 class EmailProcessor:
     """
     Email processor with date filtering and threading support.
     """
     
-    def __init__(self, config=EMAIL_CONFIG):
+    def __init__(self, config=EMAIL_CONFIG, tracker=None):
         """
         Initialize with email configuration.
+        
+        Args:
+            config (dict): Email server configuration
+            tracker (EmailTracker, optional): When given, emails it has
+                already processed are skipped before fetching
         """
         self.config = config
+        self.tracker = tracker
+        
+        # Connections are opened on first use and reused across calls
+        self._imap = None
+        self._smtp = None
+        
+        # Folder -> (UIDVALIDITY, UIDNEXT, EXISTS) seen by the last fetch, so
+        # wait_for_new_mail can tell whether mail arrived in between
+        self._mailbox_state = {}
+        
+        # SMTP is stateful, so sends from several threads take turns
+        self._smtp_lock = threading.Lock()
         
-    def fetch_emails(self, limit=2, unread_only=True, folder='inbox', days_back=7):
+        # Async SMTP connection and its lock belong to one event loop
+        self._async_smtp = None
+        self._async_smtp_lock = None
+        self._async_smtp_loop = None
+    
+    def _get_imap(self):
+        """
+        Return a logged-in IMAP connection, reusing the previous one if it is still alive.
+        
+        Avoids a TLS handshake and LOGIN on every fetch.
+        """
+        import imaplib  # imported on first use, parsing alone does not need it
+        
+        if self._imap is not None:
+            try:
+                self._imap.noop()
+                return self._imap
+            except (imaplib.IMAP4.error, OSError):
+                # Dropped by the server (idle timeout etc.) - reconnect
+                self._drop_imap()
+        
+        mail = imaplib.IMAP4_SSL(self.config['imap_server'], self.config['imap_port'])
+        mail.login(self.config['email_address'], self.config['email_password'])
+        self._imap = mail
+        return mail
+    
+    def _drop_imap(self):
+        """Close the IMAP connection without logging out, it is in an unknown state."""
+        if self._imap is not None:
+            try:
+                self._imap.shutdown()
+            except OSError:
+                pass
+            self._imap = None
+    
+    def _get_smtp(self):
+        """
+        Return a logged-in SMTP connection, reusing the previous one if it is still alive.
+        """
+        import smtplib  # imported on first use, parsing alone does not need it
+        
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+        
+        server = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'])
+        server.starttls()
+        server.login(self.config['email_address'], self.config['email_password'])
+        self._smtp = server
+        return server
+    
+    def close(self):
+        """Log out of the IMAP and SMTP servers if connected."""
+        import imaplib
+        import smtplib
+        
+        if self._imap is not None:
+            try:
+                self._imap.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+            self._imap = None
+        
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+        
+        if self._async_smtp is not None:
+            self._close_async_smtp()
+    
+    def _close_async_smtp(self):
+        """
+        Send QUIT on the async SMTP connection, on the event loop that owns it.
+        
+        If that loop is closed or is the caller's own (running) loop, QUIT
+        can't be awaited here and the connection is just closed.
+        """
+        server, loop = self._async_smtp, self._async_smtp_loop
+        self._async_smtp = None
+        try:
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            
+            if loop is None or loop.is_closed() or loop is running_loop:
+                server.close()
+            elif loop.is_running():
+                # Owned by a loop in another thread
+                asyncio.run_coroutine_threadsafe(server.quit(), loop).result(timeout=30)
+            else:
+                loop.run_until_complete(server.quit())
+        except (aiosmtplib.SMTPException, OSError, RuntimeError, concurrent.futures.TimeoutError):
+            pass
+    
+    def fetch_emails(self, limit=2, unread_only=True, folder='inbox', days_back=7, batch_size=100,
+                     exclude=()):
         """
         Fetch emails from the specified folder with date filtering.
         
         Filters emails by date to avoid processing old emails.
         Extracts Message-ID for threading support.
+        Messages are fetched in batches (one FETCH command per batch)
+        instead of one round trip per message.
         
         Args:
             limit (int): Maximum number of emails to fetch
             unread_only (bool): Whether to fetch only unread emails
             folder (str): Mailbox folder to fetch from
             days_back (int): Number of days to look back for emails
+            batch_size (int): Maximum number of messages per FETCH command
+            exclude (collection): IDs of emails to leave out like processed
+                ones, e.g. emails being answered right now
             
         Returns:
             list: List of email dictionaries with threading information
         """
         try:
-            # Connect to the IMAP server
-            mail = imaplib.IMAP4_SSL(self.config['imap_server'], self.config['imap_port'])
-            mail.login(self.config['email_address'], self.config['email_password'])
-            mail.select(folder)
-            
-            # Calculate date for filtering - only get recent emails
-            since_date = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
+            # Connect to the IMAP server (reuses the open connection if any)
+            mail = self._get_imap()
+            state = _select_mailbox(mail, folder)
+            self._mailbox_state[folder] = state
             
-            # Build search criteria with date filtering
-            search_parts = []
-            if unread_only:
-                search_parts.append('UNSEEN')
-            search_parts.append(f'SINCE {since_date}')
+            # UIDs are only stable together with the folder's UIDVALIDITY
+            uidvalidity = state[0]
             
-            # Join search criteria
-            search_criteria = f'({" ".join(search_parts)})'
-            
-            # Search for emails with date filter
-            print(f"Searching for emails: {search_criteria}")
-            status, data = mail.search(None, search_criteria)
+            # Search for emails with date filter (by UID, which unlike sequence
+            # numbers does not shift when other messages are expunged)
+            search_criteria = self._search_criteria(unread_only, days_back)
+            logger.debug("Searching for emails: %s", search_criteria)
+            status, data = mail.uid('SEARCH', None, search_criteria)
             
             if status != 'OK':
-                print(f"Error searching for emails: {status}")
+                logger.error("Error searching for emails: %s", status)
                 return []
             
-            # Get email IDs and reverse to get newest first
-            email_ids = data[0].split()
-            email_ids = list(reversed(email_ids))  # Newest first
-            
-            # Limit the number of emails to process
-            if limit > 0:
-                email_ids = email_ids[:limit]
-            
+            email_ids = self._select_email_ids(data[0], limit, uidvalidity, exclude)
             if not email_ids:
-                print(f"No emails found in the last {days_back} days")
+                logger.debug("No emails found in the last %s days", days_back)
                 return []
             
             emails = []
+            now = datetime.now().timestamp()
             
-            # Process each email
-            for email_id in email_ids:
-                # Fetch the email using its ID
-                status, data = mail.fetch(email_id, '(RFC822)')
+            # Fetch the emails in batches to avoid one round trip per message
+            # (batches also keep the command under server request size limits)
+            for start in range(0, len(email_ids), batch_size):
+                batch = email_ids[start:start + batch_size]
+                
+                # Only the headers and the first MIME part are downloaded, so
+                # attachments are never transferred. PEEK keeps \Seen unset.
+                status, data = mail.uid('FETCH', b','.join(batch), _FETCH_ITEMS)
                 
                 if status != 'OK':
-                    print(f"Error fetching email ID {email_id}: {status}")
+                    logger.error("Error fetching email IDs %s: %s", b','.join(batch).decode(), status)
                     continue
                 
-                # Parse the raw email data
-                raw_email = data[0][1]
-                msg = email.message_from_bytes(raw_email)
+                parsed, needs_full = self._parse_batch(batch, self._parse_fetch_response(data))
                 
-                # Extract email headers including Message-ID for threading
-                subject = self._decode_header(msg['subject'])
-                from_address = self._decode_header(msg['from'])
-                to_address = self._decode_header(msg['to'])
-                date = msg['date']
-                message_id = msg.get('Message-ID', '')  # Extract Message-ID
-                references = msg.get('References', '')   # Extract References
-                in_reply_to = msg.get('In-Reply-To', '') # Extract In-Reply-To
+                # Messages whose text is not in the first part need the full walk
+                if needs_full:
+                    status, data = mail.uid('FETCH', b','.join(needs_full), _FETCH_FULL_ITEMS)
+                    if status == 'OK':
+                        self._add_full_messages(parsed, self._parse_fetch_response(data))
+                    else:
+                        logger.error("Error fetching email IDs %s: %s", b','.join(needs_full).decode(), status)
                 
-                # Parse date to check if it's recent
+                emails.extend(self._build_batch_emails(batch, parsed, days_back, now, uidvalidity))
+            
+            # The connection stays open for the next call (see close())
+            logger.debug("Successfully fetched %s recent email(s)", len(emails))
+            return emails
+            
+        except Exception as e:
+            logger.error("Error fetching emails: %s", e)
+            # Don't reuse a connection in an unknown state
+            self._drop_imap()
+            return []
+    
+    def wait_for_new_mail(self, timeout=29 * 60, folder='inbox', poll_interval=30):
+        """
+        Block until the server reports new mail in a folder, or until timeout.
+        
+        Uses IMAP IDLE (RFC 2177), so nothing is polled while waiting.
+        Servers may drop a connection that idles for 30 minutes, hence the
+        default timeout. Servers without IDLE are polled instead: the call
+        just sleeps poll_interval seconds.
+        
+        IDLE only reports mail that arrives while idling, so the call returns
+        at once if the folder changed since the last fetch_emails.
+        
+        Args:
+            timeout (float): Maximum number of seconds to wait
+            folder (str): Mailbox folder to watch
+            poll_interval (float): Seconds to sleep if IDLE is not available
+            
+        Returns:
+            bool: True if new mail arrived, False otherwise
+        """
+        import imaplib
+        import socket
+        
+        try:
+            mail = self._get_imap()
+            if 'IDLE' not in mail.capabilities:
+                time.sleep(poll_interval)
+                return False
+            
+            state = _select_mailbox(mail, folder)
+            if self._mailbox_state.get(folder, state) != state:
+                logger.debug("New mail arrived in %s since the last fetch", folder)
+                return True
+            
+            tag = _imap_start_idle(mail)
+            deadline = time.monotonic() + timeout
+            while True:
                 try:
-                    from email.utils import parsedate_to_datetime
-                    email_date = parsedate_to_datetime(date)
-                    age_days = (datetime.now(email_date.tzinfo) - email_date).days
-                    
-                    # Skip emails older than days_back
-                    if age_days > days_back:
-                        print(f"Skipping old email from {age_days} days ago: {subject}")
-                        continue
-                except Exception as e:
-                    print(f"Could not parse date for email: {e}")
-                
-                # Extract the email body
-                body = self._get_email_body(msg)
-                
-                # Create email dictionary with threading information
-                email_data = {
-                    'id': email_id.decode(),
-                    'message_id': message_id,      # Include Message-ID
-                    'references': references,       # Include References
-                    'in_reply_to': in_reply_to,   # Include In-Reply-To
-                    'from': from_address,
-                    'to': to_address,
-                    'subject': subject,
-                    'date': date,
-                    'body': body
-                }
-                
-                emails.append(email_data)
+                    line = _imap_read_line(mail, max(deadline - time.monotonic(), 0.001))
+                except socket.timeout:
+                    # A socket file can't be read after a timeout, so this
+                    # connection is closed and replaced on the next call
+                    self._drop_imap()
+                    return False
                 
-                # For debugging purposes
-                print(f"Fetched email: {subject} from {from_address} (Date: {date})")
+                if not line or line.startswith(b'* BYE'):
+                    raise imaplib.IMAP4.abort("Server closed the connection")
+                if line.rstrip().endswith(b'EXISTS'):
+                    break
+            
+            _imap_end_idle(mail, tag)
+            logger.debug("New mail arrived in %s", folder)
+            return True
+            
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.error("Error waiting for new mail: %s", e)
+            # Don't reuse a connection in an unknown state
+            self._drop_imap()
+            time.sleep(poll_interval)
+            return False
+    
+    async def fetch_emails_async(self, limit=2, unread_only=True, folder='inbox', days_back=7,
+                                 batch_size=100, connections=3, exclude=()):
+        """
+        Fetch emails like fetch_emails, without blocking the event loop.
+        
+        With aioimaplib installed the matching message IDs are split into up
+        to `connections` shards, each fetched over its own IMAP connection
+        concurrently. Without it, fetch_emails runs in a worker thread.
+        
+        Args:
+            limit (int): Maximum number of emails to fetch
+            unread_only (bool): Whether to fetch only unread emails
+            folder (str): Mailbox folder to fetch from
+            days_back (int): Number of days to look back for emails
+            batch_size (int): Maximum number of messages per FETCH command
+            connections (int): Maximum number of parallel IMAP connections
+                (servers limit connections per client, so keep this small)
+            exclude (collection): IDs of emails to leave out, as in fetch_emails
+            
+        Returns:
+            list: List of email dictionaries with threading information
+        """
+        if aioimaplib is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                self.fetch_emails, limit, unread_only, folder, days_back, batch_size, exclude
+            ))
+        
+        opened = []
+        try:
+            mail, uidvalidity = await self._open_async_imap(folder)
+            opened.append(mail)
+            
+            # Search for emails with date filter (by UID, see fetch_emails)
+            search_criteria = self._search_criteria(unread_only, days_back)
+            logger.debug("Searching for emails: %s", search_criteria)
+            response = await mail.uid_search(search_criteria, charset=None)
+            
+            if response.result != 'OK':
+                logger.error("Error searching for emails: %s", response.result)
+                return []
+            
+            email_ids = self._select_email_ids(response.lines[0], limit, uidvalidity, exclude)
+            if not email_ids:
+                logger.debug("No emails found in the last %s days", days_back)
+                return []
+            
+            # Split into contiguous shards so results stay newest first
+            shard_count = max(1, min(connections, len(email_ids) // batch_size + 1))
+            shard_size = -(-len(email_ids) // shard_count)
+            shards = [email_ids[i:i + shard_size] for i in range(0, len(email_ids), shard_size)]
             
-            # Close the connection properly
-            mail.close()
-            mail.logout()
+            # The search connection handles the first shard, open the others concurrently
+            for conn, _ in await asyncio.gather(*(self._open_async_imap(folder) for _ in shards[1:])):
+                opened.append(conn)
             
-            print(f"Successfully fetched {len(emails)} recent email(s)")
+            now = datetime.now().timestamp()
+            results = await asyncio.gather(*(
+                self._fetch_shard_async(conn, shard, batch_size, days_back, now, uidvalidity)
+                for conn, shard in zip(opened, shards)
+            ))
+            
+            emails = [email_data for shard_emails in results for email_data in shard_emails]
+            logger.debug("Successfully fetched %s recent email(s)", len(emails))
             return emails
             
         except Exception as e:
-            print(f"Error fetching emails: {str(e)}")
+            logger.error("Error fetching emails: %s", e)
             return []
+        finally:
+            for conn in opened:
+                try:
+                    await conn.logout()
+                except Exception:
+                    pass
+    
+    async def _open_async_imap(self, folder):
+        """
+        Open, log in and select a folder on a new aioimaplib connection.
+        
+        Returns:
+            tuple: (connection, the folder's UIDVALIDITY or None)
+        """
+        mail = aioimaplib.IMAP4_SSL(self.config['imap_server'], self.config['imap_port'])
+        await mail.wait_hello_from_server()
+        await mail.login(self.config['email_address'], self.config['email_password'])
+        response = await mail.select(folder)
+        return mail, _parse_uidvalidity(response.lines)
+    
+    async def _fetch_shard_async(self, mail, email_ids, batch_size, days_back, now, uidvalidity):
+        """Fetch one shard of message UIDs in batches over an aioimaplib connection."""
+        emails = []
+        for start in range(0, len(email_ids), batch_size):
+            batch = email_ids[start:start + batch_size]
+            message_set = b','.join(batch).decode()
+            
+            response = await mail.uid('fetch', message_set, _FETCH_ITEMS)
+            if response.result != 'OK':
+                logger.error("Error fetching email IDs %s: %s", message_set, response.result)
+                continue
+            
+            fetched = self._parse_fetch_response(_fetch_lines_to_data(response.lines))
+            parsed, needs_full = self._parse_batch(batch, fetched)
+            
+            # Messages whose text is not in the first part need the full walk
+            if needs_full:
+                full_set = b','.join(needs_full).decode()
+                response = await mail.uid('fetch', full_set, _FETCH_FULL_ITEMS)
+                if response.result == 'OK':
+                    full = self._parse_fetch_response(_fetch_lines_to_data(response.lines))
+                    self._add_full_messages(parsed, full)
+                else:
+                    logger.error("Error fetching email IDs %s: %s", full_set, response.result)
+            
+            emails.extend(self._build_batch_emails(batch, parsed, days_back, now, uidvalidity))
+        return emails
+    
+    def _search_criteria(self, unread_only, days_back):
+        """Build the IMAP SEARCH criteria for recent (and optionally unread) emails."""
+        # Calculate date for filtering - only get recent emails
+        since_date = (datetime.now() - timedelta(days=days_back)).strftime("%d-%b-%Y")
+        
+        search_parts = []
+        if unread_only:
+            search_parts.append('UNSEEN')
+        search_parts.append(f'SINCE {since_date}')
+        
+        return f'({" ".join(search_parts)})'
+    
+    def _select_email_ids(self, search_result, limit, uidvalidity, exclude=()):
+        """Turn a UID SEARCH result into the list of UIDs to fetch, newest first."""
+        email_ids = list(reversed(search_result.split()))  # Newest first
+        
+        # Skip emails that were already processed (or are excluded) before
+        # any FETCH; this has to happen before the limit, or they would use it up
+        if exclude and email_ids:
+            email_ids = [uid for uid in email_ids if _email_key(uidvalidity, uid) not in exclude]
+        if self.tracker is not None and email_ids:
+            keys = {_email_key(uidvalidity, uid): uid for uid in email_ids}
+            email_ids = [keys[key] for key in self.tracker.filter_unprocessed(list(keys))]
+        
+        # Limit the number of emails to process
+        if limit > 0:
+            email_ids = email_ids[:limit]
+        return email_ids
+    
+    def _parse_batch(self, batch, fetched):
+        """
+        Rebuild the messages of a batch from their fetched sections.
+        
+        Returns:
+            tuple: ({message ID: (message, body)}, [IDs that need the full message])
+        """
+        parsed = {}
+        needs_full = []
+        for email_id in batch:
+            if email_id not in fetched:
+                continue
+            result = self._message_from_sections(fetched[email_id])
+            if result is None:
+                needs_full.append(email_id)
+            else:
+                parsed[email_id] = result
+        return parsed, needs_full
+    
+    def _add_full_messages(self, parsed, fetched):
+        """Parse fully fetched messages (BODY[]) into `parsed`."""
+        for email_id, sections in fetched.items():
+            if 'BODY[]' in sections:
+                msg = email.message_from_bytes(sections['BODY[]'])
+                parsed[email_id] = (msg, self._get_email_body(msg))
+    
+    def _build_batch_emails(self, batch, parsed, days_back, now, uidvalidity):
+        """Build the email dictionaries of a batch in the batch's (newest first) order."""
+        emails = []
+        for uid in batch:
+            if uid not in parsed:
+                logger.error("Error fetching email UID %s: not returned by server", uid.decode())
+                continue
+            
+            msg, body = parsed[uid]
+            email_data = self._build_email_data(
+                _email_key(uidvalidity, uid), msg, body, days_back, now
+            )
+            if email_data is not None:
+                emails.append(email_data)
+        return emails
+    
+    def _parse_fetch_response(self, data):
+        """
+        Group the sections of a multi-message FETCH response by message.
+        
+        imaplib returns a flat list where each message contributes one
+        (descriptor, payload) tuple per fetched section, followed by a b')'
+        terminator. The descriptor of a message's first section starts with
+        its sequence number, e.g. b'3 (UID 1042 BODY[HEADER] {1234}', later
+        ones only carry the section name, e.g. b' BODY[1] {56}'. Depending on
+        the server, the UID can also come last, e.g. b' UID 1042)'.
+        
+        Messages are always fetched by UID, so a response without one is an
+        unsolicited FETCH (e.g. a flag change) and is skipped: its sequence
+        number could equal the UID of a fetched message.
+        
+        Returns:
+            dict: UID (bytes) -> {section name (str): payload (bytes)}
+        """
+        messages = []
+        current = None
+        for item in data:
+            descriptor = item[0] if isinstance(item, tuple) else item
+            if not isinstance(descriptor, (bytes, bytearray)):
+                continue
+            
+            match = _FETCH_ID_RE.match(descriptor)
+            if match:
+                current = {'seq': match.group(1), 'uid': None, 'sections': {}}
+                messages.append(current)
+            if current is None:
+                continue
+            
+            uid = _FETCH_UID_RE.search(descriptor)
+            if uid:
+                current['uid'] = uid.group(1)
+            
+            if isinstance(item, tuple):
+                section = _FETCH_SECTION_RE.search(descriptor)
+                if section:
+                    current['sections'][section.group(1).decode()] = item[1]
+        
+        return {message['uid']: message['sections'] for message in messages if message['uid']}
+    
+    def _message_from_sections(self, sections):
+        """
+        Rebuild a message and its body from the HEADER and first part sections.
+        
+        Returns:
+            tuple: (message, body), or None if the body is not in the first
+                part and the full message has to be fetched
+        """
+        header = sections.get('BODY[HEADER]')
+        if header is None:
+            return None
+        
+        first_part = sections.get('BODY[1]', b'')
+        msg = email.message_from_bytes(header)
+        
+        # For single part messages part 1 is the whole body
+        if msg.get_content_maintype() != 'multipart':
+            msg = email.message_from_bytes(header + first_part)
+            return msg, self._get_email_body(msg)
+        
+        # Multipart: usable only if part 1 is the plain text _get_email_body would pick
+        part = email.message_from_bytes(sections.get('BODY[1.MIME]', b'') + first_part)
+        if part.get_content_type() != 'text/plain' or "attachment" in str(part.get("Content-Disposition", "")):
+            return None
+        return msg, self._get_email_body(part)
+    
+    def _build_email_data(self, email_id, msg, body, days_back, now):
+        """
+        Build the email dictionary for a parsed message and its body.
+        
+        Args:
+            email_id (str): Stable message key ("<UIDVALIDITY>:<UID>")
+            days_back (int): Emails older than this many days are skipped
+            now (float): Current UNIX timestamp, taken once per fetch
+            
+        Returns:
+            dict: Email data with threading information, or None if the
+                email is older than days_back
+        """
+        # Extract email headers including Message-ID for threading
+        subject = self._decode_header(msg['subject'])
+        from_address = self._decode_header(msg['from'])
+        to_address = self._decode_header(msg['to'])
+        date = msg['date']
+        message_id = msg.get('Message-ID', '')  # Extract Message-ID
+        references = msg.get('References', '')   # Extract References
+        in_reply_to = msg.get('In-Reply-To', '') # Extract In-Reply-To
+        
+        # The server already filtered with SINCE (day granularity only), so
+        # this is a cheap timestamp comparison rather than a datetime parse
+        parsed_date = parsedate_tz(date)
+        if parsed_date is None:
+            logger.warning("Could not parse date for email: %s", date)
+        else:
+            age_days = int((now - mktime_tz(parsed_date)) // 86400)
+            
+            # Skip emails older than days_back
+            if age_days > days_back:
+                logger.debug("Skipping old email from %s days ago: %s", age_days, subject)
+                return None
+        
+        # Create email dictionary with threading information
+        email_data = {
+            'id': email_id,
+            'message_id': message_id,      # Include Message-ID
+            'references': references,       # Include References
+            'in_reply_to': in_reply_to,   # Include In-Reply-To
+            'from': from_address,
+            'to': to_address,
+            'subject': subject,
+            'date': date,
+            'body': body
+        }
+        
+        logger.debug("Fetched email: %s from %s (Date: %s)", subject, from_address, date)
+        
+        return email_data
     
     def _decode_header(self, header_value):
         """
@@ -163,20 +929,18 @@ class EmailProcessor:
         """
         if header_value is None:
             return ""
+        
+        # Plain ASCII headers (no encoded words) need no decoding
+        if isinstance(header_value, str) and '=?' not in header_value:
+            return header_value
             
         try:
-            decoded_parts = []
-            for part, encoding in decode_header(header_value):
-                if isinstance(part, bytes):
-                    if encoding:
-                        decoded_parts.append(part.decode(encoding or 'utf-8', errors='replace'))
-                    else:
-                        decoded_parts.append(part.decode('utf-8', errors='replace'))
-                else:
-                    decoded_parts.append(part)
-            return ''.join(decoded_parts)
+            if isinstance(header_value, str):
+                return _decode_encoded_header(header_value)
+            # Header objects are unhashable, so they bypass the cache
+            return _decode_encoded_header.__wrapped__(header_value)
         except Exception as e:
-            print(f"Error decoding header: {str(e)}")
+            logger.error("Error decoding header: %s", e)
             return header_value
     
     def _get_email_body(self, msg):
@@ -186,10 +950,19 @@ class EmailProcessor:
         body = ""
         
         if msg.is_multipart():
+            # Only the chosen part is ever decoded: the first plain text part,
+            # or failing that the first HTML part. Attachments and other parts
+            # are skipped on their content type without touching the payload.
+            html_parts = []
             for part in msg.walk():
+                if part.is_multipart():
+                    continue
+                
                 content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition", ""))
+                if content_type != "text/plain" and content_type != "text/html":
+                    continue
                 
+                content_disposition = str(part.get("Content-Disposition", ""))
                 if "attachment" in content_disposition:
                     continue
                 
@@ -199,25 +972,29 @@ class EmailProcessor:
                         body = part.get_payload(decode=True).decode(charset, errors="replace")
                         break
                     except Exception as e:
-                        print(f"Error decoding email body: {str(e)}")
+                        logger.error("Error decoding email body: %s", e)
                         continue
-                        
-                elif content_type == "text/html" and not body:
+                
+                html_parts.append(part)
+            else:
+                # No plain text part - convert the HTML instead
+                for part in html_parts:
                     try:
                         charset = part.get_content_charset() or "utf-8"
                         html_body = part.get_payload(decode=True).decode(charset, errors="replace")
-                        # Convert HTML to plain text (basic conversion)
-                        import re
-                        body = re.sub('<[^<]+?>', '', html_body)
+                        # Convert HTML to plain text
+                        body = _html_to_text(html_body)
                     except Exception as e:
-                        print(f"Error decoding HTML body: {str(e)}")
+                        logger.error("Error decoding HTML body: %s", e)
                         continue
+                    if body:
+                        break
         else:
             try:
                 charset = msg.get_content_charset() or "utf-8"
                 body = msg.get_payload(decode=True).decode(charset, errors="replace")
             except Exception as e:
-                print(f"Error decoding simple email body: {str(e)}")
+                logger.error("Error decoding simple email body: %s", e)
         
         return body
     
@@ -243,65 +1020,165 @@ class EmailProcessor:
             bool: Success status
         """
         try:
-            # Create a multipart message with proper structure
-            if use_html:
-                msg = MIMEMultipart('alternative')
-            else:
-                msg = MIMEMultipart()
-            
-            # Set message headers
-            msg['From'] = from_address or self.config['email_address']
-            msg['To'] = to_address
-            msg['Subject'] = subject  # Subject in header, not body
-            
-            # Add threading headers for proper email chain
-            if message_id:
-                msg['In-Reply-To'] = message_id
-                # Build References header (original message + any previous references)
-                if references:
-                    msg['References'] = f"{references} {message_id}"
-                else:
-                    msg['References'] = message_id
-            
-            # Add CC if provided
-            if cc_address:
-                msg['Cc'] = cc_address
-            
-            # IMPORTANT: Clean the body - remove any "Subject:" lines that shouldn't be there
-            cleaned_body = self._clean_email_body(body)
-            
-            # Add plain text version
-            text_part = MIMEText(cleaned_body, 'plain', 'utf-8')
-            msg.attach(text_part)
-            
-            # Add HTML version for better formatting
-            if use_html:
-                # Convert markdown-style formatting to HTML
-                html_body = self._convert_to_html(cleaned_body)
-                html_part = MIMEText(html_body, 'html', 'utf-8')
-                msg.attach(html_part)
-            
-            # Connect to the SMTP server
-            server = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'])
-            server.starttls()
-            server.login(self.config['email_address'], self.config['email_password'])
+            msg = self._build_message(to_address, subject, body, from_address,
+                                      cc_address, message_id, references, use_html)
             
             # Determine all recipients
             recipients = [to_address]
             if cc_address:
                 recipients.extend([cc for cc in cc_address.split(',') if cc.strip()])
             
-            # Send the message
-            server.send_message(msg)
-            server.quit()
+            with self._smtp_lock:
+                # Connect to the SMTP server (reuses the open connection if any)
+                server = self._get_smtp()
+                
+                # Send the message
+                try:
+                    server.send_message(msg)
+                except Exception:
+                    # Don't reuse a connection in an unknown state
+                    self._smtp = None
+                    raise
             
-            print(f"Email sent successfully to {to_address} (threaded: {bool(message_id)})")
+            logger.debug("Email sent successfully to %s (threaded: %s)", to_address, bool(message_id))
             return True
             
         except Exception as e:
-            print(f"Error sending email: {str(e)}")
+            logger.error("Error sending email: %s", e)
             return False
     
+    async def send_email_async(self, to_address, subject, body, from_address=None,
+                               cc_address=None, message_id=None, references=None, use_html=False):
+        """
+        Send an email response like send_email, without blocking the event loop.
+        
+        Uses one aiosmtplib connection, kept open and shared by concurrent
+        calls (SMTP is stateful, so sends on it take turns). Without
+        aiosmtplib, send_email runs in a worker thread.
+        
+        Returns:
+            bool: Success status
+        """
+        if aiosmtplib is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                self.send_email, to_address, subject, body, from_address,
+                cc_address, message_id, references, use_html
+            ))
+        
+        msg = self._build_message(to_address, subject, body, from_address,
+                                  cc_address, message_id, references, use_html)
+        
+        async with self._get_async_smtp_lock():
+            try:
+                server = await self._get_async_smtp()
+                await server.send_message(msg)
+            except Exception as e:
+                logger.error("Error sending email: %s", e)
+                # Don't reuse a connection in an unknown state
+                self._async_smtp = None
+                return False
+        
+        logger.debug("Email sent successfully to %s (threaded: %s)", to_address, bool(message_id))
+        return True
+    
+    async def fetch_emails_while_sending(self, replies, **fetch_kwargs):
+        """
+        Fetch the next emails while previously generated replies are sent.
+        
+        The IMAP fetch and the SMTP sends run concurrently, so a cycle takes
+        about as long as the slower of the two instead of their sum.
+        
+        Args:
+            replies (list): Keyword argument dicts for send_email_async
+            **fetch_kwargs: Arguments for fetch_emails_async
+            
+        Returns:
+            tuple: (fetched emails, list of send results in `replies` order)
+        """
+        results = await asyncio.gather(
+            self.fetch_emails_async(**fetch_kwargs),
+            *(self.send_email_async(**reply) for reply in replies)
+        )
+        return results[0], list(results[1:])
+    
+    def _get_async_smtp_lock(self):
+        """Return the lock serializing sends on the async SMTP connection for this event loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_smtp_loop is not loop:
+            # Connections and locks can't be shared between event loops
+            self._async_smtp_loop = loop
+            self._async_smtp_lock = asyncio.Lock()
+            self._async_smtp = None
+        return self._async_smtp_lock
+    
+    async def _get_async_smtp(self):
+        """Return a logged-in aiosmtplib connection, reusing the previous one if it is still alive."""
+        if self._async_smtp is not None and self._async_smtp.is_connected:
+            return self._async_smtp
+        
+        server = aiosmtplib.SMTP(
+            hostname=self.config['smtp_server'],
+            port=self.config['smtp_port'],
+            start_tls=True,
+            username=self.config['email_address'],
+            password=self.config['email_password'],
+        )
+        await server.connect()
+        self._async_smtp = server
+        return server
+    
+    def _build_message(self, to_address, subject, body, from_address=None,
+                       cc_address=None, message_id=None, references=None, use_html=False):
+        """
+        Build the MIME message for a reply, including threading headers.
+        
+        Returns:
+            MIMEMultipart: The message ready to send
+        """
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
+        # Create a multipart message with proper structure
+        if use_html:
+            msg = MIMEMultipart('alternative')
+        else:
+            msg = MIMEMultipart()
+        
+        # Set message headers
+        msg['From'] = from_address or self.config['email_address']
+        msg['To'] = to_address
+        msg['Subject'] = subject  # Subject in header, not body
+        
+        # Add threading headers for proper email chain
+        if message_id:
+            msg['In-Reply-To'] = message_id
+            # Build References header (original message + any previous references)
+            if references:
+                msg['References'] = f"{references} {message_id}"
+            else:
+                msg['References'] = message_id
+        
+        # Add CC if provided
+        if cc_address:
+            msg['Cc'] = cc_address
+        
+        # IMPORTANT: Clean the body - remove any "Subject:" lines that shouldn't be there
+        cleaned_body = self._clean_email_body(body)
+        
+        # Add plain text version
+        text_part = MIMEText(cleaned_body, 'plain', 'utf-8')
+        msg.attach(text_part)
+        
+        # Add HTML version for better formatting
+        if use_html:
+            # Convert markdown-style formatting to HTML
+            html_body = self._convert_to_html(cleaned_body)
+            html_part = MIMEText(html_body, 'html', 'utf-8')
+            msg.attach(html_part)
+        
+        return msg
+    
     def _clean_email_body(self, body):
         """
         Remove any subject lines or email headers that might have been included in the body.
@@ -310,33 +1187,15 @@ class EmailProcessor:
         """
         if not body:
             return body
-            
-        # Split into lines for processing
-        lines = body.split('\n')
-        cleaned_lines = []
-        skip_next_empty = False
-        
-        for i, line in enumerate(lines):
-            # Check if this line looks like an email header
-            if (line.strip().startswith('Subject:') or 
-                line.strip().startswith('From:') or 
-                line.strip().startswith('To:') or 
-                line.strip().startswith('Date:') or 
-                line.strip().startswith('Re:')):
-                # Skip this line and potentially the next empty line
-                skip_next_empty = True
-                continue
-            
-            # Skip empty line immediately after a removed header
-            if skip_next_empty and line.strip() == '':
-                skip_next_empty = False
-                continue
-            
-            skip_next_empty = False
-            cleaned_lines.append(line)
         
-        # Join back and clean up any leading/trailing whitespace
-        cleaned_body = '\n'.join(cleaned_lines).strip()
+        # Most bodies contain no header name at all; a substring search for
+        # each is cheaper than the line-by-line regex
+        if not any(prefix in body for prefix in _HEADER_PREFIXES):
+            return body.strip() or body
+            
+        # Drop header-like lines (and one blank line after each) in a single pass,
+        # then clean up any leading/trailing whitespace
+        cleaned_body = _HEADER_LINE_RE.sub('', body).strip()
         
         # If the body starts with "Dear" or "Hello" after cleaning, it's probably correct
         # Otherwise, if it seems to start mid-sentence, preserve original
@@ -351,6 +1210,16 @@ class EmailProcessor:
         
         Converts markdown formatting to HTML for better email presentation.
         """
+        # Convert markdown-style formatting; bold goes first so "__x__" is not
+        # read as two italic markers (one pass per style instead of per marker)
+        text = _BOLD_RE.sub(_bold_to_html, text)
+        text = _ITALIC_RE.sub(_italic_to_html, text)
+        
+        # Convert line breaks to paragraphs
+        paragraphs = ''.join(
+            f"<p>{para.strip()}</p>\n" for para in text.split('\n\n') if para.strip()
+        )
+        
         # Basic HTML template
         html = f"""
         <html>
@@ -361,24 +1230,7 @@ class EmailProcessor:
             </style>
         </head>
         <body>
-        """
-        
-        # Convert markdown-style formatting
-        # Bold
-        text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text)
-        text = re.sub(r'__(.*?)__', r'<strong>\1</strong>', text)
-        
-        # Italic
-        text = re.sub(r'\*(.*?)\*', r'<em>\1</em>', text)
-        text = re.sub(r'_(.*?)_', r'<em>\1</em>', text)
-        
-        # Convert line breaks to paragraphs
-        paragraphs = text.split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                html += f"<p>{para.strip()}</p>\n"
-        
-        html += """
+        {paragraphs}
         </body>
         </html>
         """
@@ -406,119 +1258,88 @@ class EmailProcessor:
         if sender_name:
             parsed['sender_name'] = sender_name
         
+        # Find all category and sentiment keywords in one scan
+        found = self._find_keywords(parsed)
+        
         # Determine email category based on subject and body
-        category, keywords = self._categorize_email(parsed)
+        category, keywords = self._categorize_email(parsed, found)
         parsed['category'] = category
         parsed['matched_keywords'] = keywords
         
         # Determine email sentiment
-        sentiment = self._analyze_sentiment(parsed)
+        sentiment = self._analyze_sentiment(parsed, found)
         parsed['sentiment'] = sentiment
         
         # Determine priority based on content and sentiment
         priority = self._determine_priority(parsed, category, sentiment)
         parsed['priority'] = priority
         
-        print(f"Email categorized as: {category} (Priority: {priority}, Sentiment: {sentiment})")
-        print(f"Matched keywords: {', '.join(keywords) if keywords else 'None'}")
+        logger.debug("Email categorized as: %s (Priority: %s, Sentiment: %s)", category, priority, sentiment)
+        logger.debug("Matched keywords: %s", ', '.join(keywords) if keywords else 'None')
         
         return parsed
     
+    def parse_and_sanitize(self, email_data):
+        """
+        Parse an email for response generation and sanitize it in one call.
+        
+        The keyword scan and the sanitizing pass each read the body once, and
+        the sanitized email shares every field but the body with the parsed one.
+        
+        Args:
+            email_data: The fetched email
+        
+        Returns:
+            tuple: (parsed email, sanitized email for the Gemini prompt)
+        """
+        parsed = self.parse_email_for_response(email_data)
+        return parsed, sanitize_email_for_response(parsed)
+    
     def _extract_sender_name(self, from_address):
         """Extract the sender's name from an email address."""
-        if '<' in from_address and '>' in from_address:
-            match = re.search(r'^"?([^"<]+)"?\s*<[^>]+>$', from_address)
-            if match:
-                return match.group(1).strip()
-        return None
+        return _parse_sender_name(from_address)
     
-    def _categorize_email(self, email_data):
-        """Categorize email based on content analysis."""
-        subject = email_data.get('subject', '').lower()
-        body = email_data.get('body', '').lower()
-        text = f"{subject} {body}"
-        
-        categories = {
-            'complaint': [
-                'complaint', 'disappointed', 'unhappy', 'terrible', 'awful', 'poor', 
-                'unsatisfied', 'frustrated', 'upset', 'angry', 'annoyed', 'dissatisfied',
-                'problem with', 'not working', 'does not work', 'failed', 'failing',
-                'issue with', 'bad experience', 'bad service', 'poor quality'
-            ],
-            'product_support': [
-                'login', 'password', 'error', 'not working', 'help', 'how to', 'does not work',
-                'broken', 'bug', 'technical', 'support', 'assistance', 'problem',
-                'troubleshoot', 'issue', 'fix', 'solution'
-            ],
-            'feature_request': [
-                'feature', 'suggestion', 'improve', 'enhancement', 'add', 'missing', 
-                'should have', 'would be nice', 'could you add', 'please include',
-                'consider adding', 'new feature', 'functionality', 'capability'
-            ],
-            'billing_question': [
-                'bill', 'charge', 'payment', 'refund', 'subscription', 'price', 'cost',
-                'discount', 'invoice', 'credit card', 'transaction', 'receipt',
-                'cancellation', 'renewal', 'billing', 'charged', 'fee', 'pricing'
-            ],
-            'general_feedback': [
-                'thank', 'great', 'love', 'awesome', 'excellent', 'amazing', 'good',
-                'appreciate', 'feedback', 'enjoyed', 'wonderful', 'fantastic',
-                'satisfied', 'helpful', 'impressive'
-            ],
-            'urgent_request': [
-                'urgent', 'emergency', 'asap', 'immediate', 'critical', 'important',
-                'time sensitive', 'deadline', 'quickly', 'rush', 'priority', 'immediately',
-                'as soon as possible', 'promptly', 'fast', 'today'
-            ],
-            'spam': [
-                'lottery', 'million dollars', 'bitcoin', 'investment opportunity',
-                'inheritance', 'claim your', 'free money',
-                'winner', 'jackpot', 'casino', 'earn money fast', 'get rich'
-            ]
-        }
+    def _find_keywords(self, email_data):
+        """
+        Find which category and sentiment keywords occur in the email.
         
-        matched_category = None
-        matched_keywords = []
-        category_matches = {}
+        Returns:
+            set: Keywords found in the lowercased subject and body
+        """
+        text = f"{email_data.get('subject', '')} {email_data.get('body', '')}".lower()
         
-        for category, keywords in categories.items():
-            category_matches[category] = []
-            for keyword in keywords:
-                if keyword in text:
-                    category_matches[category].append(keyword)
-                    matched_keywords.append(keyword)
+        if _KEYWORD_AUTOMATON is None:
+            return {keyword for keyword in _ALL_KEYWORDS if keyword in text}
+        return {keyword for _, keyword in _KEYWORD_AUTOMATON.iter(text)}
+    
+    def _categorize_email(self, email_data, found=None):
+        """
+        Categorize email based on content analysis.
         
-        priority_order = ['urgent_request', 'complaint', 'billing_question', 'product_support', 
-                        'feature_request', 'spam', 'general_feedback', 'customer_inquiry']
+        Returns:
+            tuple: (category, keywords of that category found in the email)
+        """
+        if found is None:
+            found = self._find_keywords(email_data)
         
-        for category in priority_order:
-            if category in category_matches and category_matches[category]:
-                matched_category = category
-                break
+        # Walk the categories in priority order and stop at the first one
+        # with any matching keyword; lower-priority categories are never checked
+        for category in CATEGORY_PRIORITY:
+            matched_keywords = [
+                keyword for keyword in CATEGORY_KEYWORDS.get(category, ()) if keyword in found
+            ]
+            if matched_keywords:
+                return category, matched_keywords
         
-        if not matched_category:
-            return 'customer_inquiry', []
-            
-        return matched_category, matched_keywords
+        return 'customer_inquiry', []
     
-    def _analyze_sentiment(self, email_data):
+    def _analyze_sentiment(self, email_data, found=None):
         """Perform basic sentiment analysis on email content."""
-        text = f"{email_data.get('subject', '')} {email_data.get('body', '')}".lower()
-        
-        positive_words = [
-            'good', 'great', 'excellent', 'wonderful', 'amazing', 'love', 'like',
-            'happy', 'pleased', 'satisfied', 'thank', 'thanks', 'helpful', 'appreciate',
-            'awesome', 'fantastic', 'perfect', 'best', 'impressed'
-        ]
-        
-        negative_words = [
-            'bad', 'poor', 'terrible', 'awful', 'horrible', 'disappointed', 'upset',
-            'angry', 'unhappy', 'not working', 'problem', 'issue', 'broken', 'error',
-            'failed', 'wrong', 'worst', 'hate', 'dislike', 'annoyed', 'frustrating'
-        ]
+        if found is None:
+            found = self._find_keywords(email_data)
         
-        positive_count = sum(1 for word in positive_words if word in text)
-        negative_count = sum(1 for word in negative_words if word in text)
+        positive_count = sum(1 for word in POSITIVE_WORDS if word in found)
+        negative_count = sum(1 for word in NEGATIVE_WORDS if word in found)
         
         if positive_count > negative_count:
             return 'positive'
@@ -529,10 +1350,10 @@ class EmailProcessor:
     
     def _determine_priority(self, email_data, category, sentiment):
         """Determine the priority level of the email."""
-        if category in ['complaint', 'urgent_request']:
+        if category in HIGH_PRIORITY_CATEGORIES:
             return 'high'
         
-        if category in ['product_support', 'billing_question'] or sentiment == 'negative':
+        if category in MEDIUM_PRIORITY_CATEGORIES or sentiment == 'negative':
             return 'medium'
         
         return 'low'
\ No newline at end of file
@@ -5,14 +5,59 @@ Email tracking module to prevent duplicate processing and track email history.
 This module maintains a history of processed emails to prevent
 responding to the same email multiple times.
 
+The history is stored in a SQLite database so lookups are indexed and
+marking an email does not rewrite the whole history.
+
 Author: Linda Marin and Sawsan Abdulbari for HAMK Digital and Social Media Analytics
 Date: August 2025
 """
 
 import json
+import logging
 import os
+import sqlite3
+import threading
+import time
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, Set
+from typing import Dict, List, Set
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Seconds between cleanups of old history entries
+_CLEANUP_INTERVAL = 24 * 60 * 60
+
+# Older SQLite builds allow at most 999 parameters per statement
+_MAX_QUERY_PARAMS = 900
+
+# Hours of per-sender email counts kept in memory for count_sender_emails
+_SENDER_WINDOW_HOURS = 24
+
+# Table and indexes for the processed email history
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS emails (
+        email_id TEXT PRIMARY KEY,
+        processed_at TEXT NOT NULL,
+        subject TEXT,
+        sender TEXT,
+        category TEXT,
+        response_sent INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_emails_sender ON emails (sender, processed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_emails_processed_at ON emails (processed_at)",
+)
+
+
+def _timestamp(moment: datetime) -> str:
+    """Format a datetime as a fixed-width ISO string, so stored values sort chronologically."""
+    return moment.isoformat(timespec='microseconds')
+
+
+def _hour(moment: datetime) -> int:
+    """Number the hour a datetime falls in, for the per-sender counters."""
+    return int(moment.replace(minute=0, second=0, microsecond=0).timestamp()) // 3600
+
 
 class EmailTracker:
     """
@@ -24,55 +69,101 @@ class EmailTracker:
         Initialize the email tracker.
         
         Args:
-            history_file: Path to file storing processed email history
+            history_file: Path to the history file. A ".json" name is mapped to
+                the ".db" SQLite file next to it; an existing JSON history is
+                imported once.
             max_history_days: Number of days to keep email history
         """
         self.history_file = history_file
         self.max_history_days = max_history_days
-        self.processed_emails = self._load_history()
         
-    def _load_history(self) -> Dict:
-        """
-        Load email processing history from file.
+        # Recent emails per sender: a deque of [hour, count] buckets, loaded
+        # from the database the first time a sender is counted
+        self._sender_hours = {}
+        self._sender_lock = threading.Lock()
         
-        Returns:
-            Dictionary containing email history
-        """
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                # If file is corrupted, start fresh
-                return {"emails": {}, "last_cleanup": datetime.now().isoformat()}
+        if history_file.endswith('.json'):
+            self.db_file = history_file[:-len('.json')] + '.db'
         else:
-            return {"emails": {}, "last_cleanup": datetime.now().isoformat()}
+            self.db_file = history_file
+        
+        is_new = not os.path.exists(self.db_file)
+        
+        # Autocommit mode: every statement is its own atomic transaction.
+        # With WAL, synchronous=NORMAL only fsyncs at checkpoints instead of
+        # on every commit; a crash can lose the latest entries but never
+        # corrupts the history.
+        # check_same_thread=False: fetching may run in a worker thread
+        self.connection = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self.connection.execute(statement)
+        
+        if is_new and history_file != self.db_file:
+            self._import_json_history(history_file)
+        
+        self._cleanup_old_entries()
     
-    def _save_history(self):
-        """Save email processing history to file."""
+    def _import_json_history(self, json_file: str):
+        """
+        Import history written by the previous JSON-based tracker.
+        
+        Args:
+            json_file: Path to the old JSON history file
+        """
+        if not os.path.exists(json_file):
+            return
+        
         try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.processed_emails, f, indent=2)
-        except IOError as e:
-            print(f"Warning: Could not save email history: {e}")
+            with open(json_file, 'r') as f:
+                emails = json.load(f).get("emails", {})
+        except (json.JSONDecodeError, IOError, AttributeError):
+            # If file is corrupted, start fresh
+            return
+        
+        rows = [
+            (
+                email_id,
+                data.get("processed_at", _timestamp(datetime.now())),
+                data.get("subject", ""),
+                data.get("from", "").lower(),
+                data.get("category", "unknown"),
+                int(bool(data.get("response_sent"))),
+            )
+            for email_id, data in emails.items()
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO emails VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+        logger.info("Imported %s email entries from %s", len(rows), json_file)
     
     def _cleanup_old_entries(self):
         """Remove email entries older than max_history_days."""
-        cutoff_date = datetime.now() - timedelta(days=self.max_history_days)
-        emails_to_remove = []
+        cutoff = _timestamp(datetime.now() - timedelta(days=self.max_history_days))
+        removed = self.connection.execute(
+            "DELETE FROM emails WHERE processed_at < ?", (cutoff,)
+        ).rowcount
         
-        for email_id, data in self.processed_emails.get("emails", {}).items():
-            processed_date = datetime.fromisoformat(data.get("processed_at", datetime.now().isoformat()))
-            if processed_date < cutoff_date:
-                emails_to_remove.append(email_id)
+        if removed:
+            logger.info("Cleaned up %s old email entries", removed)
         
-        for email_id in emails_to_remove:
-            del self.processed_emails["emails"][email_id]
+        # Forget the counters of senders who have been quiet for the whole window
+        oldest = _hour(datetime.now()) - _SENDER_WINDOW_HOURS
+        with self._sender_lock:
+            for sender in [sender for sender, buckets in self._sender_hours.items()
+                           if not buckets or buckets[-1][0] <= oldest]:
+                del self._sender_hours[sender]
         
-        if emails_to_remove:
-            print(f"Cleaned up {len(emails_to_remove)} old email entries")
-            self.processed_emails["last_cleanup"] = datetime.now().isoformat()
-            self._save_history()
+        self.next_cleanup = time.monotonic() + _CLEANUP_INTERVAL
+    
+    def close(self):
+        """Write pending history to the database file and close it."""
+        if self.connection is not None:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.connection.close()
+            self.connection = None
     
     def is_processed(self, email_id: str) -> bool:
         """
@@ -80,11 +171,50 @@ class EmailTracker:
         
         Args:
             email_id: Unique identifier for the email
-            
+        
         Returns:
             True if email has been processed before
         """
-        return email_id in self.processed_emails.get("emails", {})
+        row = self.connection.execute(
+            "SELECT 1 FROM emails WHERE email_id = ?", (email_id,)
+        ).fetchone()
+        return row is not None
+    
+    def are_processed(self, email_ids: List[str]) -> Set[str]:
+        """
+        Find which of several emails have already been processed.
+        
+        Args:
+            email_ids: Unique identifiers of the emails
+        
+        Returns:
+            Set of the identifiers that have been processed before
+        """
+        processed = set()
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(email_ids), _MAX_QUERY_PARAMS):
+            chunk = email_ids[start:start + _MAX_QUERY_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT email_id FROM emails WHERE email_id IN ({placeholders})", chunk
+            )
+            processed.update(email_id for (email_id,) in rows)
+        return processed
+    
+    def filter_unprocessed(self, email_ids: List[str]) -> List[str]:
+        """
+        Drop the emails that have already been processed.
+        
+        Lets the processor skip fetching known emails entirely.
+        
+        Args:
+            email_ids: Unique identifiers of candidate emails
+            
+        Returns:
+            The identifiers not processed yet, in their original order
+        """
+        processed = self.are_processed(email_ids)
+        return [email_id for email_id in email_ids if email_id not in processed]
     
     def mark_as_processed(self, email_id: str, email_data: Dict, response_sent: bool = True):
         """
@@ -95,24 +225,37 @@ class EmailTracker:
             email_data: Email information
             response_sent: Whether a response was sent
         """
-        if "emails" not in self.processed_emails:
-            self.processed_emails["emails"] = {}
-        
-        self.processed_emails["emails"][email_id] = {
-            "processed_at": datetime.now().isoformat(),
-            "subject": email_data.get("subject", "")[:100],  # Store first 100 chars
-            "from": email_data.get("from", ""),
-            "category": email_data.get("category", "unknown"),
-            "response_sent": response_sent
-        }
-        
-        self._save_history()
-        
-        # Periodic cleanup
-        last_cleanup = datetime.fromisoformat(
-            self.processed_emails.get("last_cleanup", datetime.now().isoformat())
+        now = datetime.now()
+        sender = email_data.get("from", "").lower()
+        row = (
+            email_id,
+            _timestamp(now),
+            email_data.get("subject", "")[:100],  # Store first 100 chars
+            sender,
+            email_data.get("category", "unknown"),
+            int(response_sent),
         )
-        if (datetime.now() - last_cleanup).days >= 1:
+        # Under the lock, so that a sender's counters are not loaded between
+        # the insert and their update
+        with self._sender_lock:
+            inserted = self.connection.execute(
+                "INSERT OR IGNORE INTO emails VALUES (?, ?, ?, ?, ?, ?)", row
+            ).rowcount
+            buckets = self._sender_hours.get(sender)
+            if not inserted:
+                # Marked again: the entry moves to the current hour, so its
+                # sender's counters are reloaded on the next count
+                self.connection.execute("REPLACE INTO emails VALUES (?, ?, ?, ?, ?, ?)", row)
+                self._sender_hours.pop(sender, None)
+            elif buckets is not None:
+                hour = _hour(now)
+                if buckets and buckets[-1][0] == hour:
+                    buckets[-1][1] += 1
+                else:
+                    buckets.append([hour, 1])
+        
+        # Periodic cleanup (a float comparison, no datetime arithmetic per email)
+        if time.monotonic() >= self.next_cleanup:
             self._cleanup_old_entries()
     
     def get_processing_stats(self) -> Dict:
@@ -122,27 +265,20 @@ class EmailTracker:
         Returns:
             Dictionary containing processing statistics
         """
-        emails = self.processed_emails.get("emails", {})
-        
-        if not emails:
-            return {
-                "total_processed": 0,
-                "responses_sent": 0,
-                "categories": {}
-            }
-        
-        stats = {
-            "total_processed": len(emails),
-            "responses_sent": sum(1 for e in emails.values() if e.get("response_sent")),
-            "categories": {}
-        }
+        total, responses = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(response_sent), 0) FROM emails"
+        ).fetchone()
         
         # Count by category
-        for email_data in emails.values():
-            category = email_data.get("category", "unknown")
-            stats["categories"][category] = stats["categories"].get(category, 0) + 1
+        categories = dict(self.connection.execute(
+            "SELECT category, COUNT(*) FROM emails GROUP BY category"
+        ).fetchall())
         
-        return stats
+        return {
+            "total_processed": total,
+            "responses_sent": responses,
+            "categories": categories
+        }
     
     def get_recent_senders(self, hours: int = 24) -> Set[str]:
         """
@@ -151,39 +287,96 @@ class EmailTracker:
         
         Args:
             hours: Number of hours to look back
-            
+        
         Returns:
             Set of sender email addresses
         """
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        recent_senders = set()
-        
-        for email_data in self.processed_emails.get("emails", {}).values():
-            processed_time = datetime.fromisoformat(email_data.get("processed_at"))
-            if processed_time >= cutoff_time:
-                recent_senders.add(email_data.get("from", "").lower())
-        
-        return recent_senders
+        cutoff = _timestamp(datetime.now() - timedelta(hours=hours))
+        rows = self.connection.execute(
+            "SELECT DISTINCT sender FROM emails WHERE processed_at >= ?", (cutoff,)
+        )
+        return {sender for (sender,) in rows}
     
     def count_sender_emails(self, sender: str, hours: int = 24) -> int:
         """
         Count how many emails a sender has sent in the last N hours.
         
+        Up to 24 hours the count comes from in-memory hourly counters, so it
+        needs no query after a sender's first one; it covers the current
+        hour and the N - 1 hours before it.
+        
         Args:
             sender: Sender email address
             hours: Number of hours to look back
-            
+        
         Returns:
             Number of emails from this sender
         """
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        sender_lower = sender.lower()
-        count = 0
+        return self.count_sender_emails_batch([sender], hours)[sender.lower()]
+    
+    def count_sender_emails_batch(self, senders: List[str], hours: int = 24) -> Dict[str, int]:
+        """
+        Count how many emails each of several senders has sent in the last N hours.
+        
+        Senders not counted before are read from the database together,
+        with one query instead of one per sender.
+        
+        Args:
+            senders: Sender email addresses
+            hours: Number of hours to look back
         
-        for email_data in self.processed_emails.get("emails", {}).values():
-            processed_time = datetime.fromisoformat(email_data.get("processed_at"))
-            if processed_time >= cutoff_time:
-                if email_data.get("from", "").lower() == sender_lower:
-                    count += 1
+        Returns:
+            Dictionary mapping each lowercase sender address to its count
+        """
+        senders = list(dict.fromkeys(sender.lower() for sender in senders))
+        now = datetime.now()
+        if hours > _SENDER_WINDOW_HOURS:
+            counts = dict.fromkeys(senders, 0)
+            cutoff = _timestamp(now - timedelta(hours=hours))
+            for start in range(0, len(senders), _MAX_QUERY_PARAMS):
+                chunk = senders[start:start + _MAX_QUERY_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                counts.update(self.connection.execute(
+                    f"SELECT sender, COUNT(*) FROM emails "
+                    f"WHERE sender IN ({placeholders}) AND processed_at >= ? GROUP BY sender",
+                    (*chunk, cutoff)
+                ))
+            return counts
         
-        return count
\ No newline at end of file
+        current = _hour(now)
+        with self._sender_lock:
+            missing = [sender for sender in senders if sender not in self._sender_hours]
+            if missing:
+                self._sender_hours.update(self._load_sender_hours(missing, now))
+            return {
+                sender: sum(count for hour, count in self._sender_hours[sender] if hour > current - hours)
+                for sender in senders
+            }
+    
+    def _load_sender_hours(self, senders: List[str], now: datetime) -> Dict[str, deque]:
+        """
+        Read senders' hourly email counts for the last _SENDER_WINDOW_HOURS hours.
+        
+        Args:
+            senders: Lowercase sender email addresses
+            now: The current time
+        
+        Returns:
+            Dictionary mapping each sender to a deque of [hour, count]
+            buckets, oldest first
+        """
+        start = _timestamp(
+            now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=_SENDER_WINDOW_HOURS - 1)
+        )
+        hours = {sender: deque(maxlen=_SENDER_WINDOW_HOURS) for sender in senders}
+        for offset in range(0, len(senders), _MAX_QUERY_PARAMS):
+            chunk = senders[offset:offset + _MAX_QUERY_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT sender, substr(processed_at, 1, 13), COUNT(*) FROM emails "
+                f"WHERE sender IN ({placeholders}) AND processed_at >= ? GROUP BY 1, 2 ORDER BY 1, 2",
+                (*chunk, start)
+            )
+            for sender, hour, count in rows:
+                hours[sender].append([_hour(datetime.strptime(hour, '%Y-%m-%dT%H')), count])
+        return hours
@@ -13,12 +13,626 @@ Author: Linda Marin and Sawsan Abdulbari for HAMK Digital and Social Media Analy
 Date: August 2025
 """
 
-import google.generativeai as genai
+import asyncio
+import httpx
+from google import genai
+from google.genai import types
 from config import GEMINI_API_KEY, GEMINI_CONFIG
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import textwrap
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Optional: numpy plus an embedding backend enable the semantic response
+# cache. Without them every email goes to the API.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Optional: hnswlib narrows semantic cache lookups in large shards to a few
+# approximate nearest neighbours. Without it every entry is scored.
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Optional: onnxruntime runs an exported (e.g. int8-quantized) copy of the
+# embedding model, much faster on CPU than sentence-transformers/PyTorch
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:
+    onnxruntime = None
+    Tokenizer = None
+
+# Optional: h2 lets the API client use HTTP/2, so concurrent requests share
+# one connection. Without it each concurrent request has its own HTTP/1.1
+# connection.
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# Stand in for the sender's full and first name in cached responses, so a
+# response can be reused for a similar email from someone else
+_SENDER_PLACEHOLDER = "[[sender_name]]"
+_SENDER_FIRST_NAME_PLACEHOLDER = "[[sender_first_name]]"
+
+# Stands in for the sender's address in the prompt a cache key is built from
+_SENDER_ADDRESS_PLACEHOLDER = "[[sender_address]]"
+
+# Part of the response cache keys and semantic cache files: entries stored in
+# an older form (name placeholders that could still contain the sender's
+# name, body-only embeddings) are not used
+_TEMPLATE_VERSION = 3
+
+
+def _name_parts(sender_name):
+    """Split a sender's display name into its words ("Smith, Anna" -> Smith, Anna)."""
+    return re.findall(r'\w+', sender_name)
+
+
+def _replace_word(text, word, replacement):
+    """Replace a word or phrase only where it is not part of a longer word."""
+    return re.sub(r'(?<!\w)' + re.escape(word) + r'(?!\w)', replacement, text)
+
+
+def _contains_word(text, word):
+    """Check whether a word occurs in a text on its own, ignoring case."""
+    return re.search(r'(?<!\w)' + re.escape(word) + r'(?!\w)', text, re.IGNORECASE) is not None
+
+# Average length of a Gemini token in characters, for estimating prompt
+# sizes without an API call
+_CHARS_PER_TOKEN = 4
+
+# Appended to email bodies trimmed to fit max_input_tokens
+_TRUNCATION_MARKER = "\n[...truncated...]"
+
+# Nanoseconds in a minute, for the rate limiter
+_MINUTE_NS = 60_000_000_000
+
+# Idle connections to the API kept open, and for how many seconds (httpx
+# closes them after 5 seconds by default, so every check cycle would start
+# with a new TLS handshake)
+_KEEPALIVE_CONNECTIONS = 8
+_KEEPALIVE_EXPIRY = 300
+
+# Seconds between checks of a running batch job: doubles from the first
+# value up to the second
+_BATCH_POLL_START = 5
+_BATCH_POLL_MAX = 60
+
+# States in which a batch job has stopped running
+_BATCH_DONE_STATES = frozenset({
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+})
+
+# Semantic cache shards with this many entries get an hnswlib index; a
+# lookup then scores only the _ANN_CANDIDATES approximate nearest entries
+_ANN_MIN_ENTRIES = 10000
+_ANN_CANDIDATES = 32
+
+# Instructions for each email type. They are static text (no per-email
+# values), so every prompt of a type starts with the same bytes and
+# Gemini's implicit prompt caching can reuse the processed prefix.
+_DEFAULT_INSTRUCTIONS = """
+    You are a helpful customer support assistant. Generate a professional and empathetic response to the following email.
+    Address the sender by name if available. Be concise but thorough in your response.
+    Sign the email as 'Customer Support Team'.
+    
+    IMPORTANT: Generate ONLY the email body content. Do NOT include:
+    - Subject line or "Subject:" prefix
+    - "Re:" prefix
+    - Email headers (From:, To:, Date:)
+    - Any metadata
+    Just provide the body text starting with the greeting (e.g., "Dear [Name]," or "Hello,").
+"""
+
+_INSTRUCTIONS = {
+    "complaint": """
+        You are a professional customer support assistant handling a complaint. 
+        Generate a professional, apologetic, and solution-oriented response to the following complaint email.
+        
+        Guidelines:
+        1. Start by acknowledging the issue and apologizing sincerely
+        2. Show empathy for the sender's frustration
+        3. Explain what might have happened (if clear from the email)
+        4. Provide a specific solution or next steps
+        5. Offer some form of goodwill or compensation if appropriate
+        6. Thank them for bringing this to your attention
+        7. Sign off as 'Customer Support Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "product_support": """
+        You are a technical support specialist. Generate a professional, clear, and step-by-step response to 
+        the following support email.
+        
+        Guidelines:
+        1. Acknowledge the sender's issue
+        2. Provide clear, step-by-step instructions to solve the problem
+        3. Use simple, non-technical language when possible
+        4. Explain why your solution works (if relevant)
+        5. Offer alternative solutions if available
+        6. Invite them to reach out again if the issue persists
+        7. Sign off as 'Technical Support Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "feature_request": """
+        You are a product manager. Generate a thoughtful response to the following feature request email.
+        
+        Guidelines:
+        1. Thank the sender for their suggestion
+        2. Show appreciation for their engagement with the product
+        3. Give your impression of the idea (positively framed)
+        4. Explain if similar features are planned or already available
+        5. If appropriate, ask for more details about their use case
+        6. Set realistic expectations about implementation possibilities
+        7. Sign off as 'Product Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "billing_question": """
+        You are a billing specialist. Generate a professional, clear, and helpful response to 
+        the following billing question.
+        
+        Guidelines:
+        1. Address the sender's billing concern directly
+        2. Provide clear information about the billing process
+        3. If relevant, explain why charges appear as they do
+        4. Offer specific next steps if action is needed
+        5. Reassure them about data security
+        6. Provide contact information for further billing questions
+        7. Sign off as 'Billing Support Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "general_feedback": """
+        You are a customer experience manager. Generate a warm and appreciative response to 
+        the following feedback email.
+        
+        Guidelines:
+        1. Thank the sender enthusiastically for their feedback
+        2. Acknowledge specific positive points they mentioned
+        3. Explain how this feedback helps your team
+        4. Mention any relevant upcoming improvements
+        5. Invite them to continue providing feedback
+        6. Sign off warmly as 'Customer Experience Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "urgent_request": """
+        You are an urgent response specialist. Generate a prompt, clear, and action-oriented response to 
+        the following time-sensitive email.
+        
+        Guidelines:
+        1. Acknowledge the urgency of the sender's request
+        2. Provide immediate next steps or solutions
+        3. Be direct and concise
+        4. If you can't resolve immediately, explain exactly when they can expect resolution
+        5. Provide alternative contact methods for faster response
+        6. Sign off as 'Urgent Response Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "customer_inquiry": """
+        You are a customer support specialist. Generate a professional, informative response to 
+        the following inquiry email.
+        
+        Guidelines:
+        1. Greet the sender warmly
+        2. Answer their questions directly and completely
+        3. Provide relevant additional information they might find helpful
+        4. Include links or references to resources if relevant
+        5. Invite further questions
+        6. Sign off as 'Customer Support Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+    "spam": """
+        You are a security specialist. Generate a brief, professional response to what appears to be a 
+        spam or phishing email. Do not engage with specific claims in the email.
+        
+        Guidelines:
+        1. Be extremely brief and generic
+        2. Do not reference or acknowledge specific claims from the email
+        3. Provide general security advice
+        4. Do not include links or contact information
+        5. Sign off as 'Security Team'
+        
+        Remember: Generate ONLY the email body. NO subject lines or headers.
+    """,
+}
+_INSTRUCTIONS[None] = _INSTRUCTIONS["customer_inquiry"]
+
+
+@lru_cache(maxsize=16)
+def _prompt_prefix(email_type):
+    """
+    Get the static start of the prompts for an email type, built on first use.
+    
+    Only the types actually seen are materialized, once each.
+    
+    Args:
+        email_type (str): The type of email (None for a customer inquiry)
+        
+    Returns:
+        str: The dedented instructions, falling back to the general ones,
+            followed by the blank line before the email
+    """
+    return textwrap.dedent(_INSTRUCTIONS.get(email_type, _DEFAULT_INSTRUCTIONS)).strip() + "\n\n"
+
+
+# A header line the model added to the body (leading whitespace allowed),
+# together with one blank line directly after it
+_HEADER_LINE_RE = re.compile(
+    r'^[^\S\n]*(?:Subject:|From:|To:|Date:|Re:)[^\n]*(?:\n|\Z)(?:[^\S\n]*(?:\n|\Z))?',
+    re.MULTILINE
+)
+_HEADER_PREFIXES = ('Subject:', 'From:', 'To:', 'Date:', 'Re:')
+
+# Email types answered with a lower or higher temperature (see
+# GeminiEmailResponder._get_temperature_for_type)
+_PRECISE_TYPES = frozenset({'product_support', 'billing_question', 'urgent_request'})
+_BALANCED_TYPES = frozenset({'complaint'})
+_CREATIVE_TYPES = frozenset({'feature_request', 'general_feedback'})
+
+
+def _clean_stream(chunks):
+    """
+    Remove header lines from streamed text, like _HEADER_LINE_RE plus strip().
+    
+    Complete lines are checked as soon as they arrive. Whitespace is held
+    back until more text follows it, so leading and trailing whitespace of
+    the whole response is dropped as strip() would.
+    
+    Args:
+        chunks: Iterable of text pieces
+        
+    Yields:
+        str: The cleaned text, piece by piece
+    """
+    pending = ''  # incomplete last line
+    held = ''  # whitespace not yielded yet
+    started = False
+    skip_blank = False
+    
+    def clean_line(line):
+        nonlocal held, started, skip_blank
+        stripped = line.lstrip()
+        if stripped.startswith(_HEADER_PREFIXES):
+            skip_blank = True
+            return ''
+        if not stripped:
+            if skip_blank:
+                skip_blank = False
+            elif started:
+                held += line + '\n'
+            return ''
+        skip_blank = False
+        if not started:
+            line = stripped
+            started = True
+        content = line.rstrip()
+        text = held + content
+        held = line[len(content):] + '\n'
+        return text
+    
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split('\n')
+        text = ''.join(clean_line(line) for line in lines)
+        if text:
+            yield text
+    
+    text = clean_line(pending)
+    if text:
+        yield text
+
+
+class _ResponseCache:
+    """
+    Exact response cache: (model, generation parameters, prompt) -> response, in SQLite.
+    
+    Re-running the automation over the same emails (e.g. while testing)
+    then costs no API calls at all.
+    """
+    
+    def __init__(self, cache_file):
+        """
+        Initialize the cache. The database is opened on first use.
+        
+        Args:
+            cache_file (str): Path to the SQLite cache file
+        """
+        self.cache_file = cache_file
+        self.connection = None
+    
+    @staticmethod
+    def key(model_name, generation_config, prompt):
+        """
+        Build the cache key for a request.
+        
+        Args:
+            model_name (str): The Gemini model
+            generation_config (dict): The generation parameters
+            prompt (str): The complete prompt
+        """
+        parameters = sorted(generation_config.items())
+        return hashlib.sha256(f"{_TEMPLATE_VERSION}|{model_name}|{parameters}|{prompt}".encode()).hexdigest()
+    
+    def _connect(self):
+        """Open the cache database, creating the table if needed."""
+        if self.connection is None:
+            # check_same_thread=False: responses may be generated in worker threads
+            self.connection = sqlite3.connect(self.cache_file, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+            )
+        return self.connection
+    
+    def get(self, key):
+        """Return the cached response for a key, or None."""
+        row = self._connect().execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def put(self, key, response):
+        """Store the response generated for a key."""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, response)
+        )
+    
+    def close(self):
+        """Close the cache database if it was opened."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class _CacheShard:
+    """
+    The cached emails of one type: their vectors in one contiguous
+    (N, dim) float32 matrix, and the matching responses.
+    
+    The matrix grows by doubling its capacity, so adding an entry does not
+    copy all earlier ones. From _ANN_MIN_ENTRIES entries on, an hnswlib
+    index (if installed) picks a few candidates, which are then scored
+    exactly.
+    """
+    
+    def __init__(self, vectors, responses):
+        """
+        Initialize the shard.
+        
+        Args:
+            vectors: (N, dim) array of unit-length embeddings
+            responses (list): The N cached responses
+        """
+        self.count = len(vectors)
+        self._vectors = np.empty((max(self.count, 16), vectors.shape[1]), dtype=np.float32)
+        self._vectors[:self.count] = vectors
+        self.responses = list(responses)
+        self._index = None
+    
+    @property
+    def vectors(self):
+        """The stored vectors (without the unused capacity)."""
+        return self._vectors[:self.count]
+    
+    def add(self, vector, response):
+        """Append an entry, growing the matrix if it is full."""
+        if self.count == len(self._vectors):
+            grown = np.empty((2 * self.count, self._vectors.shape[1]), dtype=np.float32)
+            grown[:self.count] = self._vectors
+            self._vectors = grown
+            if self._index is not None:
+                self._index.resize_index(len(grown))
+        
+        self._vectors[self.count] = vector
+        self.responses.append(response)
+        if self._index is not None:
+            self._index.add_items(vector[np.newaxis], [self.count])
+        self.count += 1
+    
+    def best_match(self, vector):
+        """
+        Find the entry most similar to a vector.
+        
+        Returns:
+            tuple: (cosine similarity, entry position), or (None, None) if empty
+        """
+        if not self.count:
+            return None, None
+        
+        candidates = self._candidates(vector)
+        vectors = self.vectors if candidates is None else self._vectors[candidates]
+        similarities = vectors @ vector
+        best = int(similarities.argmax())
+        position = best if candidates is None else int(candidates[best])
+        return float(similarities[best]), position
+    
+    def _candidates(self, vector):
+        """Positions of the approximate nearest entries, or None to score all of them."""
+        if hnswlib is None or self.count < _ANN_MIN_ENTRIES:
+            return None
+        
+        if self._index is None:
+            self._index = hnswlib.Index(space="ip", dim=self._vectors.shape[1])
+            self._index.init_index(max_elements=len(self._vectors), ef_construction=200, M=16)
+            self._index.add_items(self.vectors, np.arange(self.count))
+            self._index.set_ef(4 * _ANN_CANDIDATES)
+        
+        labels, _ = self._index.knn_query(vector, k=_ANN_CANDIDATES)
+        return labels[0]
+
+
+class _SemanticCache:
+    """
+    Reuse generated responses for emails that say (nearly) the same thing.
+    
+    Emails (subject and body) are embedded with a sentence-transformers
+    model, or with an ONNX export of it run by onnxruntime. Each email type
+    has its own shard of normalized vectors, so a lookup is one matrix
+    product and the cosine similarity of the closest earlier email decides
+    whether its response is reused.
+    """
+    
+    def __init__(self, model_name="all-MiniLM-L6-v2", threshold=0.92, cache_file=None, onnx_model=None):
+        """
+        Initialize the cache, loading previously saved entries.
+        
+        Args:
+            model_name (str): sentence-transformers model for the embeddings
+            threshold (float): Minimum cosine similarity for a cache hit
+            cache_file (str, optional): .npz file the entries are saved to
+            onnx_model (str, optional): ONNX export of the model, with its
+                tokenizer.json in the same directory. Used instead of
+                sentence-transformers when given.
+        """
+        self.model_name = model_name
+        self.threshold = threshold
+        self.cache_file = cache_file
+        self.onnx_model = onnx_model
+        self._model = None  # loaded on first use, it takes a few seconds
+        self._tokenizer = None
+        self._model_lock = threading.Lock()  # embed() is called from worker threads
+        self._shards = {}  # email_type -> _CacheShard
+        self._dirty = False
+        
+        if cache_file and os.path.exists(cache_file):
+            self._load()
+    
+    def _load(self):
+        """Read the shards saved by save()."""
+        try:
+            with np.load(self.cache_file, allow_pickle=False) as data:
+                if "version" not in data.files or int(data["version"]) != _TEMPLATE_VERSION:
+                    # Responses from an older version may still contain a sender's name
+                    logger.info("Ignoring semantic cache written by an older version")
+                    return
+                for key in data.files:
+                    if key.startswith("vectors:"):
+                        email_type = key[len("vectors:"):]
+                        self._shards[email_type] = _CacheShard(
+                            data[key], data["responses:" + email_type].tolist()
+                        )
+        except (OSError, ValueError, KeyError) as e:
+            # If file is corrupted, start fresh
+            logger.warning("Could not load semantic cache: %s", e)
+            self._shards = {}
+    
+    def save(self):
+        """Write the shards to the cache file if anything was added."""
+        if not self.cache_file or not self._dirty:
+            return
+        
+        arrays = {"version": np.array(_TEMPLATE_VERSION)}
+        for email_type, shard in self._shards.items():
+            arrays["vectors:" + email_type] = shard.vectors
+            arrays["responses:" + email_type] = np.array(shard.responses, dtype=str)
+        with open(self.cache_file, "wb") as f:
+            np.savez(f, **arrays)
+        self._dirty = False
+    
+    def embed(self, text):
+        """
+        Embed the text of an email as a unit-length float32 vector.
+        
+        Whitespace is normalized first so that re-wrapped or re-quoted
+        copies of the same text map to the same vector.
+        """
+        text = " ".join(text.split())
+        if self._model is None:
+            self._load_model()
+        if self.onnx_model:
+            return self._embed_onnx(text)
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+    
+    def _load_model(self):
+        """Load the embedding model once, even if several threads need it at the same time."""
+        with self._model_lock:
+            if self._model is not None:
+                return
+            if self.onnx_model:
+                tokenizer = Tokenizer.from_file(
+                    os.path.join(os.path.dirname(self.onnx_model), "tokenizer.json")
+                )
+                tokenizer.enable_truncation(max_length=256)
+                self._tokenizer = tokenizer
+                # Set last: other threads only check _model before embedding
+                self._model = onnxruntime.InferenceSession(self.onnx_model, providers=["CPUExecutionProvider"])
+            else:
+                self._model = SentenceTransformer(self.model_name)
+    
+    def _embed_onnx(self, text):
+        """
+        Embed text with the ONNX model: mean pooling over the token
+        embeddings, then L2 normalization, as sentence-transformers does.
+        """
+        encoding = self._tokenizer.encode(text)
+        mask = np.array([encoding.attention_mask], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([encoding.ids], dtype=np.int64),
+            "attention_mask": mask,
+            "token_type_ids": np.array([encoding.type_ids], dtype=np.int64),
+        }
+        input_names = {model_input.name for model_input in self._model.get_inputs()}
+        token_embeddings = self._model.run(
+            None, {name: value for name, value in inputs.items() if name in input_names}
+        )[0][0]
+        
+        vector = (token_embeddings * mask[0, :, None]).sum(axis=0) / max(mask.sum(), 1)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+    
+    def lookup(self, email_type, vector):
+        """
+        Find the cached response of the most similar email of the same type.
+        
+        Returns:
+            str: The cached response, or None if nothing is similar enough
+        """
+        shard = self._shards.get(email_type or "")
+        if shard is None:
+            return None
+        
+        similarity, position = shard.best_match(vector)
+        if similarity is None or similarity < self.threshold:
+            return None
+        return shard.responses[position]
+    
+    def add(self, email_type, vector, response):
+        """Remember the response generated for an email."""
+        key = email_type or ""
+        if key not in self._shards:
+            self._shards[key] = _CacheShard(np.empty((0, len(vector)), dtype=np.float32), [])
+        self._shards[key].add(vector, response)
+        self._dirty = True
 
-# Configure the Gemini API with our API key
-genai.configure(api_key=GEMINI_API_KEY)
 
 class GeminiEmailResponder:
     """
@@ -28,7 +642,8 @@ class GeminiEmailResponder:
     and communicating with the Gemini API to generate appropriate responses.
     """
     
-    def __init__(self, model_name=GEMINI_CONFIG["model"], config=GEMINI_CONFIG):
+    def __init__(self, model_name=GEMINI_CONFIG["model"], config=GEMINI_CONFIG, verbose=False,
+                 api_key=None, http_options=None):
         """
         Initialize the responder with the specified model and configuration.
         
@@ -37,14 +652,74 @@ class GeminiEmailResponder:
                 (Default: model specified in GEMINI_CONFIG)
             config (dict): Configuration for the Gemini API
                 (Default: GEMINI_CONFIG from config.py)
+            verbose (bool): Log the prompts, response previews and cache
+                hits, for educational purposes (Default: False)
+            api_key (str, optional): Gemini API key
+                (Default: GEMINI_API_KEY from config.py)
+            http_options (types.HttpOptions, optional): HTTP settings for the
+                client, e.g. timeouts or a custom transport
+                (Default: long-lived keep-alive connections, HTTP/2 if h2
+                is installed)
         """
-        # Initialize the Gemini model with the specified name
-        self.model = genai.GenerativeModel(model_name)
+        if http_options is None:
+            limits = httpx.Limits(
+                max_keepalive_connections=_KEEPALIVE_CONNECTIONS, keepalive_expiry=_KEEPALIVE_EXPIRY
+            )
+            client_args = {'http2': h2 is not None, 'limits': limits}
+            http_options = types.HttpOptions(client_args=client_args, async_client_args=client_args)
+        
+        # Each responder has its own client (and connection pool) instead of
+        # configuring the API key globally
+        self.client = genai.Client(api_key=api_key or GEMINI_API_KEY, http_options=http_options)
+        self.model_name = model_name
         self.config = config
+        self.verbose = verbose
         
-        # Initialize counters for rate limiting
+        # Generation parameters for each email type, built once and shared
+        # by every request of that type
+        self._generation_configs = {
+            email_type: types.GenerateContentConfig(**self._build_generation_config(email_type))
+            for email_type in _INSTRUCTIONS
+        }
+        
+        # Token bucket for rate limiting: starts full and refills at
+        # max_requests_per_minute / 60 tokens per second. It is kept as the
+        # monotonic time in nanoseconds at which the bucket is full again,
+        # so the bookkeeping is integer arithmetic.
+        self.max_requests_per_minute = self.config.get("max_requests_per_minute", 60)
+        self._full_at_ns = time.monotonic_ns()
         self.requests_count = 0
-        self.last_request_time = time.time()
+        
+        # Guard the rate limit counters and the caches when generate_batch
+        # runs requests in several threads
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        
+        # Exact response cache, checked before the semantic one
+        self.response_cache = None
+        if self.config.get("response_cache", False):
+            self.response_cache = _ResponseCache(
+                self.config.get("response_cache_file", "response_cache.db")
+            )
+        
+        # Semantic response cache (only when an embedding backend is installed)
+        self.semantic_cache = None
+        onnx_model = self.config.get("semantic_cache_onnx_model") if onnxruntime is not None else None
+        if (np is not None and (SentenceTransformer is not None or onnx_model)
+                and self.config.get("semantic_cache", False)):
+            self.semantic_cache = _SemanticCache(
+                model_name=self.config.get("semantic_cache_model", "all-MiniLM-L6-v2"),
+                threshold=self.config.get("semantic_cache_threshold", 0.92),
+                cache_file=self.config.get("semantic_cache_file", "semantic_cache.npz"),
+                onnx_model=onnx_model,
+            )
+    
+    def close(self):
+        """Close the response cache and save the semantic cache so it survives a restart."""
+        if self.response_cache is not None:
+            self.response_cache.close()
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
     
     def generate_response(self, email_content, email_type=None):
         """
@@ -61,83 +736,562 @@ class GeminiEmailResponder:
         Returns:
             str: Generated email response
         """
+        cached, cache_keys = self._lookup_cached_response(email_content, email_type)
+        if cached is not None:
+            return cached
+        
         # Check if we need to handle rate limiting
         self._handle_rate_limiting()
         
-        # Create a prompt with instructions based on email type
-        prompt = self._create_prompt(email_content, email_type)
+        prompt = self._prepare_prompt(email_content, email_type)
         
-        # For educational purposes, show the prompt being used
-        print(f"\nUsing prompt for {email_type}:")
-        print(f"{prompt[:200]}... (truncated)")
+        try:
+            # Generate content using the Gemini API
+            response = self.client.models.generate_content(
+                model=self.model_name,
+                contents=prompt,
+                config=self._generation_config(email_type)
+            )
+            return self._finish_response(response, email_content, email_type, cache_keys)
+            
+        except Exception as e:
+            return self._handle_generation_error(e, email_content, email_type)
+    
+    async def generate_response_async(self, email_content, email_type=None):
+        """
+        Generate a response like generate_response, without blocking the event loop.
+        
+        Args:
+            email_content (dict): Email content with from, subject, and body fields
+            email_type (str, optional): Type of email for context
+            
+        Returns:
+            str: Generated email response
+        """
+        # Embedding (the first call loads the model) and SQLite block, so
+        # the lookup runs in the loop's default thread pool
+        cached, cache_keys = await asyncio.get_running_loop().run_in_executor(
+            None, self._lookup_cached_response, email_content, email_type
+        )
+        if cached is not None:
+            return cached
+        
+        await self._handle_rate_limiting_async()
+        
+        prompt = self._prepare_prompt(email_content, email_type)
         
         try:
-            # Configure generation parameters
-            generation_config = {
-                "temperature": self._get_temperature_for_type(email_type),
-                "top_p": self.config["top_p"],
-                "top_k": self.config["top_k"],
-                "max_output_tokens": self.config["max_output_tokens"],
-            }
+            # The client keeps one async HTTP session, so concurrent calls share its connections
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=prompt,
+                config=self._generation_config(email_type)
+            )
+            return self._finish_response(response, email_content, email_type, cache_keys)
             
-            # Generate content using the Gemini API
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
+        except Exception as e:
+            return self._handle_generation_error(e, email_content, email_type)
+    
+    def stream_response(self, email_content, email_type=None):
+        """
+        Generate a response to an email, yielding the text as it arrives.
+        
+        The caller can start using the response after the first chunk
+        instead of waiting for the whole generation. Header lines are
+        removed on the fly, so the joined chunks equal what
+        generate_response returns for the same text.
+        
+        Args:
+            email_content (dict): Email content with from, subject, and body fields
+            email_type (str, optional): Type of email for context
+            
+        Yields:
+            str: Consecutive pieces of the generated email response
+        """
+        cached, cache_keys = self._lookup_cached_response(email_content, email_type)
+        if cached is not None:
+            yield cached
+            return
+        
+        self._handle_rate_limiting()
+        
+        prompt = self._prepare_prompt(email_content, email_type)
+        
+        pieces = []
+        try:
+            response = self.client.models.generate_content_stream(
+                model=self.model_name,
+                contents=prompt,
+                config=self._generation_config(email_type)
             )
+            for piece in _clean_stream(chunk.text or '' for chunk in response):
+                pieces.append(piece)
+                yield piece
             
-            # Update request counter
-            self.requests_count += 1
-            self.last_request_time = time.time()
+        except Exception as e:
+            if pieces:
+                raise  # part of the response was already delivered
+            yield self._handle_generation_error(e, email_content, email_type)
+            return
+        
+        self._remember_response(''.join(pieces), email_content, email_type, cache_keys)
+    
+    def generate_batch(self, emails, max_workers=None):
+        """
+        Generate responses for several emails in parallel threads.
+        
+        The API client releases the GIL while waiting for the network, so
+        the requests overlap even though the SDK call is blocking. Emails
+        whose requests differ only in the sender get one API call between them.
+        
+        Args:
+            emails (list): (email_content, email_type) pairs
+            max_workers (int, optional): Number of threads
+                (Default: "batch_workers" from the configuration, or 8)
             
-            # Extract the text from the response
-            generated_text = response.text
+        Returns:
+            list: Generated responses, in the same order as emails
+        """
+        emails = list(emails)
+        if not emails:
+            return []
+        
+        groups = self._group_duplicates(emails)
+        
+        def respond(positions):
+            first_content, email_type = emails[positions[0]]
+            response = self.generate_response(first_content, email_type)
             
-            # IMPORTANT: Clean the response to remove any subject lines or headers
-            generated_text = self._clean_response(generated_text)
+            responses = [response]
+            for position in positions[1:]:
+                duplicate = self._reuse_response(response, first_content, emails[position][0])
+                if duplicate is None:
+                    duplicate = self.generate_response(*emails[position])
+                responses.append(duplicate)
+            return responses
+        
+        results = [None] * len(emails)
+        max_workers = max_workers or self.config.get("batch_workers", 8)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+            for positions, responses in zip(groups, executor.map(respond, groups)):
+                for position, response in zip(positions, responses):
+                    results[position] = response
+        return results
+    
+    def _group_duplicates(self, emails):
+        """
+        Group emails with the same cache key, i.e. the same prompt apart from
+        the sender (mailing list bursts, auto-replies), so they share one API call.
+        
+        Args:
+            emails (list): (email_content, email_type) pairs
             
-            # For educational purposes, show a preview of the response
-            preview = generated_text[:100] + "..." if len(generated_text) > 100 else generated_text
-            print(f"\nGenerated response preview: {preview}")
+        Returns:
+            list: Lists of positions in emails, one per group
+        """
+        groups = {}
+        for position, (email_content, email_type) in enumerate(emails):
+            groups.setdefault(self._cache_key(email_content, email_type), []).append(position)
+        return list(groups.values())
+    
+    def _reuse_response(self, response, first_content, email_content):
+        """
+        Adapt the response to the first email of a group for another email of it.
+        
+        Returns:
+            str: The response for email_content, or None if it needs its own
+                (the response names its sender in a way that can't be templated)
+        """
+        if not response:
+            return None
+        if email_content.get('sender_name', '') == first_content.get('sender_name', ''):
+            return response
+        return self._personalize(self._make_template(response, first_content), email_content)
+    
+    def generate_batch_job(self, emails, timeout=None):
+        """
+        Generate responses for several emails with one Gemini Batch API job.
+        
+        Batch jobs are billed at a lower rate than single requests and need
+        only a few HTTP calls, but their results can take minutes. Cached
+        emails are answered right away; if the job fails or does not finish
+        in time, the remaining emails are answered with generate_batch.
+        
+        Args:
+            emails (list): (email_content, email_type) pairs
+            timeout (float, optional): Seconds to wait for the job
+                (Default: "batch_job_timeout" from the configuration, or 900)
             
-            return generated_text
+        Returns:
+            list: Generated responses, in the same order as emails
+        """
+        emails = list(emails)
+        results = [None] * len(emails)
+        pending = {}  # position -> cache keys
+        for position, (email_content, email_type) in enumerate(emails):
+            cached, cache_keys = self._lookup_cached_response(email_content, email_type)
+            if cached is not None:
+                results[position] = cached
+            else:
+                pending[position] = cache_keys
+        if not pending:
+            return results
+        
+        timeout = timeout or self.config.get("batch_job_timeout", 900)
+        responses = self._run_batch_job([emails[position] for position in pending], timeout)
+        if responses is None:
+            fallback = self.generate_batch([emails[position] for position in pending])
+            for position, response in zip(pending, fallback):
+                results[position] = response
+            return results
+        
+        for (position, cache_keys), response in zip(pending.items(), responses):
+            email_content, email_type = emails[position]
+            try:
+                if response is None:
+                    raise ValueError("Batch job returned no response")
+                results[position] = self._finish_response(response, email_content, email_type, cache_keys)
+            except Exception as e:
+                results[position] = self._handle_generation_error(e, email_content, email_type)
+        return results
+    
+    def _run_batch_job(self, emails, timeout):
+        """
+        Submit one batch job for the emails and wait for it to finish.
+        
+        The job is polled with exponential backoff and cancelled after
+        timeout seconds.
+        
+        Returns:
+            list: The API response for each email (None where the request
+                failed), or None if the job as a whole failed
+        """
+        self._handle_rate_limiting()
+        
+        try:
+            job = self.client.batches.create(
+                model=self.model_name,
+                src=[
+                    types.InlinedRequest(
+                        contents=self._prepare_prompt(email_content, email_type),
+                        config=self._generation_config(email_type),
+                        metadata={"position": str(position)},
+                    )
+                    for position, (email_content, email_type) in enumerate(emails)
+                ],
+            )
+            logger.info("Submitted batch job %s for %s emails", job.name, len(emails))
             
+            deadline = time.monotonic() + timeout
+            delay = _BATCH_POLL_START
+            while job.state not in _BATCH_DONE_STATES:
+                if time.monotonic() + delay > deadline:
+                    logger.warning("Batch job %s did not finish in %s seconds, cancelling it", job.name, timeout)
+                    self.client.batches.cancel(name=job.name)
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, _BATCH_POLL_MAX)
+                job = self.client.batches.get(name=job.name)
         except Exception as e:
-            # Handle API errors gracefully
-            error_msg = f"Error generating response: {str(e)}"
-            print(error_msg)
+            logger.error("Error running batch job: %s", e)
+            return None
+        
+        if job.state not in (types.JobState.JOB_STATE_SUCCEEDED, types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED):
+            logger.error("Batch job %s ended in state %s", job.name, job.state)
+            return None
+        
+        responses = [None] * len(emails)
+        for index, inlined in enumerate(job.dest.inlined_responses or []):
+            position = int((inlined.metadata or {}).get("position", index))
+            if inlined.error:
+                logger.error("Batch request failed: %s", inlined.error.message)
+            responses[position] = inlined.response
+        return responses
+    
+    async def generate_batch_async(self, emails):
+        """
+        Generate responses for several emails concurrently.
+        
+        The API calls overlap, so a batch takes about as long as its slowest
+        request instead of the sum of all of them. Like in generate_batch,
+        emails whose requests differ only in the sender share one API call.
+        
+        Args:
+            emails (list): (email_content, email_type) pairs
             
-            # Provide a fallback response for real-world scenarios
-            fallback_response = self._get_fallback_response(email_content, email_type)
-            print(f"Using fallback response instead.")
+        Returns:
+            list: Generated responses, in the same order as emails
+        """
+        emails = list(emails)
+        groups = self._group_duplicates(emails)
+        
+        async def respond(positions):
+            first_content, email_type = emails[positions[0]]
+            response = await self.generate_response_async(first_content, email_type)
             
-            return fallback_response
+            responses = [response]
+            for position in positions[1:]:
+                duplicate = self._reuse_response(response, first_content, emails[position][0])
+                if duplicate is None:
+                    duplicate = await self.generate_response_async(*emails[position])
+                responses.append(duplicate)
+            return responses
+        
+        results = [None] * len(emails)
+        for positions, responses in zip(groups, await asyncio.gather(*map(respond, groups))):
+            for position, response in zip(positions, responses):
+                results[position] = response
+        return results
     
-    def _handle_rate_limiting(self, max_requests_per_minute=60):
+    def _lookup_cached_response(self, email_content, email_type):
         """
-        Handle API rate limiting to avoid exceeding quotas.
+        Look for a cached response to this email or a near-duplicate of it.
         
-        Implements a simple rate limiting mechanism to ensure we don't
-        exceed the API's rate limits.
+        A hit needs no API call and does not count against the rate limit.
+        A cache that fails (e.g. the embedding model can't be downloaded) is
+        logged and treated as a miss, so the email is still answered.
         
-        Args:
-            max_requests_per_minute (int): Maximum requests allowed per minute
+        Returns:
+            tuple: (cached response or None, cache keys for _finish_response)
         """
-        # Calculate time since last request
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
+        key = vector = None
+        
+        if self.response_cache is not None:
+            try:
+                key = self._cache_key(email_content, email_type)
+                with self._cache_lock:
+                    cached = self.response_cache.get(key)
+            except Exception as e:
+                logger.warning("Response cache lookup failed, treating it as a miss: %s", e)
+                key = cached = None
+            cached = self._personalize(cached, email_content)
+            if cached is not None:
+                if self.verbose:
+                    logger.info("Using cached response for identical %s email", email_type)
+                return cached, (key, vector)
+        
+        if self.semantic_cache is not None:
+            try:
+                # The subject often carries the request ("Refund order 123")
+                vector = self.semantic_cache.embed(
+                    f"{email_content.get('subject', '')}\n{email_content.get('body', '')}"
+                )
+                with self._cache_lock:
+                    cached = self.semantic_cache.lookup(email_type, vector)
+            except Exception as e:
+                logger.warning("Semantic cache lookup failed, treating it as a miss: %s", e)
+                vector = cached = None
+            cached = self._personalize(cached, email_content)
+            if cached is not None:
+                if self.verbose:
+                    logger.info("Using cached response for similar %s email", email_type)
+                return cached, (key, vector)
+        
+        return None, (key, vector)
+    
+    def _cache_key(self, email_content, email_type):
+        """
+        Build the exact cache key of an email from everything that goes into
+        its request: the prompt (subject, body, sentiment, priority, ...) and
+        the generation parameters.
+        
+        The sender's name and address are replaced by placeholders, like in
+        the cached response, so the same email from someone else has the
+        same key.
+        """
+        anonymous = dict(email_content, sender_name=_SENDER_PLACEHOLDER if email_content.get('sender_name') else '')
+        anonymous['from'] = _SENDER_ADDRESS_PLACEHOLDER
+        prompt = self._create_prompt(anonymous, email_type)
+        return _ResponseCache.key(self.model_name, self._build_generation_config(email_type), prompt)
+    
+    def _make_template(self, response, email_content):
+        """
+        Turn a response into a template that can be sent to other senders.
+        
+        The sender's full name and first name (as whole words) become
+        placeholders. A response that still names the sender in another
+        way (e.g. "Dear Ms. Smith") or contains their address is specific
+        to this sender.
+        
+        Returns:
+            str: The template, or None if the response must not be reused
+        """
+        address = parseaddr(email_content.get('from', ''))[1]
+        if address and address.lower() in response.lower():
+            return None
+        
+        sender_name = email_content.get('sender_name', '')
+        if not sender_name:
+            return response
+        
+        parts = _name_parts(sender_name)
+        template = _replace_word(response, sender_name, _SENDER_PLACEHOLDER)
+        if parts:
+            template = _replace_word(template, parts[0], _SENDER_FIRST_NAME_PLACEHOLDER)
+        if any(_contains_word(template, part) for part in parts):
+            return None
+        return template
+    
+    def _personalize(self, template, email_content):
+        """
+        Fill the sender's name into a cached response template.
+        
+        Returns:
+            str: The response, or None if there is no template or it needs
+                a name the email does not have
+        """
+        if template is None:
+            return None
+        
+        sender_name = email_content.get('sender_name', '')
+        parts = _name_parts(sender_name)
+        if not parts:
+            if _SENDER_PLACEHOLDER in template or _SENDER_FIRST_NAME_PLACEHOLDER in template:
+                return None
+            return template
+        return template.replace(_SENDER_PLACEHOLDER, sender_name).replace(
+            _SENDER_FIRST_NAME_PLACEHOLDER, parts[0]
+        )
+    
+    def _prepare_prompt(self, email_content, email_type):
+        """Create the prompt for an email and log it in verbose mode."""
+        # Create a prompt with instructions based on email type
+        prompt = self._create_prompt(email_content, email_type)
+        
+        # For educational purposes, show the prompt being used
+        if self.verbose:
+            logger.info("Using prompt for %s:\n%s... (truncated)", email_type, prompt[:200])
         
-        # If it's been more than a minute, reset counter
-        if elapsed > 60:
-            self.requests_count = 0
+        return prompt
+    
+    def _generation_config(self, email_type):
+        """Get the generation parameters for an email type (unknown types use the defaults)."""
+        config = self._generation_configs.get(email_type)
+        return config if config is not None else self._generation_configs[None]
+    
+    def _build_generation_config(self, email_type):
+        """Build the generation parameters for an email type."""
+        return {
+            "temperature": self._get_temperature_for_type(email_type),
+            "top_p": self.config["top_p"],
+            "top_k": self.config["top_k"],
+            "max_output_tokens": self.config["max_output_tokens"],
+        }
+    
+    def _finish_response(self, response, email_content, email_type, cache_keys):
+        """
+        Turn an API response into the email body and remember it in the cache.
+        
+        Returns:
+            str: The cleaned response text
+        """
+        # Extract the text from the response (None if it was blocked)
+        generated_text = response.text
+        if not generated_text:
+            raise ValueError("Gemini returned no text")
+        
+        # IMPORTANT: Clean the response to remove any subject lines or headers
+        generated_text = self._clean_response(generated_text)
+        
+        self._remember_response(generated_text, email_content, email_type, cache_keys)
+        
+        # For educational purposes, show a preview of the response
+        if self.verbose:
+            preview = textwrap.shorten(generated_text, width=100, placeholder="...")
+            logger.info("Generated response preview: %s", preview)
+        
+        return generated_text
+    
+    def _remember_response(self, generated_text, email_content, email_type, cache_keys):
+        """
+        Store a generated response in the caches, with the sender's name as a
+        placeholder. Responses that name the sender in another way are not stored.
+        """
+        if not generated_text:
             return
         
-        # If we're approaching the limit, wait
-        if self.requests_count >= max_requests_per_minute:
-            wait_time = 60 - elapsed + 1  # Add 1 second buffer
-            print(f"Rate limit approaching, waiting {wait_time:.2f} seconds...")
+        key, vector = cache_keys
+        template = self._make_template(generated_text, email_content)
+        if template is None:
+            return
+        try:
+            with self._cache_lock:
+                if key is not None:
+                    self.response_cache.put(key, template)
+                if vector is not None:
+                    self.semantic_cache.add(email_type, vector, template)
+        except Exception as e:
+            # The response itself is fine, only later emails miss the cache
+            logger.warning("Could not store the response in the cache: %s", e)
+    
+    def _handle_generation_error(self, error, email_content, email_type):
+        """
+        Report an API error and return the fallback response instead.
+        
+        Returns:
+            str: The fallback response for the email type
+        """
+        # Handle API errors gracefully
+        logger.error("Error generating response: %s", error)
+        
+        # Provide a fallback response for real-world scenarios
+        fallback_response = self._get_fallback_response(email_content, email_type)
+        logger.warning("Using fallback response instead.")
+        
+        return fallback_response
+    
+    def _handle_rate_limiting(self):
+        """
+        Handle API rate limiting to avoid exceeding quotas.
+        
+        Uses a token bucket: each request takes a token, and tokens refill
+        continuously up to max_requests_per_minute. Bursts are allowed while
+        tokens last; after that requests are spaced at the refill rate
+        instead of stalling until a whole minute has passed.
+        """
+        wait_time = self._reserve_request()
+        if wait_time:
+            logger.info("Rate limit reached, waiting %.2f seconds...", wait_time)
             time.sleep(wait_time)
-            self.requests_count = 0
+    
+    async def _handle_rate_limiting_async(self):
+        """
+        Handle API rate limiting like _handle_rate_limiting, without blocking.
+        
+        Waiting requests sleep with asyncio.sleep, so other coroutines keep
+        running meanwhile.
+        """
+        wait_time = self._reserve_request()
+        if wait_time:
+            logger.info("Rate limit reached, waiting %.2f seconds...", wait_time)
+            await asyncio.sleep(wait_time)
+    
+    def _reserve_request(self):
+        """
+        Take a token from the bucket for one request.
+        
+        When the bucket is empty the token is taken in advance (the count
+        goes negative), so every waiting request gets its own later slot
+        and the lock is never held while sleeping.
+        
+        Returns:
+            float: Seconds to wait before sending the request (0 if none)
+        """
+        # Nanoseconds to refill one token, and to refill all but one
+        token_ns = _MINUTE_NS // self.max_requests_per_minute
+        burst_ns = _MINUTE_NS - token_ns
+        
+        # Take a token under the lock, so that parallel requests cannot
+        # spend the same token
+        with self._lock:
+            now = time.monotonic_ns()
+            full_at = max(self._full_at_ns, now)
+            self._full_at_ns = full_at + token_ns
+            self.requests_count += 1
+        
+        # Wait until the token taken has refilled far enough to be spent
+        wait_ns = full_at - burst_ns - now
+        return wait_ns / 1e9 if wait_ns > 0 else 0.0
     
     def _get_temperature_for_type(self, email_type):
         """
@@ -154,13 +1308,13 @@ class GeminiEmailResponder:
             float: The temperature value to use (0.0-1.0)
         """
         # Use different temperatures based on email type
-        if email_type in ['product_support', 'billing_question', 'urgent_request']:
+        if email_type in _PRECISE_TYPES:
             # More precise, less creative for technical/important matters
             return max(0.1, self.config["temperature"] - 0.3)
-        elif email_type in ['complaint']:
+        elif email_type in _BALANCED_TYPES:
             # Balanced approach for complaints
             return max(0.3, self.config["temperature"] - 0.1)
-        elif email_type in ['feature_request', 'general_feedback']:
+        elif email_type in _CREATIVE_TYPES:
             # More creative for positive or idea-based emails
             return min(0.9, self.config["temperature"] + 0.1)
         else:
@@ -176,31 +1330,14 @@ class GeminiEmailResponder:
         """
         if not response_text:
             return response_text
-            
-        # Remove any lines that look like email headers
-        lines = response_text.split('\n')
-        cleaned_lines = []
-        skip_next_empty = False
-        
-        for line in lines:
-            # Skip lines that look like headers
-            if (line.startswith('Subject:') or 
-                line.startswith('From:') or 
-                line.startswith('To:') or 
-                line.startswith('Date:') or
-                line.startswith('Re:')):
-                skip_next_empty = True
-                continue
-            
-            # Skip empty line after a header
-            if skip_next_empty and line.strip() == '':
-                skip_next_empty = False
-                continue
-            
-            skip_next_empty = False
-            cleaned_lines.append(line)
         
-        return '\n'.join(cleaned_lines).strip()
+        # Most responses contain no header name at all; a substring search
+        # for each is cheaper than the line-by-line regex
+        if not any(prefix in response_text for prefix in _HEADER_PREFIXES):
+            return response_text.strip()
+            
+        # Drop header-like lines (and one blank line after each) in a single pass
+        return _HEADER_LINE_RE.sub('', response_text).strip()
     
     def _create_prompt(self, email_content, email_type=None):
         """
@@ -216,172 +1353,55 @@ class GeminiEmailResponder:
         Returns:
             str: Formatted prompt for Gemini API
         """
-        # Extract sender name if available
-        sender_name = email_content.get('sender_name', 'the customer')
-        
-        # Base instructions for all email types
-        instructions = f"""
-        You are a helpful customer support assistant. Generate a professional and empathetic response to the following email.
-        Address the sender by name if available. Be concise but thorough in your response.
-        Sign the email as 'Customer Support Team'.
-        
-        IMPORTANT: Generate ONLY the email body content. Do NOT include:
-        - Subject line or "Subject:" prefix
-        - "Re:" prefix
-        - Email headers (From:, To:, Date:)
-        - Any metadata
-        Just provide the body text starting with the greeting (e.g., "Dear [Name]," or "Hello,").
-        """
-        
-        # Add specific instructions based on email type
-        if email_type == "complaint":
-            instructions = f"""
-            You are a professional customer support assistant handling a complaint. 
-            Generate a professional, apologetic, and solution-oriented response to the following complaint email.
-            
-            Guidelines:
-            1. Start by acknowledging the issue and apologizing sincerely
-            2. Show empathy for {sender_name}'s frustration
-            3. Explain what might have happened (if clear from the email)
-            4. Provide a specific solution or next steps
-            5. Offer some form of goodwill or compensation if appropriate
-            6. Thank them for bringing this to your attention
-            7. Sign off as 'Customer Support Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
-        
-        elif email_type == "product_support":
-            instructions = f"""
-            You are a technical support specialist. Generate a professional, clear, and step-by-step response to 
-            the following support email.
-            
-            Guidelines:
-            1. Acknowledge {sender_name}'s issue
-            2. Provide clear, step-by-step instructions to solve the problem
-            3. Use simple, non-technical language when possible
-            4. Explain why your solution works (if relevant)
-            5. Offer alternative solutions if available
-            6. Invite them to reach out again if the issue persists
-            7. Sign off as 'Technical Support Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
+        # Everything specific to this email (sender name included) goes after
+        # the static instructions for the email type, built once per type
+        prefix = _prompt_prefix(email_type)
         
-        elif email_type == "feature_request":
-            instructions = f"""
-            You are a product manager. Generate a thoughtful response to the following feature request email.
-            
-            Guidelines:
-            1. Thank {sender_name} for their suggestion
-            2. Show appreciation for their engagement with the product
-            3. Give your impression of the idea (positively framed)
-            4. Explain if similar features are planned or already available
-            5. If appropriate, ask for more details about their use case
-            6. Set realistic expectations about implementation possibilities
-            7. Sign off as 'Product Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
+        # Format the email content for the prompt
+        sender_name = email_content.get('sender_name')
+        greeting = f"The sender's name is {sender_name}. Address them by name.\n\n" if sender_name else ""
+        email_text = (
+            f"{greeting}"
+            f"From: {email_content.get('from', 'customer@example.com')}\n"
+            f"To: {email_content.get('to', 'support@company.com')}\n"
+            f"Subject: {email_content.get('subject', 'No Subject')}\n"
+            f"Body: "
+        )
         
-        elif email_type == "billing_question":
-            instructions = f"""
-            You are a billing specialist. Generate a professional, clear, and helpful response to 
-            the following billing question.
-            
-            Guidelines:
-            1. Address {sender_name}'s billing concern directly
-            2. Provide clear information about the billing process
-            3. If relevant, explain why charges appear as they do
-            4. Offer specific next steps if action is needed
-            5. Reassure them about data security
-            6. Provide contact information for further billing questions
-            7. Sign off as 'Billing Support Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
+        # Add sentiment and priority information if available
+        sentiment = f"\n\nEmail sentiment: {email_content['sentiment']}" if 'sentiment' in email_content else ""
+        priority = f"\nPriority: {email_content['priority']}" if 'priority' in email_content else ""
+        details = sentiment + priority
         
-        elif email_type == "general_feedback":
-            instructions = f"""
-            You are a customer experience manager. Generate a warm and appreciative response to 
-            the following feedback email.
-            
-            Guidelines:
-            1. Thank {sender_name} enthusiastically for their feedback
-            2. Acknowledge specific positive points they mentioned
-            3. Explain how this feedback helps your team
-            4. Mention any relevant upcoming improvements
-            5. Invite them to continue providing feedback
-            6. Sign off warmly as 'Customer Experience Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
+        # Trim the body so that the whole prompt fits the input token budget
+        body = self._trim_body(email_content.get('body', ''), len(prefix) + len(email_text) + len(details))
         
-        elif email_type == "urgent_request":
-            instructions = f"""
-            You are an urgent response specialist. Generate a prompt, clear, and action-oriented response to 
-            the following time-sensitive email.
-            
-            Guidelines:
-            1. Acknowledge the urgency of {sender_name}'s request
-            2. Provide immediate next steps or solutions
-            3. Be direct and concise
-            4. If you can't resolve immediately, explain exactly when they can expect resolution
-            5. Provide alternative contact methods for faster response
-            6. Sign off as 'Urgent Response Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
+        # Combine instructions and email content
+        return f"{prefix}{email_text}{body}{details}"
+    
+    def _trim_body(self, body, other_chars):
+        """
+        Shorten an email body so the prompt stays within max_input_tokens.
         
-        elif email_type == "customer_inquiry" or email_type is None:
-            instructions = f"""
-            You are a customer support specialist. Generate a professional, informative response to 
-            the following inquiry email.
-            
-            Guidelines:
-            1. Greet {sender_name} warmly
-            2. Answer their questions directly and completely
-            3. Provide relevant additional information they might find helpful
-            4. Include links or references to resources if relevant
-            5. Invite further questions
-            6. Sign off as 'Customer Support Team'
-            
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
+        Token counts are estimated from the length in characters. The start
+        of the body is kept (quoted earlier messages usually come last) and
+        the rest is replaced by a marker.
         
-        elif email_type == "spam":
-            instructions = f"""
-            You are a security specialist. Generate a brief, professional response to what appears to be a 
-            spam or phishing email. Do not engage with specific claims in the email.
-            
-            Guidelines:
-            1. Be extremely brief and generic
-            2. Do not reference or acknowledge specific claims from the email
-            3. Provide general security advice
-            4. Do not include links or contact information
-            5. Sign off as 'Security Team'
+        Args:
+            body (str): The email body
+            other_chars (int): Length of the rest of the prompt
             
-            Remember: Generate ONLY the email body. NO subject lines or headers.
-            """
-        
-        # Format the email content for the prompt
-        email_text = f"From: {email_content.get('from', 'customer@example.com')}\n"
-        email_text += f"To: {email_content.get('to', 'support@company.com')}\n"
-        email_text += f"Subject: {email_content.get('subject', 'No Subject')}\n"
-        email_text += f"Body: {email_content.get('body', '')}"
-        
-        # Add sentiment information if available
-        if 'sentiment' in email_content:
-            email_text += f"\n\nEmail sentiment: {email_content['sentiment']}"
-        
-        # Add priority information if available
-        if 'priority' in email_content:
-            email_text += f"\nPriority: {email_content['priority']}"
-        
-        # Combine instructions and email content
-        prompt = f"{instructions}\n\n{email_text}"
+        Returns:
+            str: The body, trimmed if it was too long
+        """
+        budget = self.config.get("max_input_tokens")
+        if not budget:
+            return body
         
-        return prompt
+        limit = budget * _CHARS_PER_TOKEN - other_chars
+        if len(body) <= limit:
+            return body
+        return body[:max(0, limit - len(_TRUNCATION_MARKER))].rstrip() + _TRUNCATION_MARKER
     
     def _get_fallback_response(self, email_content, email_type=None):
         """
@@ -6,27 +6,86 @@ Date: August 2025
 Version: 4.0 
 """
 
+import asyncio
+import atexit
 import time
 import datetime
 import logging
+import logging.handlers
+import queue
+import re
 import sys
-from typing import Dict
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
 from gemini_email import GeminiEmailResponder
 from email_processor import EmailProcessor
 from email_filter import EmailFilter
 from email_tracker import EmailTracker
 
+# Size of the log file's write buffer in bytes
+_LOG_BUFFER_SIZE = 64 * 1024
+
+
+class _BufferedFileHandler(logging.FileHandler):
+    """
+    File handler that writes through a large buffer instead of flushing
+    every record. _LogListener flushes it when the log queue runs empty, so
+    a burst of records costs one write.
+    """
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=_LOG_BUFFER_SIZE, encoding=self.encoding)
+    
+    def flush(self):
+        """Do nothing per record; see flush_buffer."""
+    
+    def flush_buffer(self):
+        """Write the buffered records to the file."""
+        super().flush()
+
+
+class _LogListener(logging.handlers.QueueListener):
+    """QueueListener that flushes buffered handlers whenever the queue is empty."""
+    
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                if isinstance(handler, _BufferedFileHandler):
+                    handler.flush_buffer()
+
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('email_automation.log'),
-        logging.StreamHandler()
-    ]
-)
+# Records are put on a queue and written to the log file and the console by
+# a background thread, so logging never waits for slow output
+_log_handlers = [
+    _BufferedFileHandler('email_automation.log'),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_queue = queue.Queue(-1)
+_log_listener = _LogListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # writes out the queued records
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
 logger = logging.getLogger(__name__)
 
+# Subjects that already carry a reply prefix ("Re:", "RE :", ...)
+_REPLY_PREFIX_RE = re.compile(r'\s*re\s*:', re.IGNORECASE)
+
+# Seconds between reads of the history statistics from the tracker
+_TRACKER_STATS_INTERVAL = 5 * 60
+
+# Number of recent cycles kept for the response rate statistic
+_RECENT_CYCLES = 60
+
+def _quiet(*args, **kwargs):
+    """Stand-in for print when console output is off."""
+
 class EmailAutomationSystem:
     """
     Email automation system with threading and date filtering.
@@ -34,209 +93,566 @@ class EmailAutomationSystem:
     
     def __init__(self):
         """Initialize all system components."""
-        self.email_processor = EmailProcessor()
-        self.gemini_responder = GeminiEmailResponder()
         self.email_tracker = EmailTracker()
+        self.email_processor = EmailProcessor(tracker=self.email_tracker)
+        self.gemini_responder = GeminiEmailResponder()
         self.email_filter = EmailFilter()
         
         # Configuration
         self.config = {
-            "max_emails_per_cycle": 1,  # Process one email at a time
-            "check_interval": 30,  # Seconds between checks
+            "max_emails_per_cycle": 16,  # Emails fetched per check
+            "worker_threads": 8,  # Emails processed in parallel
+            "check_interval": 30,  # Seconds between checks (servers without IMAP IDLE)
+            "max_check_interval": 600,  # Longest interval, reached by doubling after empty checks
+            "idle_timeout": 29 * 60,  # Longest wait for new mail before checking anyway
             "max_emails_per_sender": 3,  # Max emails from same sender per day
             "spam_threshold": 0.5,  # Spam score threshold (0.0-1.0)
             "rate_limit_window": 24,  # Hours for rate limiting
             "days_to_check": 7,  # Only check emails from last N days
             "use_html_emails": True,  # Use HTML for better formatting
+            "use_batch_api": False,  # Gemini Batch API: cheaper, but replies can take minutes
+            "use_async_api": True,  # Generate a cycle's responses concurrently on one event loop
+            "send_attempts": 3,  # Tries per response before giving up
+            "verbose": sys.stdout.isatty(),  # Progress output on the console
         }
         
-        # Statistics
-        self.stats = {
-            "total_processed": 0,
-            "responses_sent": 0,
-            "emails_skipped": 0,
-            "errors": 0,
-            "categories": {}
+        # Progress output goes to the console only in verbose mode; the log
+        # file has the important events either way
+        self._say = print if self.config["verbose"] else _quiet
+        
+        # Seconds until the next check without IMAP IDLE: doubled after every
+        # check that found nothing, reset when emails arrive
+        self._current_interval = self.config["check_interval"]
+        
+        # Statistics: every thread counts in its own pair of Counters (totals
+        # and categories), so counting takes no lock. The stats property
+        # adds them up.
+        self._local_stats = threading.local()
+        self._stat_counters = []
+        
+        # Statistics display: the tracker's history statistics are read
+        # every few minutes, and (time, responses sent) of the recent cycles
+        # give the response rate
+        self._last_tracker_scan = 0.0
+        self._cached_tracker_stats = None
+        self._recent_cycles = deque(maxlen=_RECENT_CYCLES)
+        
+        # Emails accepted for a response but not recorded by the tracker yet
+        # (email ID -> sender). The per-sender rate limit counts them too.
+        self.in_progress = {}
+        
+        # Guards in_progress together with the tracker updates that end it,
+        # and the list of statistics counters
+        self.state_lock = threading.Lock()
+        
+        # Fetching, Gemini calls and sending all wait on the network, so
+        # emails are processed in parallel by a pool created once
+        self.executor = ThreadPoolExecutor(max_workers=self.config["worker_threads"])
+        
+        # Fetching runs in its own thread, so the next batch can be fetched
+        # while the current one is processed. One thread: IMAP commands on
+        # the shared connection must not overlap.
+        self.fetch_executor = ThreadPoolExecutor(max_workers=1)
+        self._next_fetch = None
+        
+        # Event loop for the async Gemini calls, kept for the whole run since
+        # the API client's async connections belong to the loop that opened them
+        self.loop = asyncio.new_event_loop()
+        
+        # Responses are sent by one background thread, so workers go on to
+        # the next email instead of waiting for the SMTP server
+        self.send_queue = queue.Queue()
+        self.sender_thread = threading.Thread(target=self._send_responses, daemon=True)
+        self.sender_thread.start()
+    
+    @property
+    def stats(self) -> Dict:
+        """Processing statistics, added up from the counters of all threads."""
+        totals = Counter()
+        categories = Counter()
+        with self.state_lock:
+            counters = list(self._stat_counters)
+        for thread_totals, thread_categories in counters:
+            # dict() copies atomically, the thread may be counting meanwhile
+            totals.update(dict(thread_totals))
+            categories.update(dict(thread_categories))
+        
+        return {
+            "total_processed": totals["total_processed"],
+            "responses_sent": totals["responses_sent"],
+            "emails_skipped": totals["emails_skipped"],
+            "errors": totals["errors"],
+            "categories": dict(categories)
         }
     
+    def _thread_counters(self):
+        """Return this thread's (totals, categories) Counters, creating them on first use."""
+        counters = getattr(self._local_stats, "counters", None)
+        if counters is None:
+            counters = self._local_stats.counters = (Counter(), Counter())
+            with self.state_lock:
+                self._stat_counters.append(counters)
+        return counters
+    
+    def _increment_stat(self, name: str, category: Optional[str] = None):
+        """Add one to a statistics counter, and to a category count if given."""
+        totals, categories = self._thread_counters()
+        totals[name] += 1
+        if category is not None:
+            categories[category] += 1
+    
     def should_process_email(self, email_data: Dict) -> tuple[bool, str]:
         """
         Determine if an email should be processed and responded to.
         """
-        email_id = email_data.get('id')
-        from_address = email_data.get('from', '')
+        return self.should_process_batch([email_data])[0]
+    
+    def should_process_batch(self, emails: List[Dict]) -> List[tuple[bool, str]]:
+        """
+        Determine which emails of a batch should be processed and responded to.
         
+        The tracker is asked once for the whole batch and the rate limit is
+        looked up once per sender. An email accepted here counts against its
+        sender's limit for the emails after it. Call with state_lock held.
+        
+        Args:
+            emails: The fetched emails
+        
+        Returns:
+            List of (should_process, reason) tuples in the same order as the input
+        """
         # Check if already processed
-        if self.email_tracker.is_processed(email_id):
-            return False, "Already processed"
+        processed = self.email_tracker.are_processed([email_data.get('id') for email_data in emails])
         
-        # Check if it should be filtered out
-        should_skip, skip_reason = self.email_filter.should_skip_email(
-            email_data, 
-            self.config["spam_threshold"]
-        )
-        if should_skip:
-            return False, skip_reason
+        # Check if they should be filtered out
+        skips = self.email_filter.should_skip_batch(emails, self.config["spam_threshold"])
         
-        # Check rate limiting per sender
-        sender_count = self.email_tracker.count_sender_emails(
-            from_address, 
+        # Rate limiting per sender (responses still being generated or sent
+        # are not in the tracker yet)
+        sender_counts = Counter(self.email_tracker.count_sender_emails_batch(
+            [email_data.get('from', '') for email_data in emails],
             hours=self.config["rate_limit_window"]
-        )
-        if sender_count >= self.config["max_emails_per_sender"]:
-            return False, f"Rate limit exceeded for sender (max {self.config['max_emails_per_sender']} per {self.config['rate_limit_window']}h)"
+        ))
+        sender_counts.update(self.in_progress.values())
         
-        return True, ""
+        verdicts = []
+        for email_data, (should_skip, skip_reason) in zip(emails, skips):
+            sender = email_data.get('from', '').lower()
+            if email_data.get('id') in processed:
+                verdicts.append((False, "Already processed"))
+            elif should_skip:
+                verdicts.append((False, skip_reason))
+            elif sender_counts[sender] >= self.config["max_emails_per_sender"]:
+                verdicts.append((False, f"Rate limit exceeded for sender (max {self.config['max_emails_per_sender']} per {self.config['rate_limit_window']}h)"))
+            else:
+                sender_counts[sender] += 1
+                verdicts.append((True, ""))
+        return verdicts
     
-    def process_single_email(self, email_data: Dict) -> bool:
+    def _accept_batch(self, emails: List[Dict]) -> Dict[str, tuple]:
         """
-        Process a single email and generate/send response if appropriate.
+        Check a batch of emails and mark the accepted ones as in progress.
+        
+        Emails already in progress are left out; _prepare_email checks them
+        again on its own.
         
+        Returns:
+            Dictionary mapping email IDs to their (should_process, reason) verdict
         """
-        email_id = email_data.get('id')
+        with self.state_lock:
+            emails = [email_data for email_data in emails if email_data.get('id') not in self.in_progress]
+            verdicts = self.should_process_batch(emails)
+            for email_data, (should_process, _) in zip(emails, verdicts):
+                if should_process:
+                    self.in_progress[email_data.get('id')] = email_data.get('from', '').lower()
+        return {email_data.get('id'): verdict for email_data, verdict in zip(emails, verdicts)}
+    
+    def process_single_email(self, email_data: Dict, verdict: Optional[tuple] = None) -> bool:
+        """
+        Process a single email and generate/send response if appropriate.
         
+        Args:
+            email_data: The fetched email
+            verdict: Its (should_process, reason) from _accept_batch; checked
+                here if None
+        """
         try:
-            # Display email information
-            print(f"\n{'='*50}")
-            print(f"Processing Email ID: {email_id}")
-            print(f"Subject: {email_data['subject'][:80]}...")
-            print(f"From: {email_data['from']}")
-            print(f"Date: {email_data.get('date', 'Unknown')}") 
-            
-            # Check if we should process this email
-            should_process, reason = self.should_process_email(email_data)
-            
-            if not should_process:
-                print(f"⚠️ Skipping email: {reason}")
-                logger.info(f"Skipped email {email_id}: {reason}")
-                self.stats["emails_skipped"] += 1
-                
-                # Mark as processed even though we didn't respond
-                self.email_tracker.mark_as_processed(
-                    email_id, 
-                    email_data, 
-                    response_sent=False
-                )
+            prepared = self._prepare_email(email_data, verdict)
+            if prepared is None:
                 return True
             
-            # Parse and categorize the email
-            parsed_email = self.email_processor.parse_email_for_response(email_data)
-            category = parsed_email.get('category', 'unknown')
-            
-            # Update statistics
-            self.stats["total_processed"] += 1
-            if category not in self.stats["categories"]:
-                self.stats["categories"][category] = 0
-            self.stats["categories"][category] += 1
-            
-            # Display categorization
-            print(f"Category: {category}")
-            print(f"Sentiment: {parsed_email.get('sentiment', 'neutral')}")
-            print(f"Priority: {parsed_email.get('priority', 'medium')}")
-            
-            # Additional security check for high-risk categories
-            if category == "spam":
-                print("⚠️ Email categorized as spam - not responding")
-                self.email_tracker.mark_as_processed(
-                    email_id, 
-                    parsed_email, 
-                    response_sent=False
-                )
-                return True
+            parsed_email, sanitized_email = prepared
+            return self._respond(email_data, parsed_email, sanitized_email)
             
-            # Sanitize email content before generating response
-            sanitized_email = self.email_filter.sanitize_email_for_response(parsed_email)
+        except Exception as e:
+            self._handle_processing_error(email_data, e)
+            return False
+    
+    def _prepare_email(self, email_data: Dict, verdict: Optional[tuple] = None):
+        """
+        Check, categorize and sanitize an email before its response is generated.
+        
+        Emails that get no response are marked as processed here; the others
+        are in_progress until _send_responses marks them.
+        
+        Args:
+            email_data: The fetched email
+            verdict: Its (should_process, reason) from _accept_batch, which
+                already marked an accepted email as in progress; checked
+                here if None
+        
+        Returns:
+            tuple: (parsed email, sanitized email), or None if the email
+                gets no response
+        """
+        email_id = email_data.get('id')
+        from_address = email_data.get('from', '')
+        
+        # Display email information
+        self._say(
+            f"\n{'='*50}\n"
+            f"Processing Email ID: {email_id}\n"
+            f"Subject: {email_data.get('subject', '')[:80]}...\n"
+            f"From: {from_address}\n"
+            f"Date: {email_data.get('date', 'Unknown')}"
+        )
+        
+        # Check if we should process this email. Checking and accepting is
+        # one step, so that parallel workers see each other's emails.
+        if verdict is not None:
+            should_process, reason = verdict
+        else:
+            with self.state_lock:
+                if email_id in self.in_progress:
+                    self._say("⚠️ Skipping email: Response already in progress")
+                    return None
+                
+                should_process, reason = self.should_process_email(email_data)
+                if should_process:
+                    self.in_progress[email_id] = from_address.lower()
+        
+        if not should_process:
+            self._say(f"⚠️ Skipping email: {reason}")
+            logger.info(f"Skipped email {email_id}: {reason}")
+            self._increment_stat("emails_skipped")
             
-            # Generate response using Gemini API
-            print("\n📝 Generating response using Gemini API...")
-            response = self.gemini_responder.generate_response(
-                sanitized_email, 
-                email_type=category
+            # Mark as processed even though we didn't respond
+            self.email_tracker.mark_as_processed(
+                email_id, 
+                email_data, 
+                response_sent=False
             )
+            return None
+        
+        # Parse, categorize and sanitize the email
+        parsed_email, sanitized_email = self.email_processor.parse_and_sanitize(email_data)
+        category = parsed_email.get('category', 'unknown')
+        
+        # Update statistics
+        self._increment_stat("total_processed", category)
+        
+        # Display categorization
+        self._say(
+            f"Category: {category}\n"
+            f"Sentiment: {parsed_email.get('sentiment', 'neutral')}\n"
+            f"Priority: {parsed_email.get('priority', 'medium')}"
+        )
+        
+        # Additional security check for high-risk categories
+        if category == "spam":
+            self._say("⚠️ Email categorized as spam - not responding")
+            self._mark_as_processed(email_id, parsed_email, response_sent=False)
+            return None
+        
+        return parsed_email, sanitized_email
+    
+    def _respond(self, email_data: Dict, parsed_email: Dict, sanitized_email: Dict,
+                 response: Optional[str] = None) -> bool:
+        """
+        Queue the response to a prepared email for sending.
+        
+        Args:
+            email_data: The fetched email
+            parsed_email: The email as returned by _prepare_email
+            sanitized_email: Its sanitized content, for the Gemini prompt
+            response: A response generated already; generated here if None
+        
+        Returns:
+            bool: Whether a response was queued
+        """
+        email_id = email_data.get('id')
+        to_address = parsed_email['from']
+        
+        try:
+            if response is None:
+                # Generate response using Gemini API
+                self._say("\n📝 Generating response using Gemini API...")
+                response = self.gemini_responder.generate_response(
+                    sanitized_email, 
+                    email_type=parsed_email['category']
+                )
             
             if not response:
                 logger.error(f"Failed to generate response for email {email_id}")
-                self.stats["errors"] += 1
+                self._increment_stat("errors")
+                with self.state_lock:
+                    self.in_progress.pop(email_id, None)
                 return False
             
             # Preview response
             preview = response[:150] + "..." if len(response) > 150 else response
-            print(f"Response preview: {preview}")
+            self._say(f"Response preview: {preview}")
             
             # Create proper reply subject
-            original_subject = parsed_email.get('subject', '')
+            original_subject = parsed_email['subject']
             # Check if it already has "Re:" prefix
-            if original_subject.lower().startswith('re:'):
+            if _REPLY_PREFIX_RE.match(original_subject):
                 reply_subject = original_subject
             else:
                 reply_subject = f"Re: {original_subject}"
             
-            # Send the response with threading information
-            print(f"\n📧 Sending threaded response to {parsed_email['from']}...")
-            
-            # Extract threading information
-            message_id = parsed_email.get('message_id', '')
-            references = parsed_email.get('references', '')
-            
-            # Send with proper threading
-            success = self.email_processor.send_email(
-                to_address=parsed_email['from'],
-                subject=reply_subject,  # Subject in proper field
-                body=response,
-                message_id=message_id,  # Include for threading
-                references=references,   # Include for threading
-                use_html=self.config["use_html_emails"]  # Use HTML formatting
-            )
-            
-            if success:
-                print("✅ Response sent successfully (threaded reply)")
-                self.stats["responses_sent"] += 1
-                logger.info(f"Successfully processed and responded to email {email_id}")
-            else:
-                print("❌ Failed to send response")
-                self.stats["errors"] += 1
-                logger.error(f"Failed to send response for email {email_id}")
-            
-            # Mark as processed
-            self.email_tracker.mark_as_processed(
-                email_id, 
-                parsed_email, 
-                response_sent=success
-            )
+            # Queue the response with threading information
+            self._say(f"\n📧 Queueing threaded response to {to_address}...")
             
-            return success
+            self.send_queue.put((email_id, parsed_email, {
+                "to_address": to_address,
+                "subject": reply_subject,  # Subject in proper field
+                "body": response,
+                "message_id": parsed_email['message_id'],  # Include for threading
+                "references": parsed_email['references'],   # Include for threading
+                "use_html": self.config["use_html_emails"]  # Use HTML formatting
+            }))
+            return True
             
         except Exception as e:
-            logger.error(f"Error processing email {email_id}: {str(e)}", exc_info=True)
-            self.stats["errors"] += 1
+            self._handle_processing_error(email_data, e)
+            return False
+    
+    def _send_responses(self):
+        """
+        Send the queued responses one after another (runs in sender_thread).
+        
+        A failed send is retried after a growing delay. The email is marked
+        as processed once its response is sent or the attempts are used up.
+        """
+        while True:
+            item = self.send_queue.get()
+            if item is None:
+                self.send_queue.task_done()
+                return
             
-            # Mark as processed to avoid retrying problematic emails
+            email_id, parsed_email, send_kwargs = item
+            try:
+                success = False
+                for attempt in range(self.config["send_attempts"]):
+                    if attempt:
+                        time.sleep(2 ** attempt)
+                    # Send with proper threading
+                    success = self.email_processor.send_email(**send_kwargs)
+                    if success:
+                        break
+                
+                if success:
+                    self._say(f"✅ Response to email {email_id} sent successfully (threaded reply)")
+                    self._increment_stat("responses_sent")
+                    logger.info(f"Successfully processed and responded to email {email_id}")
+                else:
+                    self._say(f"❌ Failed to send response to email {email_id}")
+                    self._increment_stat("errors")
+                    logger.error(f"Failed to send response for email {email_id}")
+                
+                # Mark as processed
+                self._mark_as_processed(email_id, parsed_email, response_sent=success)
+            except Exception as e:
+                self._handle_processing_error({**parsed_email, 'id': email_id}, e)
+            finally:
+                self.send_queue.task_done()
+    
+    def _mark_as_processed(self, email_id: str, email_data: Dict, response_sent: bool):
+        """Record an email in the tracker; it stops counting as in progress."""
+        with self.state_lock:
             self.email_tracker.mark_as_processed(
                 email_id, 
                 email_data, 
-                response_sent=False
+                response_sent=response_sent
             )
-            return False
+            self.in_progress.pop(email_id, None)
+    
+    def _handle_processing_error(self, email_data: Dict, error: Exception):
+        """Log an error while processing an email and mark the email as processed."""
+        email_id = email_data.get('id')
+        logger.error(f"Error processing email {email_id}: {str(error)}", exc_info=error)
+        self._increment_stat("errors")
+        
+        # Mark as processed to avoid retrying problematic emails
+        self._mark_as_processed(email_id, email_data, response_sent=False)
+    
+    def process_emails(self, emails: List[Dict]):
+        """
+        Process a batch of emails: with a Gemini Batch API job, with
+        concurrent async Gemini calls, or else in parallel worker threads.
+        
+        The whole batch is checked up front by _accept_batch. In worker
+        threads, emails from the same sender are processed in order by one worker.
+        """
+        verdicts = self._accept_batch(emails)
+        
+        if self.config["use_batch_api"]:
+            self._process_batch(emails, verdicts)
+            return
+        if self.config["use_async_api"]:
+            self._process_async(emails, verdicts)
+            return
+        
+        by_sender = {}
+        for email_data in emails:
+            # pop: a repeated email ID is checked again (and found in progress)
+            by_sender.setdefault(email_data.get('from', '').lower(), []).append(
+                (email_data, verdicts.pop(email_data.get('id'), None))
+            )
+        
+        futures = [
+            self.executor.submit(self._process_sender_emails, sender_emails)
+            for sender_emails in by_sender.values()
+        ]
+        for future in as_completed(futures):
+            future.result()
+    
+    def _process_batch(self, emails: List[Dict], verdicts: Dict[str, tuple]):
+        """
+        Process a batch of emails with one Gemini Batch API job.
+        
+        Urgent requests are answered right away instead of waiting for the
+        job. The responses are sent by the worker threads.
+        
+        Args:
+            emails: The fetched emails
+            verdicts: Their verdicts from _accept_batch, by email ID
+        """
+        futures = []
+        batch = []
+        for email_data in emails:
+            try:
+                prepared = self._prepare_email(email_data, verdicts.pop(email_data.get('id'), None))
+            except Exception as e:
+                self._handle_processing_error(email_data, e)
+                continue
+            if prepared is None:
+                continue
+            
+            parsed_email, sanitized_email = prepared
+            if parsed_email.get('category') == "urgent_request":
+                futures.append(self.executor.submit(self._respond, email_data, parsed_email, sanitized_email))
+            else:
+                batch.append((email_data, parsed_email, sanitized_email))
+        
+        if batch:
+            self._say(f"\n📝 Generating {len(batch)} response(s) with a Gemini batch job...")
+            try:
+                responses = self.gemini_responder.generate_batch_job(
+                    (sanitized_email, parsed_email.get('category', 'unknown'))
+                    for _, parsed_email, sanitized_email in batch
+                )
+            except Exception as e:
+                self._release_batch(batch, e)
+                responses = []
+            futures.extend(
+                self.executor.submit(self._respond, *prepared, response)
+                for prepared, response in zip(batch, responses)
+            )
+        
+        for future in as_completed(futures):
+            future.result()
+    
+    def _process_async(self, emails: List[Dict], verdicts: Dict[str, tuple]):
+        """
+        Process a batch of emails with concurrent async Gemini calls.
+        
+        The API calls of the whole batch overlap on one event loop, so the
+        batch takes about as long as its slowest response, without a thread
+        per request. The responses are sent by the sender thread.
+        
+        Args:
+            emails: The fetched emails
+            verdicts: Their verdicts from _accept_batch, by email ID
+        """
+        batch = []
+        for email_data in emails:
+            try:
+                prepared = self._prepare_email(email_data, verdicts.pop(email_data.get('id'), None))
+            except Exception as e:
+                self._handle_processing_error(email_data, e)
+                continue
+            if prepared is not None:
+                batch.append((email_data, *prepared))
+        
+        if batch:
+            self._say(f"\n📝 Generating {len(batch)} response(s) using Gemini API...")
+            try:
+                responses = self.loop.run_until_complete(self.gemini_responder.generate_batch_async(
+                    (sanitized_email, parsed_email['category']) for _, parsed_email, sanitized_email in batch
+                ))
+            except Exception as e:
+                self._release_batch(batch, e)
+                return
+            for prepared, response in zip(batch, responses):
+                self._respond(*prepared, response)
+    
+    def _release_batch(self, batch: List[tuple], error: Exception):
+        """
+        Log a failure to generate the responses of a batch and take its
+        emails out of in_progress, so that a later cycle fetches them again.
+        
+        Args:
+            batch: (email, parsed email, sanitized email) of each email
+            error: The exception raised while generating
+        """
+        logger.error(f"Error generating responses for {len(batch)} email(s): {str(error)}", exc_info=error)
+        self._increment_stat("errors")
+        with self.state_lock:
+            for email_data, _, _ in batch:
+                self.in_progress.pop(email_data.get('id'), None)
+    
+    def _process_sender_emails(self, emails: List[tuple]):
+        """Process the (email, verdict) pairs of one sender one after another."""
+        for email_data, verdict in emails:
+            self.process_single_email(email_data, verdict)
     
     def display_statistics(self):
         """Display current processing statistics."""
-        print("\n" + "="*50)
-        print("📊 Processing Statistics:")
-        print(f"  Total processed: {self.stats['total_processed']}")
-        print(f"  Responses sent: {self.stats['responses_sent']}")
-        print(f"  Emails skipped: {self.stats['emails_skipped']}")
-        print(f"  Errors: {self.stats['errors']}")
-        
-        if self.stats["categories"]:
-            print("  Categories:")
-            for category, count in self.stats["categories"].items():
-                print(f"    - {category}: {count}")
-        
-        # Get tracker statistics
-        tracker_stats = self.email_tracker.get_processing_stats()
-        print(f"\n  Historical stats (last {self.email_tracker.max_history_days} days):")
-        print(f"    - Total in history: {tracker_stats['total_processed']}")
-        print("="*50)
+        if not self.config["verbose"]:
+            return
+        
+        stats = self.stats
+        now = time.monotonic()
+        self._recent_cycles.append((now, stats['responses_sent']))
+        self._say("\n" + "="*50)
+        self._say("📊 Processing Statistics:")
+        self._say(f"  Total processed: {stats['total_processed']}")
+        self._say(f"  Responses sent: {stats['responses_sent']}")
+        self._say(f"  Emails skipped: {stats['emails_skipped']}")
+        self._say(f"  Errors: {stats['errors']}")
+        
+        # Response rate over the recent cycles
+        (first_time, first_sent), (last_time, last_sent) = self._recent_cycles[0], self._recent_cycles[-1]
+        if last_time > first_time:
+            rate = (last_sent - first_sent) * 60 / (last_time - first_time)
+            self._say(f"  Recent rate: {rate:.1f} responses/min")
+        
+        if stats["categories"]:
+            self._say("  Categories:")
+            for category, count in stats["categories"].items():
+                self._say(f"    - {category}: {count}")
+        
+        # Get tracker statistics (they change slowly, so read them only
+        # every few minutes)
+        if self._cached_tracker_stats is None or now - self._last_tracker_scan > _TRACKER_STATS_INTERVAL:
+            self._cached_tracker_stats = self.email_tracker.get_processing_stats()
+            self._last_tracker_scan = now
+        tracker_stats = self._cached_tracker_stats
+        self._say(f"\n  Historical stats (last {self.email_tracker.max_history_days} days):")
+        self._say(f"    - Total in history: {tracker_stats['total_processed']}")
+        self._say("="*50)
     
     def run(self):
         """
@@ -252,12 +668,15 @@ class EmailAutomationSystem:
         print("="*60)
         print(f"Started at: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"Configuration:")
-        print(f"  - Check interval: {self.config['check_interval']} seconds")
+        print(f"  - Check interval: {self.config['check_interval']}-{self.config['max_check_interval']} seconds (without IMAP IDLE)")
         print(f"  - Max emails per cycle: {self.config['max_emails_per_cycle']}")
+        print(f"  - Worker threads: {self.config['worker_threads']}")
         print(f"  - Days to check: {self.config['days_to_check']} days")  # Show date range
         print(f"  - Spam threshold: {self.config['spam_threshold']}")
         print(f"  - Rate limit: {self.config['max_emails_per_sender']} emails per sender per {self.config['rate_limit_window']}h")
         print(f"  - HTML emails: {self.config['use_html_emails']}")  # Show HTML status
+        print(f"  - Gemini Batch API: {self.config['use_batch_api']}")
+        print(f"  - Async Gemini calls: {self.config['use_async_api']}")
         print("\nPress Ctrl+C to stop the system")
         print("-"*60)
         
@@ -267,68 +686,115 @@ class EmailAutomationSystem:
             while True:
                 try:
                     current_time = datetime.datetime.now().strftime('%H:%M:%S')
-                    print(f"\n🔍 Checking for new emails from last {self.config['days_to_check']} days... ({current_time})")
+                    self._say(f"\n🔍 Checking for new emails from last {self.config['days_to_check']} days... ({current_time})")
                     
-                    # Fetch unread emails with date filtering
-                    emails = self.email_processor.fetch_emails(
-                        limit=self.config["max_emails_per_cycle"],
-                        unread_only=True,
-                        days_back=self.config["days_to_check"]  # Only recent emails
-                    )
+                    # Fetch unread emails, unless the previous cycle fetched them already
+                    next_fetch = self._next_fetch or self.fetch_executor.submit(self._fetch)
+                    self._next_fetch = None
+                    emails = next_fetch.result()
+                    
+                    # A full batch means more may be waiting: fetch the next
+                    # batch while this one is processed
+                    more_waiting = len(emails) >= self.config["max_emails_per_cycle"]
+                    if more_waiting:
+                        self._next_fetch = self.fetch_executor.submit(
+                            self._fetch, {email_data.get('id') for email_data in emails}
+                        )
                     
                     if emails:
-                        print(f"📬 Found {len(emails)} new email(s) from the last {self.config['days_to_check']} days")
+                        self._current_interval = self.config["check_interval"]
+                        self._say(f"📬 Found {len(emails)} new email(s) from the last {self.config['days_to_check']} days")
                         
-                        for email_data in emails:
-                            self.process_single_email(email_data)
+                        self.process_emails(emails)
                         
                         # Display statistics after processing
                         self.display_statistics()
                     else:
-                        print(f"📭 No new emails in the last {self.config['days_to_check']} days")
+                        self._say(f"📭 No new emails in the last {self.config['days_to_check']} days")
                     
-                    # Wait before next check
-                    print(f"\n⏰ Next check in {self.config['check_interval']} seconds...")
-                    time.sleep(self.config['check_interval'])
+                    # Wait for new mail before the next check (IMAP IDLE: the
+                    # server notifies us, nothing is polled meanwhile)
+                    if not more_waiting:
+                        self._say("\n⏰ Waiting for new emails...")
+                        self.email_processor.wait_for_new_mail(
+                            timeout=self.config["idle_timeout"],
+                            poll_interval=self._current_interval
+                        )
+                        if not emails:
+                            self._current_interval = min(self._current_interval * 2, self.config["max_check_interval"])
                     
                 except KeyboardInterrupt:
                     raise  # Re-raise to handle in outer try block
                 except Exception as e:
                     logger.error(f"Error in main loop: {str(e)}", exc_info=True)
-                    print(f"\n❌ Error occurred: {str(e)}")
-                    print("Retrying in 60 seconds...")
+                    self._say(f"\n❌ Error occurred: {str(e)}")
+                    self._say("Retrying in 60 seconds...")
                     time.sleep(60)
         
         except KeyboardInterrupt:
-            print("\n\n🛑 Shutdown requested by user...")
+            self._say("\n\n🛑 Shutdown requested by user...")
             self.shutdown()
     
+    def _fetch(self, exclude=frozenset()) -> List[Dict]:
+        """
+        Fetch recent unread emails that are not being answered already.
+        
+        Args:
+            exclude: IDs of further emails to leave out, e.g. the batch
+                being processed
+        
+        Returns:
+            List of fetched emails
+        """
+        with self.state_lock:
+            exclude = set(exclude).union(self.in_progress)
+        
+        # Fetch unread emails with date filtering
+        return self.email_processor.fetch_emails(
+            limit=self.config["max_emails_per_cycle"],
+            unread_only=True,
+            days_back=self.config["days_to_check"],  # Only recent emails
+            exclude=exclude
+        )
+    
     def shutdown(self):
         """Clean shutdown of the system."""
-        print("\n" + "="*60)
-        print("System Shutdown")
-        print("="*60)
+        self._say("\n" + "="*60)
+        self._say("System Shutdown")
+        self._say("="*60)
         
         # Display final statistics
-        print("Final Statistics:")
-        print(f"  Total emails processed: {self.stats['total_processed']}")
-        print(f"  Responses sent: {self.stats['responses_sent']}")
-        print(f"  Emails skipped: {self.stats['emails_skipped']}")
-        print(f"  Errors encountered: {self.stats['errors']}")
+        stats = self.stats
+        self._say("Final Statistics:")
+        self._say(f"  Total emails processed: {stats['total_processed']}")
+        self._say(f"  Responses sent: {stats['responses_sent']}")
+        self._say(f"  Emails skipped: {stats['emails_skipped']}")
+        self._say(f"  Errors encountered: {stats['errors']}")
         
-        if self.stats["categories"]:
-            print("\n  Categories breakdown:")
-            for category, count in self.stats["categories"].items():
-                print(f"    - {category}: {count}")
+        if stats["categories"]:
+            self._say("\n  Categories breakdown:")
+            for category, count in stats["categories"].items():
+                self._say(f"    - {category}: {count}")
         
         # Get historical statistics
         tracker_stats = self.email_tracker.get_processing_stats()
-        print(f"\n  Historical totals (last {self.email_tracker.max_history_days} days):")
-        print(f"    - Total processed: {tracker_stats['total_processed']}")
-        print(f"    - Responses sent: {tracker_stats['responses_sent']}")
+        self._say(f"\n  Historical totals (last {self.email_tracker.max_history_days} days):")
+        self._say(f"    - Total processed: {tracker_stats['total_processed']}")
+        self._say(f"    - Responses sent: {tracker_stats['responses_sent']}")
         
-        print("\n✨ Thank you for using the Gemini Email Automation System!")
-        print("="*60)
+        # Wait for running workers and queued responses, then log out of the
+        # mail servers, close the history database and save the response cache
+        self.executor.shutdown()
+        self.fetch_executor.shutdown()
+        self.send_queue.put(None)
+        self.sender_thread.join()
+        self.email_processor.close()
+        self.email_tracker.close()
+        self.gemini_responder.close()
+        self.loop.close()
+        
+        self._say("\n✨ Thank you for using the Gemini Email Automation System!")
+        self._say("="*60)
         
         logger.info("Email automation system shut down gracefully")
 
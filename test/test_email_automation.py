@@ -11,16 +11,23 @@ Author: Linda Marin and Sawsan Abdulbari for HAMK Digital and Social Media Analy
 Date: August 2025
 """
 
+import asyncio
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import sys
 import os
+import sqlite3
+import tempfile
+from email.message import EmailMessage
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from email_processor import EmailProcessor
+import gemini_email
 from gemini_email import GeminiEmailResponder
+from email_filter import EmailFilter
+from email_tracker import EmailTracker
 
 class TestEmailCategorization(unittest.TestCase):
     """Test email categorization functionality"""
@@ -101,6 +108,20 @@ class TestEmailCategorization(unittest.TestCase):
         }
         result = self.email_processor.parse_email_for_response(email_data)
         self.assertEqual(result['category'], 'spam')
+    
+    def test_parse_and_sanitize(self):
+        """Test that the sanitized email keeps the parsed fields but not the links"""
+        email_data = {
+            'from': 'John Doe <john@example.com>',
+            'subject': 'Need help',
+            'body': 'I have an issue, see https://example.com/screenshot'
+        }
+        parsed, sanitized = self.email_processor.parse_and_sanitize(email_data)
+        self.assertEqual(parsed['category'], 'product_support')
+        self.assertEqual(sanitized['category'], 'product_support')
+        self.assertEqual(sanitized['sender_name'], 'John Doe')
+        self.assertIn('https://example.com', parsed['body'])
+        self.assertEqual(sanitized['body'], 'I have an issue, see [URL REMOVED]')
 
 class TestGeminiResponder(unittest.TestCase):
     """Test Gemini API response generation"""
@@ -108,7 +129,7 @@ class TestGeminiResponder(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures"""
         # Mock the Gemini API to avoid actual API calls during testing
-        with patch('gemini_email.genai.GenerativeModel'):
+        with patch('gemini_email.genai.Client'):
             self.responder = GeminiEmailResponder()
     
     def test_temperature_selection(self):
@@ -155,6 +176,231 @@ class TestGeminiResponder(unittest.TestCase):
         self.assertIn('step-by-step', prompt.lower())
         self.assertIn('Technical Support Team', prompt)
     
+    def test_prompt_prefix_is_static(self):
+        """Test that the sender name only appears after the shared instructions"""
+        prompt_a = self.responder._create_prompt({'body': 'Broken', 'sender_name': 'Anna'}, 'complaint')
+        prompt_b = self.responder._create_prompt({'body': 'Broken', 'sender_name': 'Ben'}, 'complaint')
+        
+        prefix_a = prompt_a[:prompt_a.index('Anna')]
+        self.assertEqual(prefix_a, prompt_b[:prompt_b.index('Ben')])
+        self.assertIn('apologetic', prefix_a.lower())
+    
+    def test_long_body_trimmed_to_input_budget(self):
+        """Test that an oversized body is cut so the prompt fits max_input_tokens"""
+        self.responder.config = dict(self.responder.config, max_input_tokens=1000)
+        email_content = {'body': 'word ' * 5000, 'priority': 'high'}
+        prompt = self.responder._create_prompt(email_content, 'complaint')
+        
+        self.assertLessEqual(len(prompt), 1000 * 4)
+        self.assertIn('[...truncated...]', prompt)
+        self.assertTrue(prompt.endswith('Priority: high'))
+    
+    def test_clean_response_removes_headers(self):
+        """Test that header lines the model adds are removed from the response"""
+        response = "Subject: Re: Order\n\n  To: you\nDear Anna,\n\nThanks!\n\nDate: today"
+        self.assertEqual(self.responder._clean_response(response), "Dear Anna,\n\nThanks!")
+    
+    def test_identical_email_uses_response_cache(self):
+        """Test that an identical email is answered from the cache, with the new sender's name"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(self.responder.config, response_cache=True, semantic_cache=False,
+                          response_cache_file=os.path.join(temp_dir, 'responses.db'))
+            with patch('gemini_email.genai.Client') as client_class:
+                models = client_class.return_value.models
+                models.generate_content.return_value = MagicMock(text="Dear Anna,\n\nWe are on it.")
+                responder = GeminiEmailResponder(config=config)
+                
+                responder.generate_response({'body': 'Broken', 'sender_name': 'Anna'}, 'complaint')
+                response = responder.generate_response({'body': 'Broken', 'sender_name': 'Ben'}, 'complaint')
+                responder.close()
+            
+            self.assertEqual(models.generate_content.call_count, 1)
+            self.assertEqual(response, "Dear Ben,\n\nWe are on it.")
+    
+    def test_response_cache_tells_apart_subjects(self):
+        """Test that emails with the same body but different subjects are not answered alike"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(self.responder.config, response_cache=True, semantic_cache=False,
+                          response_cache_file=os.path.join(temp_dir, 'responses.db'))
+            with patch('gemini_email.genai.Client') as client_class:
+                models = client_class.return_value.models
+                models.generate_content.side_effect = [
+                    MagicMock(text="Your refund for order 123 is approved."),
+                    MagicMock(text="Your subscription is cancelled."),
+                ]
+                responder = GeminiEmailResponder(config=config)
+                
+                responder.generate_response({'subject': 'Refund order 123', 'body': 'See subject, thanks.'}, 'billing_question')
+                response = responder.generate_response(
+                    {'subject': 'Cancel my subscription', 'body': 'See subject, thanks.'}, 'billing_question'
+                )
+                responder.close()
+            
+            self.assertEqual(response, "Your subscription is cancelled.")
+            self.assertEqual(models.generate_content.call_count, 2)
+    
+    def test_failing_cache_is_a_miss(self):
+        """Test that an email is still answered when the caches fail"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(self.responder.config, response_cache=True, semantic_cache=False,
+                          response_cache_file=os.path.join(temp_dir, 'responses.db'))
+            with patch('gemini_email.genai.Client') as client_class:
+                models = client_class.return_value.models
+                models.generate_content.return_value = MagicMock(text="We are on it.")
+                responder = GeminiEmailResponder(config=config)
+                error = sqlite3.OperationalError("disk I/O error")
+                with patch.object(responder.response_cache, 'get', side_effect=error), \
+                        patch.object(responder.response_cache, 'put', side_effect=error):
+                    response = responder.generate_response({'body': 'Broken'}, 'complaint')
+                responder.close()
+            
+            self.assertEqual(response, "We are on it.")
+    
+    def test_response_cache_replaces_every_form_of_the_name(self):
+        """Test that a cached response never greets the next sender with the first sender's name"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = dict(self.responder.config, response_cache=True, semantic_cache=False,
+                          response_cache_file=os.path.join(temp_dir, 'responses.db'))
+            with patch('gemini_email.genai.Client') as client_class:
+                models = client_class.return_value.models
+                models.generate_content.side_effect = [
+                    MagicMock(text="Dear Anna,\n\nOur Annual plan covers this, Anna Smith."),
+                    MagicMock(text="Dear Ms. Smith,\n\nWe are on it."),
+                    MagicMock(text="Dear Ms. Jones,\n\nWe are on it."),
+                ]
+                responder = GeminiEmailResponder(config=config)
+                
+                responder.generate_response({'body': 'Broken', 'sender_name': 'Anna Smith'}, 'complaint')
+                first_name = responder.generate_response({'body': 'Broken', 'sender_name': 'Bob Jones'}, 'complaint')
+                responder.generate_response({'body': 'Late', 'sender_name': 'Anna Smith'}, 'complaint')
+                last_name = responder.generate_response({'body': 'Late', 'sender_name': 'Bob Jones'}, 'complaint')
+                responder.close()
+            
+            self.assertEqual(first_name, "Dear Bob,\n\nOur Annual plan covers this, Bob Jones.")
+            self.assertEqual(last_name, "Dear Ms. Jones,\n\nWe are on it.")
+            self.assertEqual(models.generate_content.call_count, 3)
+    
+    @unittest.skipIf(gemini_email.np is None, "numpy is not installed")
+    def test_semantic_cache_replaces_every_form_of_the_name(self):
+        """Test that a similar email gets the cached response with its own sender's name"""
+        config = dict(self.responder.config, response_cache=False, semantic_cache=False)
+        with patch('gemini_email.genai.Client') as client_class:
+            models = client_class.return_value.models
+            models.generate_content.side_effect = [
+                MagicMock(text="Dear Anna,\n\nThanks, Anna Smith."),
+                MagicMock(text="Dear Ms. Smith,\n\nWe are on it."),
+                MagicMock(text="Dear Ms. Jones,\n\nWe are on it."),
+            ]
+            responder = GeminiEmailResponder(config=config)
+            responder.semantic_cache = gemini_email._SemanticCache()
+            vectors = {'Broken': [1.0, 0.0], 'Late': [0.0, 1.0]}
+            with patch.object(responder.semantic_cache, 'embed',
+                              side_effect=lambda text: gemini_email.np.array(vectors[text.split()[-1]], dtype='float32')) as embed:
+                responder.generate_response({'subject': 'Help', 'body': 'Broken', 'sender_name': 'Anna Smith'}, 'complaint')
+                self.assertEqual(embed.call_args[0][0], "Help\nBroken")
+                first_name = responder.generate_response({'body': 'Broken', 'sender_name': 'Bob Jones'}, 'complaint')
+                responder.generate_response({'body': 'Late', 'sender_name': 'Anna Smith'}, 'complaint')
+                last_name = responder.generate_response({'body': 'Late', 'sender_name': 'Bob Jones'}, 'complaint')
+        
+        self.assertEqual(first_name, "Dear Bob,\n\nThanks, Bob Jones.")
+        self.assertEqual(last_name, "Dear Ms. Jones,\n\nWe are on it.")
+        self.assertEqual(models.generate_content.call_count, 3)
+    
+    def test_batch_answers_duplicate_bodies_once(self):
+        """Test that emails with the same subject and body in a batch share one API call, others do not"""
+        config = dict(self.responder.config, response_cache=False, semantic_cache=False)
+        with patch('gemini_email.genai.Client') as client_class:
+            models = client_class.return_value.models
+            models.generate_content.side_effect = [
+                MagicMock(text="Dear Anna,\n\nWe are on it."),
+                MagicMock(text="Dear Cara,\n\nYour refund is on its way."),
+            ]
+            responder = GeminiEmailResponder(config=config)
+            
+            responses = responder.generate_batch([
+                ({'subject': 'Help', 'body': 'Broken', 'sender_name': 'Anna'}, 'complaint'),
+                ({'subject': 'Help', 'body': 'Broken', 'sender_name': 'Ben'}, 'complaint'),
+                ({'subject': 'Help', 'body': 'Broken', 'sender_name': 'Anna'}, 'complaint'),
+                ({'subject': 'Refund', 'body': 'Broken', 'sender_name': 'Cara'}, 'complaint'),
+            ], max_workers=1)
+        
+        self.assertEqual(models.generate_content.call_count, 2)
+        self.assertEqual(responses, [
+            "Dear Anna,\n\nWe are on it.", "Dear Ben,\n\nWe are on it.", "Dear Anna,\n\nWe are on it.",
+            "Dear Cara,\n\nYour refund is on its way."
+        ])
+    
+    def test_batch_asks_again_when_the_response_cannot_be_reused(self):
+        """Test that a duplicate body gets its own response if the first one names its sender"""
+        config = dict(self.responder.config, response_cache=False, semantic_cache=False)
+        with patch('gemini_email.genai.Client') as client_class:
+            models = client_class.return_value.models
+            models.generate_content.side_effect = [
+                MagicMock(text="Dear Ms. Smith,\n\nWe are on it."),
+                MagicMock(text="Dear Mr. Jones,\n\nWe are on it."),
+            ]
+            responder = GeminiEmailResponder(config=config)
+            
+            responses = responder.generate_batch([
+                ({'body': 'Broken', 'sender_name': 'Anna Smith'}, 'complaint'),
+                ({'body': 'Broken', 'sender_name': 'Bob Jones'}, 'complaint'),
+                ({'body': 'Broken', 'sender_name': 'Anna Smith'}, 'complaint'),
+            ])
+        
+        self.assertEqual(models.generate_content.call_count, 2)
+        self.assertEqual(responses, [
+            "Dear Ms. Smith,\n\nWe are on it.", "Dear Mr. Jones,\n\nWe are on it.",
+            "Dear Ms. Smith,\n\nWe are on it."
+        ])
+    
+    def test_async_batch_answers_duplicates_once(self):
+        """Test that the async batch shares one API call between duplicates like generate_batch"""
+        config = dict(self.responder.config, response_cache=False, semantic_cache=False)
+        with patch('gemini_email.genai.Client') as client_class:
+            models = client_class.return_value.aio.models
+            models.generate_content = AsyncMock(side_effect=[
+                MagicMock(text="Dear Anna,\n\nWe are on it."),
+                MagicMock(text="Dear Cara,\n\nYour refund is on its way."),
+            ])
+            responder = GeminiEmailResponder(config=config)
+            
+            responses = asyncio.run(responder.generate_batch_async([
+                ({'subject': 'Help', 'body': 'Broken', 'sender_name': 'Anna'}, 'complaint'),
+                ({'subject': 'Refund', 'body': 'Broken', 'sender_name': 'Cara'}, 'complaint'),
+                ({'subject': 'Help', 'body': 'Broken', 'sender_name': 'Ben'}, 'complaint'),
+            ]))
+        
+        self.assertEqual(models.generate_content.call_count, 2)
+        self.assertEqual(responses, [
+            "Dear Anna,\n\nWe are on it.", "Dear Cara,\n\nYour refund is on its way.",
+            "Dear Ben,\n\nWe are on it."
+        ])
+    
+    def test_rate_limit_spaces_requests_after_burst(self):
+        """Test that the token bucket allows a burst, then waits for one token"""
+        with patch('gemini_email.time.sleep') as sleep:
+            for _ in range(self.responder.max_requests_per_minute):
+                self.responder._handle_rate_limiting()
+            sleep.assert_not_called()
+            
+            self.responder._handle_rate_limiting()
+            sleep.assert_called_once()
+            self.assertLessEqual(sleep.call_args[0][0], 60 / self.responder.max_requests_per_minute)
+    
+    def test_stream_response_removes_headers(self):
+        """Test that streamed chunks are cleaned like a complete response"""
+        text = "Subject: Re: Order\n\nDear Anna,\n\nThanks for waiting.\n"
+        chunks = [MagicMock(text=text[i:i + 7]) for i in range(0, len(text), 7)]
+        config = dict(self.responder.config, response_cache=False, semantic_cache=False)
+        with patch('gemini_email.genai.Client') as client_class:
+            client_class.return_value.models.generate_content_stream.return_value = iter(chunks)
+            responder = GeminiEmailResponder(config=config)
+            
+            pieces = list(responder.stream_response({'body': 'Where is my order?'}, 'customer_inquiry'))
+        
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(''.join(pieces), responder._clean_response(text))
+    
     def test_fallback_response(self):
         """Test fallback response generation"""
         email_content = {
@@ -200,6 +446,83 @@ class TestEmailSenderName(unittest.TestCase):
         name = self.email_processor._extract_sender_name(from_address)
         self.assertIsNone(name)
 
+class TestEmailBody(unittest.TestCase):
+    """Test email body extraction"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.email_processor = EmailProcessor()
+    
+    def test_html_only_body(self):
+        """Test that HTML-only emails are converted to plain text"""
+        msg = EmailMessage()
+        msg.set_content('placeholder')
+        msg.add_alternative(
+            '<html><head><style>p { color: red; }</style></head>'
+            '<body><p>Hello <b>there</b> &amp; welcome</p><script>alert(1)</script></body></html>',
+            subtype='html'
+        )
+        # Drop the plain text part so only HTML is left
+        msg.get_payload().pop(0)
+        
+        body = self.email_processor._get_email_body(msg)
+        self.assertEqual(body.strip(), 'Hello there & welcome')
+    
+    def test_decode_header(self):
+        """Test that plain and RFC 2047 encoded headers are decoded"""
+        self.assertEqual(self.email_processor._decode_header('Order status'), 'Order status')
+        self.assertEqual(self.email_processor._decode_header('=?utf-8?q?Tilaus_=C3=A4?='), 'Tilaus ä')
+        self.assertEqual(self.email_processor._decode_header(None), '')
+
+class TestFetchResponse(unittest.TestCase):
+    """Test parsing of IMAP FETCH responses"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.email_processor = EmailProcessor()
+    
+    def test_sections_grouped_by_uid(self):
+        """Test that sections are keyed by UID wherever the server puts it"""
+        data = [
+            (b'1 (UID 101 BODY[HEADER] {9}', b'Subject: a'),
+            (b' BODY[1] {5}', b'hello'),
+            b')',
+            (b'2 (BODY[HEADER] {9}', b'Subject: b'),
+            b' UID 102)',
+        ]
+        fetched = self.email_processor._parse_fetch_response(data)
+        self.assertEqual(fetched, {
+            b'101': {'BODY[HEADER]': b'Subject: a', 'BODY[1]': b'hello'},
+            b'102': {'BODY[HEADER]': b'Subject: b'},
+        })
+    
+    def test_fetch_without_uid_is_skipped(self):
+        """Test that an unsolicited FETCH cannot overwrite a message whose UID equals its sequence number"""
+        data = [
+            (b'1 (UID 2 BODY[HEADER] {9}', b'Subject: a'),
+            b')',
+            (b'2 (BODY[HEADER] {9}', b'Subject: b'),
+            b')',
+        ]
+        fetched = self.email_processor._parse_fetch_response(data)
+        self.assertEqual(fetched, {b'2': {'BODY[HEADER]': b'Subject: a'}})
+    
+    def test_select_skips_excluded_before_limit(self):
+        """Test that excluded emails do not use up the fetch limit"""
+        email_ids = self.email_processor._select_email_ids(b'1 2 3 4', 2, '7', exclude={'7:4'})
+        self.assertEqual(email_ids, [b'3', b'2'])
+    
+    def test_wait_returns_if_mail_arrived_since_fetch(self):
+        """Test that mail arriving between the fetch and IDLE is not waited for"""
+        mail = MagicMock(capabilities=('IMAP4REV1', 'IDLE'))
+        mail.select.return_value = ('OK', [b'4'])
+        mail.response.side_effect = lambda name: (name, [b'7' if name == 'UIDVALIDITY' else b'11'])
+        self.email_processor._imap = mail
+        self.email_processor._mailbox_state['inbox'] = ('7', b'10', b'3')
+        
+        self.assertTrue(self.email_processor.wait_for_new_mail(timeout=1))
+        mail.send.assert_not_called()
+
 class TestPriorityDetermination(unittest.TestCase):
     """Test email priority determination"""
     
@@ -243,6 +566,109 @@ class TestPriorityDetermination(unittest.TestCase):
         priority = self.email_processor._determine_priority(email_data, 'feature_request', 'positive')
         self.assertEqual(priority, 'low')
 
+class TestEmailFilter(unittest.TestCase):
+    """Test spam filtering"""
+    
+    def test_score_batch_matches_single_scores(self):
+        """Test batch scoring returns the same scores as scoring one by one"""
+        emails = [
+            {'from': 'friend@example.com', 'subject': 'Lunch', 'body': 'See you at noon'},
+            {'from': 'winner@lottery.biz', 'subject': 'Claim your prize', 'body': 'Free money at bit.ly/x'},
+            {'from': 'noreply@service.com', 'subject': 'Update', 'body': 'Your report is ready'},
+        ]
+        scores = EmailFilter.score_batch(emails)
+        
+        self.assertEqual(len(scores), len(emails))
+        for email_data, score in zip(emails, scores):
+            self.assertEqual(score, EmailFilter.calculate_spam_score(email_data)[0])
+        self.assertEqual(scores[0], 0.0)
+        self.assertGreaterEqual(scores[1], 0.5)
+    
+    def test_excessive_capitalization(self):
+        """Test that shouting subjects are detected"""
+        email_data = {'from': 'user@example.com', 'subject': 'READ THIS NOW', 'body': 'Hello'}
+        score, reasons = EmailFilter.calculate_spam_score(email_data)
+        self.assertIn("Excessive capitalization", reasons)
+        self.assertAlmostEqual(score, 0.2)
+    
+    def test_cached_verdict_depends_on_body(self):
+        """Test that a repeated email gets the same verdict and a changed body is checked again"""
+        ham = {'from': 'user@example.com', 'subject': 'Order', 'body': 'Where is my order?'}
+        spam = dict(ham, body='Claim your lottery winnings, winner! Get rich with free money at bit.ly/x')
+        
+        self.assertEqual(EmailFilter.should_skip_email(ham), (False, ""))
+        self.assertEqual(EmailFilter.should_skip_email(dict(ham)), (False, ""))
+        self.assertTrue(EmailFilter.should_skip_email(spam)[0])
+    
+    def test_sanitize_removes_dangerous_content(self):
+        """Test that links and script/data URIs are stripped from the body"""
+        email_data = {
+            'body': 'See https://evil.example/x and javascript:alert(1) '
+                    'and data:text/html;base64,PHNjcmlwdD4= ok'
+        }
+        body = EmailFilter.sanitize_email_for_response(email_data)['body']
+        self.assertEqual(
+            body,
+            'See [URL REMOVED] and [SCRIPT REMOVED] and [DATA URI REMOVED] ok'
+        )
+
+class TestEmailTracker(unittest.TestCase):
+    """Test processed email history"""
+    
+    def setUp(self):
+        """Set up a tracker with a temporary history database"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.tracker = EmailTracker(os.path.join(self.temp_dir.name, 'history.json'))
+    
+    def tearDown(self):
+        """Close the database and remove the temporary directory"""
+        self.tracker.close()
+        self.temp_dir.cleanup()
+    
+    def test_mark_and_count(self):
+        """Test that processed emails are remembered and counted per sender"""
+        self.assertFalse(self.tracker.is_processed('1'))
+        
+        self.tracker.mark_as_processed('1', {'from': 'User@Example.com', 'category': 'complaint'})
+        self.tracker.mark_as_processed('2', {'from': 'user@example.com'}, response_sent=False)
+        
+        self.assertTrue(self.tracker.is_processed('1'))
+        self.assertEqual(self.tracker.count_sender_emails('USER@example.com'), 2)
+        self.assertEqual(self.tracker.get_recent_senders(), {'user@example.com'})
+        
+        stats = self.tracker.get_processing_stats()
+        self.assertEqual(stats['total_processed'], 2)
+        self.assertEqual(stats['responses_sent'], 1)
+        self.assertEqual(stats['categories'], {'complaint': 1, 'unknown': 1})
+    
+    def test_sender_count_after_first_query(self):
+        """Test that sender counts kept in memory follow new and repeated marks"""
+        self.tracker.mark_as_processed('1', {'from': 'user@example.com'})
+        self.assertEqual(self.tracker.count_sender_emails('user@example.com'), 1)
+        
+        self.tracker.mark_as_processed('2', {'from': 'User@example.com'})
+        self.tracker.mark_as_processed('2', {'from': 'user@example.com'}, response_sent=False)
+        self.assertEqual(self.tracker.count_sender_emails('user@example.com'), 2)
+        self.assertEqual(self.tracker.count_sender_emails('user@example.com', hours=48), 2)
+    
+    def test_filter_unprocessed(self):
+        """Test that processed emails are dropped and order is kept"""
+        self.tracker.mark_as_processed('7:2', {'from': 'user@example.com'})
+        remaining = self.tracker.filter_unprocessed(['7:3', '7:2', '7:1'])
+        self.assertEqual(remaining, ['7:3', '7:1'])
+    
+    def test_count_sender_emails_batch(self):
+        """Test that several senders are counted at once, including unknown ones"""
+        self.tracker.mark_as_processed('1', {'from': 'a@example.com'})
+        self.tracker.mark_as_processed('2', {'from': 'a@example.com'})
+        self.tracker.mark_as_processed('3', {'from': 'b@example.com'})
+        
+        expected = {'a@example.com': 2, 'b@example.com': 1, 'c@example.com': 0}
+        senders = ['A@example.com', 'b@example.com', 'c@example.com', 'a@example.com']
+        self.assertEqual(self.tracker.count_sender_emails_batch(senders), expected)
+        self.assertEqual(self.tracker.count_sender_emails_batch(senders, hours=48), expected)
+        self.assertEqual(self.tracker.are_processed(['3', '4', '1']), {'1', '3'})
+
 def run_tests():
     """Run all tests and display results"""
     # Create test suite
@@ -253,7 +679,11 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestEmailCategorization))
     suite.addTests(loader.loadTestsFromTestCase(TestGeminiResponder))
     suite.addTests(loader.loadTestsFromTestCase(TestEmailSenderName))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmailBody))
+    suite.addTests(loader.loadTestsFromTestCase(TestFetchResponse))
     suite.addTests(loader.loadTestsFromTestCase(TestPriorityDetermination))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmailFilter))
+    suite.addTests(loader.loadTestsFromTestCase(TestEmailTracker))
     
     # Run tests with detailed output
     runner = unittest.TextTestRunner(verbosity=2)